@@ -1,6 +1,7 @@
 from __future__ import annotations
 from telnetlib import BRK
 
+import io
 import requests
 import os
 import re
@@ -8,7 +9,7 @@ import sys
 import math
 
 from os import path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterator, Optional
 
 
 sys.path.append(path.join('..', '..', 'src', 'python3'))
@@ -16,17 +17,30 @@ sys.path.append(path.join('..', '..', 'src', 'python3'))
 from nnlp import Fst, Segmenter
 from nnlp.symbol import BRK_SYM, EPS_SYM, escape_symbol, is_special_symbol
 from nnlp.symbol import CAP_SYM, UNK_SYM
-from nnlp_tools.util import lexicon_add_ilabel_selfloop
-from nnlp_tools import build_lexicon_fst
+from nnlp_tools.util import iter_lexicon_add_ilabel_selfloop, prune_lexicon
+from nnlp_tools import Pipeline, Stage, build_lexicon_fst
+from nnlp_tools.evaluate import evaluate_agreement
 from nnlp_tools.mutable_fst import MutableFst
 
 if TYPE_CHECKING:
-    from nnlp_tools.lexicon_fst_builder import Lexicon
+    from nnlp_tools.lexicon_fst_builder import LexiconEntry
 
 REMOTE_DICT_URL = 'https://github.com/fxsjy/jieba/raw/67fa2e36e72f69d9134b8a1037b83fbb070b9775/extra_dict/'
 LOCAL_DIR = 'exp'
 UNK_WEIGHT = 10
 
+# number of multi-character words kept in the pruned model
+PRUNE_TOP_N = 20000
+
+EVAL_SENTENCES = [
+    '南京市长江大桥',
+    '研究生命的起源',
+    '女朋友很重要吗',
+    '北京大学生前来应聘',
+    '长春市长春药店',
+    '你好hello你好现在是北京时间早上8点20左右',
+]
+
 def download_file(url: str, filename: str):
     '''
     download a file from url to filename
@@ -65,27 +79,28 @@ def download_dict(filename: str) -> None:
         sys.exit(22)
 
 
-def read_jiebadict_to_lexicon(filename: str) -> Lexicon:
-    ''' read jieba dict and convert it to Lexicon
+def read_jiebadict_to_lexicon(filename: str) -> Iterator[LexiconEntry]:
+    ''' read jieba dict and convert it to Lexicon, yields the entries one by
+    one. The file is read twice (total count first, then the entries), so it
+    is never loaded into memory. Repeated words are yielded as they are, and
+    sort_lexicon() keeps the one with the largest count
     '''
-    lexicon: Lexicon = []
-    freq = {}
+    total_count = 0
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            row = line.strip().split()
+            total_count += int(row[1])
+
     with open(filename, encoding='utf-8') as f:
         for line in f:
             row = line.strip().split()
             word = row[0]
             count = int(row[1])
-            freq[word] = count
-
-    total_count = sum(freq.values())
-    for word, count in freq.items():
-        lexicon.append((
-            escape_symbol(word),
-            tuple(map(escape_symbol, word)),
-            -math.log(count / total_count),
-        ))
-    
-    return lexicon
+            yield (
+                escape_symbol(word),
+                tuple(map(escape_symbol, word)),
+                -math.log(count / total_count),
+            )
 
 def build_breaker_fst(lexicon_fst: MutableFst) -> MutableFst:
     ''' build breaker FST according to lexicon FST. Breaker FST outputs <brk>
@@ -93,28 +108,55 @@ def build_breaker_fst(lexicon_fst: MutableFst) -> MutableFst:
     '''
     breaker_fst = MutableFst(isymbols=lexicon_fst._osymbols, name="B")
     state_1 = breaker_fst.create_state()
-    for _, symbol in lexicon_fst._osymbols:
-        if not is_special_symbol(symbol):
-            breaker_fst.add_arc(0, state_1, symbol, symbol)
+    symbols = [
+        symbol for _, symbol in lexicon_fst._osymbols
+        if not is_special_symbol(symbol)
+    ]
+    breaker_fst.add_arcs([0] * len(symbols), [state_1] * len(symbols),
+                         symbols, symbols)
     
     breaker_fst.add_arc(state_1, 0, EPS_SYM, BRK_SYM)
     breaker_fst.set_final_state(0)
 
     return breaker_fst
 
-def postprocess_fst(fst: MutableFst):
+def build_lexicon(filename: str, top_n: Optional[int] = None) -> MutableFst:
+    ''' build lexicon FST from jieba dict, only the top_n multi-character words
+    are kept if top_n is set '''
+    lexicon = read_jiebadict_to_lexicon(filename)
+    if top_n is not None:
+        lexicon = prune_lexicon(lexicon, top_n=top_n)
+    lexicon = iter_lexicon_add_ilabel_selfloop(lexicon)
+    return build_lexicon_fst(lexicon, minimal=True)
+
+
+def compose_breaker(fst: MutableFst) -> MutableFst:
+    ''' compose lexicon FST with its breaker FST '''
+    return fst.compose(build_breaker_fst(fst), inplace=True)
+
+
+def postprocess_fst(fst: MutableFst) -> MutableFst:
     ''' postprocesses the wordseg FST, adding rules for handling English words
     and numbers
     '''
-    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_."
+    alphabet = list("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.")
+    n = len(alphabet)
     state_c1 = fst.create_state()
-    for ch in alphabet:
-        fst.add_arc(0, state_c1, ch, ch, UNK_WEIGHT)
-        fst.add_arc(state_c1, state_c1, ch, ch)
+    fst.add_arcs([0] * n + [state_c1] * n, [state_c1] * (n * 2), alphabet * 2, alphabet * 2,
+                 [UNK_WEIGHT] * n + [0] * n)
     fst.add_arc(state_c1, 0, EPS_SYM, BRK_SYM)
 
-    for sym in [r'\s', r'\t', r'\r', r'\n']:
-        fst.add_arc(0, 0, sym, BRK_SYM)
+    spaces = [r'\s', r'\t', r'\r', r'\n']
+    fst.add_arcs([0] * len(spaces), [0] * len(spaces), spaces, [BRK_SYM] * len(spaces))
+
+    # add selfloop for <unk> -> <capture> <brk>
+    state_u1 = fst.create_state()
+    final_states = list(fst.final_states().keys())
+    n = len(final_states)
+    fst.add_arcs(final_states, [state_u1] * n, [UNK_SYM] * n, [CAP_SYM] * n, [10] * n)
+    fst.add_arc(state_u1, 0, EPS_SYM, BRK_SYM)
+
+    return fst
 
 
 def e2e_test():
@@ -131,52 +173,51 @@ def e2e_test():
     assert segmenter.segment_string('"233" hello-world i_0,AAC ') == ['"', '233', '"', 'hello-world', 'i_0', ',', 'AAC']
 
 
+def build_fst(dict_file: str, top_n: Optional[int] = None) -> MutableFst:
+    ''' build the wordseg FST from jieba dict, see build_lexicon() for top_n
+    '''
+    pipeline = Pipeline([
+        Stage('L', build_lexicon, [dict_file], filename=dict_file, top_n=top_n),
+        Stage('LB', compose_breaker),
+        Stage('det', MutableFst.determinize, inplace=True),
+        Stage('rds', MutableFst.rmdisambig, inplace=True),
+        Stage('min', MutableFst.minimize, allow_nondet=True, inplace=True),
+        Stage('post', postprocess_fst),
+        Stage('opt', MutableFst.optimize_for_decoding, inplace=True),
+    ], cache_dir=path.join(LOCAL_DIR, 'cache'), verbose=True)
+    return pipeline.run()
+
+
+def evaluate(fst: MutableFst, dict_file: str) -> None:
+    ''' evaluate the agreement of the pruned model with fst '''
+    pruned_fst = build_fst(dict_file, top_n=PRUNE_TOP_N)
+    agreement = evaluate_agreement(Fst.from_json(io.StringIO(fst.to_json())),
+                                   Fst.from_json(io.StringIO(pruned_fst.to_json())),
+                                   EVAL_SENTENCES)
+    print(f'pruned model with top {PRUNE_TOP_N} words: {agreement}')
+
+
 def run():
     ''' main function of run.py
     '''
     prepare_env()
     download_dict('dict.txt.small')
     print('read dict.txt.small')
-    lexicon = read_jiebadict_to_lexicon(path.join(LOCAL_DIR, 'dict.txt.small'))
-    lexicon = lexicon_add_ilabel_selfloop(lexicon)
-    fst = build_lexicon_fst(lexicon)
-    fst.print_info()
-
-    fst_B = build_breaker_fst(fst)
-    fst_B.print_info()
-
-    fst = fst.compose(fst_B)
-    fst.print_info()
-
-    fst = fst.determinize()
-    fst.print_info()
-    fst = fst.rmdisambig()
-    fst.print_info()
-    fst = fst.rmepslocal()
-    fst.print_info()
-    fst = fst.minimize(allow_nondet=True)
-    fst.print_info()
-
-    # add rules for numbers, English words and spaces
-    print(f'postprocess {fst.name}')
-    postprocess_fst(fst)
-    fst.print_info()
+    dict_file = path.join(LOCAL_DIR, 'dict.txt.small')
+    fst = build_fst(dict_file)
 
-    # add selfloop for <unk> -> <capture> <brk>
-    state_u1 = fst.create_state()
-    for final_state in fst.final_states().keys():
-        fst.add_arc(final_state, state_u1, UNK_SYM, CAP_SYM, 10)
-    fst.add_arc(state_u1, 0, EPS_SYM, BRK_SYM)
-    
     json_file = path.join(LOCAL_DIR, 'wordseg.json')
     print(f'save to {json_file}')
     with open(json_file, 'w', encoding='utf-8') as f:
-        f.write(fst.to_json())
+        fst.write_json(f)
     
     print('start e2e test')
     e2e_test()
     print('success')
 
+    print('evaluate pruned model')
+    evaluate(fst, dict_file)
+
 if __name__ == '__main__':
     run()
 
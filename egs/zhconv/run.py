@@ -14,7 +14,8 @@ sys.path.append(path.join('..', '..', 'src', 'python3'))
 from nnlp import Fst, Converter
 from nnlp.symbol import CAP_SYM, UNK_SYM
 from nnlp_tools.util import lexicon_add_ilabel_selfloop
-from nnlp_tools import build_lexicon_fst
+from nnlp_tools import Pipeline, Stage, build_lexicon_fst
+from nnlp_tools.mutable_fst import MutableFst
 
 if TYPE_CHECKING:
     from nnlp_tools.lexicon_fst_builder import Lexicon
@@ -74,6 +75,19 @@ def read_rules() -> Lexicon:
 
     return lexicon
 
+def build_lexicon() -> MutableFst:
+    ''' build lexicon FST from the rules '''
+    lexicon = read_rules()
+    lexicon = lexicon_add_ilabel_selfloop(lexicon)
+    return build_lexicon_fst(lexicon)
+
+def add_unk_selfloop(fst: MutableFst) -> MutableFst:
+    ''' add selfloop for <unk> -> <capture> '''
+    final_states = list(fst.final_states().keys())
+    n = len(final_states)
+    fst.add_arcs(final_states, [0] * n, [UNK_SYM] * n, [CAP_SYM] * n, [10] * n)
+    return fst
+
 def e2e_test():
     fst = Fst.from_json('exp/zhconv_t2s.json')
     converter = Converter(fst)
@@ -93,27 +107,20 @@ def run() -> None:
 
     prepare_env()
     download_rules()
-    lexicon = read_rules()
-    lexicon = lexicon_add_ilabel_selfloop(lexicon)
-    fst = build_lexicon_fst(lexicon)
-    fst.print_info()
-    fst = fst.determinize()
-    fst.print_info()
-    fst = fst.rmdisambig()
-    fst.print_info()
-    fst = fst.rmepslocal()
-    fst.print_info()
-    fst = fst.minimize(allow_nondet=True)
-    fst.print_info()
-
-    # add selfloop for <unk> -> <capture>
-    for final_state in fst.final_states().keys():
-        fst.add_arc(final_state, 0, UNK_SYM, CAP_SYM, 10)
-    
+    pipeline = Pipeline([
+        Stage('L', build_lexicon, [RULE_PATH]),
+        Stage('det', MutableFst.determinize, inplace=True),
+        Stage('rds', MutableFst.rmdisambig, inplace=True),
+        Stage('min', MutableFst.minimize, allow_nondet=True, inplace=True),
+        Stage('unk', add_unk_selfloop),
+        Stage('opt', MutableFst.optimize_for_decoding, inplace=True),
+    ], cache_dir=path.join('exp', 'cache'), verbose=True)
+    fst = pipeline.run()
+
     json_file = path.join('exp', 'zhconv_t2s.json')
     print(f'save to {json_file}')
     with open(json_file, 'w', encoding='utf-8') as f:
-        f.write(fst.to_json())
+        fst.write_json(f)
 
     e2e_test()
     print(f'e2e test success')
@@ -0,0 +1,81 @@
+''' benchmark of FstDecoder on a generated segmentation FST, before and after
+MutableFst.optimize_for_decoding(). The FST is built like egs/wordseg: the
+lexicon FST is determinized, its disambig symbols are removed and it's
+minimized, then a word break is appended after each word.
+Usage:
+    python3 -m benchmark.bench_decoding '''
+from __future__ import annotations
+
+import io
+import math
+import random
+import time
+
+from nnlp.fst import Fst
+from nnlp.segmenter import Segmenter
+from nnlp.symbol import BRK_SYM, EPS_SYM
+from nnlp_tools.lexicon_fst_builder import build_lexicon_fst
+from nnlp_tools.mutable_fst import MutableFst
+from nnlp_tools.util import iter_lexicon_add_ilabel_selfloop
+
+
+def generate_lexicon(num_words: int) -> list[tuple[str, tuple[str, ...], float]]:
+    ''' generate the lexicon of num_words words with zipf distribution '''
+
+    rand = random.Random(1)
+    chars = [chr(0x4e00 + i) for i in range(2000)]
+    words: set[str] = set(chars)
+    while len(words) < num_words:
+        words.add(''.join(rand.choice(chars) for _ in range(rand.randint(2, 4))))
+
+    total = sum(1 / rank for rank in range(1, num_words + 1))
+    return [(word, tuple(word), -math.log(1 / rank / total))
+            for rank, word in enumerate(sorted(words), 1)]
+
+
+def build_fst(lexicon: list[tuple[str, tuple[str, ...], float]]) -> MutableFst:
+    ''' build the segmentation FST '''
+
+    fst = build_lexicon_fst(iter_lexicon_add_ilabel_selfloop(lexicon), minimal=True)
+    breaker_fst = MutableFst(isymbols=fst._osymbols, name='B')
+    state_1 = breaker_fst.create_state()
+    symbols = [symbol for _, symbol in fst._osymbols if symbol != EPS_SYM]
+    breaker_fst.add_arcs([0] * len(symbols), [state_1] * len(symbols), symbols, symbols)
+    breaker_fst.add_arc(state_1, 0, EPS_SYM, BRK_SYM)
+    breaker_fst.set_final_state(0)
+
+    fst.compose(breaker_fst, inplace=True)
+    fst.determinize(inplace=True).rmdisambig(inplace=True)
+    fst.minimize(allow_nondet=True, inplace=True)
+    return fst
+
+
+def bench(fst: MutableFst, sentences: list[str]) -> tuple[float, list[list[str]]]:
+    ''' returns characters per second and the segmentation results '''
+
+    segmenter = Segmenter(Fst.from_json(io.StringIO(fst.to_json())))
+    start_time = time.perf_counter()
+    results = [segmenter.segment_string(sentence) for sentence in sentences]
+    seconds = time.perf_counter() - start_time
+
+    return sum(map(len, sentences)) / seconds, results
+
+
+if __name__ == '__main__':
+    lexicon = generate_lexicon(50000)
+    fst = build_fst(lexicon)
+
+    rand = random.Random(2)
+    words = [word for word, _, _ in lexicon]
+    sentences = [''.join(rand.choices(words, k=20)) for _ in range(200)]
+
+    print(f'{"model":>10} {"states":>8} {"arcs":>8} {"chars/s":>10}')
+    chars_per_second, results = bench(fst, sentences)
+    print(f'{"baseline":>10} {fst.num_states():>8} {fst.num_arcs():>8} {chars_per_second:>10.0f}')
+
+    fst.optimize_for_decoding(inplace=True)
+    chars_per_second, optimized_results = bench(fst, sentences)
+    print(f'{"optimized":>10} {fst.num_states():>8} {fst.num_arcs():>8} {chars_per_second:>10.0f}')
+
+    agreement = sum(a == b for a, b in zip(results, optimized_results)) / len(sentences)
+    print(f'agreement: {agreement:.2%}')
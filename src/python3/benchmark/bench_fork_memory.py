@@ -0,0 +1,78 @@
+''' benchmark of the private memory of forked workers, with the model loaded
+by Fst.from_binary() or nnlp.flat_fst.preload() in the parent process. Each
+worker segments the sentences and reports its private memory from
+/proc/self/smaps_rollup, so it only runs on Linux.
+Usage:
+    python3 -m benchmark.bench_fork_memory '''
+from __future__ import annotations
+
+import os
+import random
+import tempfile
+
+from nnlp.flat_fst import freeze_heap, preload
+from nnlp.fst import Fst
+from nnlp.segmenter import Segmenter
+
+from .bench_decoding import build_fst, generate_lexicon
+
+NUM_WORKERS = 4
+
+
+def private_memory() -> int:
+    ''' returns the private memory of this process in KB '''
+
+    with open('/proc/self/smaps_rollup', encoding='utf-8') as f:
+        return sum(int(line.split()[1]) for line in f if line.startswith('Private_'))
+
+
+def run_workers(fst: Fst, sentences: list[str]) -> list[int]:
+    ''' fork the workers to segment sentences, returns the private memory of
+    each worker in KB '''
+
+    memory: list[int] = []
+    for _ in range(NUM_WORKERS):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            segmenter = Segmenter(fst)
+            for sentence in sentences:
+                segmenter.segment_string(sentence)
+            os.write(write_fd, str(private_memory()).encode('utf-8'))
+            os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            memory.append(int(f.read()))
+        os.waitpid(pid, 0)
+
+    return memory
+
+
+if __name__ == '__main__':
+    lexicon = generate_lexicon(50000)
+    fst = build_fst(lexicon)
+    fst.optimize_for_decoding(inplace=True)
+
+    rand = random.Random(2)
+    words = [word for word, _, _ in lexicon]
+    sentences = [''.join(rand.choices(words, k=20)) for _ in range(200)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        binary_file = os.path.join(tmpdir, 'fst.bin')
+        with open(binary_file, 'wb') as f:
+            fst.write_binary(f, weight_bits=16)
+        flat_file = os.path.join(tmpdir, 'flat_fst.bin')
+        with open(flat_file, 'wb') as f:
+            fst.write_binary(f, weight_bits=16, flat=True)
+        del fst
+
+        print(f'{"model":>10} {"private KB of workers"}')
+        binary_fst = Fst.from_binary(binary_file)
+        freeze_heap()
+        print(f'{"binary":>10} {run_workers(binary_fst, sentences)}')
+        del binary_fst
+
+        flat_fst = preload(flat_file)
+        print(f'{"flat":>10} {run_workers(flat_fst, sentences)}')
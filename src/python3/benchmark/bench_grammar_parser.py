@@ -0,0 +1,62 @@
+''' benchmark of BNFTokenizer, RuleParser and Grammar on generated grammars with a large number of
+alternatives, and on a single rule with a large number of sub rules. The time per alternative and
+per sub rule should be almost constant as the grammar grows.
+Usage:
+    python3 -m benchmark.bench_grammar_parser '''
+from __future__ import annotations
+
+import time
+
+from nnlp_tools.bnf_tokenizer import BNFTokenizer
+from nnlp_tools.grammar import Grammar
+from nnlp_tools.rule import Rule
+from nnlp_tools.rule_parser import RuleParser
+from nnlp_tools.util import SourcePosition
+
+
+def generate_grammar(num_alternatives: int) -> list[str]:
+    ''' generate the grammar with num_alternatives alternatives in one class, the same number of
+    single-rule classes, and one rule with num_alternatives / 10 sub rules '''
+
+    alternatives = ' | '.join(f'"w{i}" <c{i}>' for i in range(num_alternatives))
+    lines = [f'<root> ::= {alternatives}']
+    for i in range(num_alternatives):
+        lines.append(f'<c{i}> ::= ("a{i}" | "b{i}")? "c{i}"')
+
+    # one rule with a sub rule for every 10 alternatives
+    lines.append(generate_sub_rules(num_alternatives // 10))
+
+    return lines
+
+
+def generate_sub_rules(num_sub_rules: int) -> str:
+    ''' generate one rule with num_sub_rules optional sub rules '''
+
+    groups = ' '.join(f'("x{i}" | "y{i}")?' for i in range(num_sub_rules))
+    return f'<groups> ::= {groups}'
+
+
+def bench(lines: list[str], root: str) -> float:
+    ''' returns seconds to parse the grammar '''
+
+    start_time = time.perf_counter()
+    tokenizer = BNFTokenizer()
+    parser = RuleParser()
+    rules: list[Rule] = []
+    for line in lines:
+        rules.extend(parser(*tokenizer(line), SourcePosition()))
+    Grammar(rules, root)
+
+    return time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    print(f'{"alternatives":>12} {"seconds":>10} {"us/alternative":>15}')
+    for num_alternatives in [12500, 25000, 50000, 100000, 200000]:
+        seconds = bench(generate_grammar(num_alternatives), 'root')
+        print(f'{num_alternatives:>12} {seconds:>10.3f} {seconds / num_alternatives * 1e6:>15.2f}')
+
+    print(f'{"sub rules":>12} {"seconds":>10} {"us/sub rule":>15}')
+    for num_sub_rules in [2500, 5000, 10000, 20000, 40000]:
+        seconds = bench([generate_sub_rules(num_sub_rules)], 'groups')
+        print(f'{num_sub_rules:>12} {seconds:>10.3f} {seconds / num_sub_rules * 1e6:>15.2f}')
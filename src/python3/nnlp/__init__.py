@@ -1,3 +1,6 @@
 from .converter import Converter
+from .flat_fst import FlatFst
 from .fst import Fst
+from .lazy_fst import ComposedFst, LazyDeterminizedFst, ReplaceFst
+from .model_handle import ModelHandle
 from .segmenter import Segmenter
@@ -0,0 +1,246 @@
+''' the compact binary format of FST, written by nnlp_tools and read by Fst.from_binary().
+Layout (little-endian):
+    header    magic, version, number of states and arcs, byte width of labels and states, number of
+              bits of weight codes (0 for float32 weights)
+    sections  isymbols, osymbols, arc_offsets, final_weights, codebook, ilabels, olabels,
+              dest_states and weights. The integer columns are packed with their byte width.
+              For compressed FST, isymbols and osymbols are compressed, and the four arc columns
+              are replaced by arc_blocks and block_index. arc_blocks are the compressed blocks of
+              a fixed number of states, each block is the concatenated arc columns of its states.
+              block_index is the codec, states per block, the offsets of blocks in arc_blocks and
+              the crc32 of each block. Sharded FST has the blocks without compression (codec none),
+              so that the blocks could be read from file on demand. prefetch_states is the optional
+              list of hot states, their blocks are loaded with the FST. flags is the optional bit
+              flags, see FLAG_FLAT
+    footer    section table of (name, offset, length, crc32), the offset of the table and magic '''
+from __future__ import annotations
+
+import hashlib
+import lzma
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from typing import Callable, Optional, Union
+
+MAGIC = b'NNLPFST\0'
+VERSION = 2
+
+# versions could be read. Version 1 has no crc32 of blocks in block_index
+SUPPORTED_VERSIONS = (1, 2)
+
+# magic, version, num_states, num_arcs, ilabel_width, olabel_width, state_width, weight_bits
+HEADER = struct.Struct('<8sIIIBBBB')
+
+# name, offset, length, crc32
+SECTION_ENTRY = struct.Struct('<16sQQI')
+
+# number of sections, offset of section table, magic
+FOOTER = struct.Struct('<IQ8s')
+
+# supported number of bits of the weight codes, 0 means float32 weights without codebook
+WEIGHT_BITS = (0, 8, 16)
+
+# codec, number of states per block. Followed by uint64 offsets of the blocks and the end of last
+# block, then uint32 crc32 of the blocks
+BLOCK_INDEX = struct.Struct('<II')
+
+# codecs of the blocks, none for the sharded FST without compression
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2}
+
+# bit flags of section flags
+FLAGS = struct.Struct('<I')
+
+# flat FST for FlatFst: columns with native widths and 8-byte aligned, arcs sorted by input label
+FLAG_FLAT = 1
+
+_TYPECODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+def get_width(max_value: int) -> int:
+    r''' returns number of bytes to store the non-negative integers not larger than max_value '''
+
+    for width in (1, 2, 3):
+        if max_value < 1 << (8 * width):
+            return width
+    return 4
+
+
+def pack_ints(values: array, width: int) -> bytes:
+    r''' pack non-negative integers to little-endian bytes with width bytes each '''
+
+    if width == 3:
+        # drop the highest byte of each 4-byte integer
+        raw = pack_ints(values, 4)
+        packed = bytearray(len(raw) // 4 * 3)
+        for i in range(3):
+            packed[i::3] = raw[i::4]
+        return bytes(packed)
+
+    data = array(_TYPECODES[width], values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_ints(data: bytes, width: int) -> array:
+    r''' unpack the bytes written by pack_ints() to array of integers '''
+
+    if width == 3:
+        widened = bytearray(len(data) // 3 * 4)
+        for i in range(3):
+            widened[i::4] = data[i::3]
+        data = bytes(widened)
+        width = 4
+
+    values = array(_TYPECODES[width])
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    r''' compress data by codec name '''
+
+    if codec == 'none':
+        return data
+    elif codec == 'zlib':
+        return zlib.compress(data, 9)
+    elif codec == 'lzma':
+        return lzma.compress(data)
+    raise Exception(f'unsupported codec: {codec}')
+
+
+def decompress(codec_id: int, data: bytes) -> bytes:
+    r''' decompress data by codec id in CODECS '''
+
+    if codec_id == CODECS['none']:
+        return data
+    elif codec_id == CODECS['zlib']:
+        return zlib.decompress(data)
+    elif codec_id == CODECS['lzma']:
+        return lzma.decompress(data)
+    raise Exception(f'unsupported codec id: {codec_id}')
+
+
+def pack_floats(values: array) -> bytes:
+    r''' pack floats to little-endian float32 bytes '''
+
+    data = array('f', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_floats(data: bytes) -> array:
+    r''' unpack the bytes written by pack_floats() to array of floats '''
+
+    values = array('f')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def read_section_table(read_range: Callable[[int, int], bytes],
+                       size: int) -> dict[str, tuple[int, int, int]]:
+    r''' read the section table from the footer of FST data, returns dict of section name ->
+    (offset, length, crc32). Raises Exception if data is not the binary FST
+    Args:
+        read_range: function of (offset, length) returns the bytes in that range of data
+        size: number of bytes of data '''
+
+    if size < HEADER.size + FOOTER.size or read_range(0, len(MAGIC)) != MAGIC:
+        raise Exception('binary FST: invalid magic')
+    num_sections, table_offset, magic = FOOTER.unpack(read_range(size - FOOTER.size, FOOTER.size))
+    if magic != MAGIC or table_offset + num_sections * SECTION_ENTRY.size > size:
+        raise Exception('binary FST: invalid footer')
+
+    table = read_range(table_offset, num_sections * SECTION_ENTRY.size)
+    sections: dict[str, tuple[int, int, int]] = {}
+    for i in range(num_sections):
+        name, offset, length, crc = SECTION_ENTRY.unpack_from(table, i * SECTION_ENTRY.size)
+        if offset + length > table_offset:
+            raise Exception('binary FST: invalid section table')
+        sections[name.rstrip(b'\0').decode('utf-8')] = (offset, length, crc)
+
+    return sections
+
+
+def fingerprint(reader: SectionReader) -> str:
+    r''' content hash of binary FST from its header and the length and crc32 of its sections '''
+
+    h = hashlib.sha1(HEADER.pack(*reader.header))
+    for name, (_, length, crc) in sorted(reader.sections.items()):
+        h.update(SECTION_ENTRY.pack(name.encode('utf-8'), 0, length, crc))
+    return h.hexdigest()
+
+
+class SectionReader:
+    r''' reads the sections of binary FST from its data, or from file on demand. For file, only the
+    header and section table are read when it's created, and the file is kept open for later reads.
+    Reads are thread-safe
+    Args:
+        source: the data of binary FST like bytes or mmap, or its filename
+        verify: true to check the crc32 of sections read by read() '''
+
+    def __init__(self, source: Union[bytes, mmap.mmap, str], verify: bool = False) -> None:
+        self._verify = verify
+        self._lock = threading.Lock()
+        self._file = None
+        self._data: Optional[memoryview] = None
+        if isinstance(source, str):
+            self._file = open(source, 'rb')
+            size = os.fstat(self._file.fileno()).st_size
+        else:
+            self._data = memoryview(source)
+            size = len(source)
+
+        try:
+            self.sections = read_section_table(self.read_range, size)
+        except Exception:
+            self.close()
+            raise
+
+        # magic, version, num_states, num_arcs, ilabel_width, olabel_width, state_width, weight_bits
+        self.header: tuple = HEADER.unpack(self.read_range(0, HEADER.size))
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        r''' read length bytes from offset. Returns memoryview of the data without copying if it's
+        read from data '''
+
+        if self._data is not None:
+            return self._data[offset:offset + length]
+
+        assert self._file is not None
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        if len(data) != length:
+            raise Exception('binary FST: unexpected end of file')
+        return data
+
+    def read(self, name: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        r''' read section name, or length bytes from offset of the section. The crc32 is checked
+        only when the whole section is read '''
+
+        section_offset, section_length, crc = self.sections[name]
+        if length is None:
+            data = self.read_range(section_offset, section_length)
+            if self._verify and zlib.crc32(data) != crc:
+                raise Exception(f'binary FST: checksum mismatch: {name}')
+            return data
+
+        if offset + length > section_length:
+            raise Exception(f'binary FST: read out of section: {name}')
+        return self.read_range(section_offset + offset, length)
+
+    def close(self) -> None:
+        r''' close the file '''
+
+        if self._file is not None:
+            self._file.close()
@@ -0,0 +1,161 @@
+''' decode the graph of binary FST, see binary_format '''
+from __future__ import annotations
+
+import collections
+import itertools
+import threading
+import zlib
+from array import array
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from . import binary_format
+
+if TYPE_CHECKING:
+    # isymbol -> list of (dest_state, osymbol, weight)
+    StateArcs = dict[str, list[tuple[int, str, float]]]
+
+# names of the arc columns, in the order of sections and in each compressed block
+ARC_COLUMNS = ('ilabels', 'olabels', 'dest_states', 'weights')
+
+
+class StateDecoder:
+    r''' decodes the packed arc columns of a range of states to the graph of Fst
+    Args:
+        isymbols: input symbol of each symbol-id
+        osymbols: output symbol of each symbol-id
+        widths: byte width of each arc column in ARC_COLUMNS
+        codebook: weight of each code, None if the weights are float32 '''
+
+    def __init__(self, isymbols: list[Optional[str]], osymbols: list[Optional[str]],
+                 widths: tuple[int, int, int, int], codebook: Optional[array]) -> None:
+        self._isymbols = isymbols
+        self._osymbols = osymbols
+        self._widths = widths
+        self._codebook = codebook
+
+    @property
+    def widths(self) -> tuple[int, int, int, int]:
+        r''' byte width of each arc column '''
+        return self._widths
+
+    def decode(self, columns: list[bytes], arc_offsets: array, first_state: int,
+               last_state: int) -> list[StateArcs]:
+        r''' decode the states in [first_state, last_state), columns are the packed arc columns of
+        these states '''
+
+        ilabels, olabels, dest_states, codes = (binary_format.unpack_ints(data, width)
+                                                for data, width in zip(columns, self._widths))
+        weights: Iterable[float]
+        if self._codebook is None:
+            weights = binary_format.unpack_floats(columns[3])
+        else:
+            weights = map(self._codebook.__getitem__, codes)
+
+        arcs = zip(map(self._isymbols.__getitem__, ilabels), dest_states,
+                   map(self._osymbols.__getitem__, olabels), weights)
+        states: list[StateArcs] = []
+        for state in range(first_state, last_state):
+            state_arcs: StateArcs = {}
+            for isymbol, dest_state, osymbol, weight in itertools.islice(
+                    arcs, arc_offsets[state + 1] - arc_offsets[state]):
+                state_arcs.setdefault(isymbol, []).append((dest_state, osymbol, weight))
+            states.append(state_arcs)
+
+        return states
+
+    def split_columns(self, data: bytes, num_arcs: int) -> list[bytes]:
+        r''' split the concatenated arc columns of num_arcs arcs '''
+
+        columns: list[bytes] = []
+        offset = 0
+        for width in self._widths:
+            columns.append(data[offset:offset + num_arcs * width])
+            offset += num_arcs * width
+
+        return columns
+
+
+class BlockGraph:
+    r''' graph of the binary FST with arc blocks. It's used as Fst._graph, the block of a state is
+    read, decompressed and decoded on the first access, and at most cache_blocks decoded blocks are
+    kept in a LRU cache. The blocks of prefetch_states are loaded by prefetch() and never evicted
+    Args:
+        decoder: decoder of the states
+        reader: reader of the sections of binary FST
+        block_states: number of states in each block
+        codec_id: the codec of blocks, see binary_format.CODECS
+        block_offsets: offset of each block in section arc_blocks, and the end of last block
+        block_crcs: crc32 of each block, None to skip the check
+        arc_offsets: offset of the first arc of each state, and the number of arcs
+        cache_blocks: max number of decoded blocks in cache '''
+
+    def __init__(self, decoder: StateDecoder, reader: binary_format.SectionReader,
+                 block_states: int, codec_id: int, block_offsets: array,
+                 block_crcs: Optional[array], arc_offsets: array, cache_blocks: int) -> None:
+        self._decoder = decoder
+        self._reader = reader
+        self._block_states = block_states
+        self._codec_id = codec_id
+        self._block_offsets = block_offsets
+        self._block_crcs = block_crcs
+        self._arc_offsets = arc_offsets
+        self._cache_blocks = max(cache_blocks, 1)
+        self._cache: collections.OrderedDict[int, list[StateArcs]] = collections.OrderedDict()
+        self._pinned: dict[int, list[StateArcs]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._arc_offsets) - 1
+
+    def __getitem__(self, state: int) -> StateArcs:
+        if not 0 <= state < len(self):
+            raise IndexError(state)
+
+        block, index = divmod(state, self._block_states)
+        states = self._pinned.get(block)
+        if states is not None:
+            return states[index]
+
+        with self._lock:
+            states = self._cache.get(block)
+            if states is not None:
+                self._cache.move_to_end(block)
+                return states[index]
+
+        # decode without the lock, the block might be decoded by several threads
+        states = self._decode_block(block)
+        with self._lock:
+            self._cache[block] = states
+            if len(self._cache) > self._cache_blocks:
+                self._cache.popitem(last=False)
+
+        return states[index]
+
+    def close(self) -> None:
+        r''' close the reader of binary FST '''
+        self._reader.close()
+
+    def prefetch(self, states: Iterable[int]) -> None:
+        r''' load the blocks of states, and keep them out of the LRU cache. It should be called before
+        the graph is shared by threads '''
+
+        for block in sorted({state // self._block_states for state in states}):
+            if block not in self._pinned:
+                cached = self._cache.pop(block, None)
+                self._pinned[block] = cached if cached is not None else self._decode_block(block)
+
+    def _decode_block(self, block: int) -> list[StateArcs]:
+        r''' read, decompress and decode the states of block '''
+
+        offset = self._block_offsets[block]
+        data = self._reader.read('arc_blocks', offset, self._block_offsets[block + 1] - offset)
+        if self._block_crcs is not None and zlib.crc32(data) != self._block_crcs[block]:
+            raise Exception(f'binary FST: checksum mismatch: block {block}')
+        data = binary_format.decompress(self._codec_id, data)
+
+        first_state = block * self._block_states
+        last_state = min(first_state + self._block_states, len(self))
+        num_arcs = self._arc_offsets[last_state] - self._arc_offsets[first_state]
+        columns = self._decoder.split_columns(data, num_arcs)
+
+        return self._decoder.decode(columns, self._arc_offsets, first_state, last_state)
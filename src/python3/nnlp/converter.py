@@ -1,18 +1,23 @@
-from .decoder import FstDecoder
+from __future__ import annotations
+
+from typing import Union
+
 from .fst import Fst
+from .model_handle import ModelHandle
 
 class Converter:
     ''' converts a string to another with FST 
     Args:
-        fst (Fst): the FST model for convertion
+        fst (Fst | ModelHandle): the FST model for convertion, or its ModelHandle to swap the model
+            while running
         beam_size (int): beam_size for decoder
     Usage:
         converter = Converter(fst_model)
         output_str = converter.convert_string(input_str)
     '''
 
-    def __init__(self, fst: Fst, beam_size: int = 8) -> None:
-        self._fst = fst
+    def __init__(self, fst: Union[Fst, ModelHandle], beam_size: int = 8) -> None:
+        self._model = fst if isinstance(fst, ModelHandle) else ModelHandle(fst)
         self._beam_size = beam_size
 
     def convert_string(self, input: str) -> str:
@@ -24,6 +29,6 @@ class Converter:
         '''
 
         input_symbols = list(input)
-        decoder = FstDecoder(self._fst, self._beam_size)
-        output_symbols = decoder.decode_sequence(input_symbols)
+        with self._model.acquire_decoder(self._beam_size) as decoder:
+            output_symbols = decoder.decode_sequence(input_symbols)
         return ''.join(output_symbols)
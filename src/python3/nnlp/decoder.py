@@ -3,16 +3,23 @@ from __future__ import annotations
 from collections import deque
 from typing import TYPE_CHECKING, Optional, Sequence, Union
 import math
+import threading
 
 from .fst import Fst
+from .lazy_fst import ComposedFst
 from .symbol import BRK_SYM, CAP_EPS_SYM, EPS_SYM, UNK_SYM, CAP_SYM, escape_symbol, is_special_symbol, unescape_symbol
 if TYPE_CHECKING:
     InputSymbol = Union[str, tuple[str, str]]
 
+# max number of tokens kept in the arena of a pooled context
+_MAX_POOLED_TOKENS = 65536
+
 
 class _Token:
     r''' token in decoding lattice '''
 
+    __slots__ = ('state', 'olabel', 'prev_token', 'cost', 'capture')
+
     def __init__(self,
                  state: int,
                  olabel: str,
@@ -34,62 +41,133 @@ class _Token:
         return f'_Token({self.state}, "{self.olabel}", cost={self.cost}, capture={self.capture})'
 
 
+class _DecodeContext:
+    r''' scratch state of one decode. The beams and the queue are cleared and reused by each decode,
+    and tokens are taken from an arena of tokens reused by later decodes, so the steady-state
+    decoding doesn't allocate them '''
+
+    def __init__(self) -> None:
+        self.beam: list[_Token] = []
+        self.next_beam: list[_Token] = []
+        self.queue: deque[_Token] = deque()
+
+        # tokens[:num_tokens] are used by current decode
+        self.tokens: list[_Token] = []
+        self.num_tokens = 0
+
+    def reset(self) -> None:
+        r''' clear the state of last decode '''
+
+        self.beam.clear()
+        self.next_beam.clear()
+        self.queue.clear()
+        self.num_tokens = 0
+
+    def new_token(self,
+                  state: int,
+                  olabel: str,
+                  prev_tok: Union[_Token, None],
+                  cost: float,
+                  capture: Optional[str] = None) -> _Token:
+        r''' get a token from the arena '''
+
+        if self.num_tokens < len(self.tokens):
+            tok = self.tokens[self.num_tokens]
+            tok.state = state
+            tok.olabel = olabel
+            tok.prev_token = prev_tok
+            tok.cost = cost
+            tok.capture = capture
+        else:
+            tok = _Token(state, olabel, prev_tok, cost, capture)
+            self.tokens.append(tok)
+        self.num_tokens += 1
+
+        return tok
+
+    def swap_beams(self) -> None:
+        r''' make next_beam the current beam, and reuse the current one as next_beam '''
+
+        self.beam, self.next_beam = self.next_beam, self.beam
+        self.next_beam.clear()
+
+
 class FstDecoder:
-    r''' beam-search decoder for WFST '''
+    r''' beam-search decoder for WFST. fst could also be a sequence of FSTs, which will be composed
+    on the fly by ComposedFst. The decoder could be shared by threads, the state of each decode is
+    kept in a context taken from a pool of at most pool_size contexts '''
 
-    def __init__(self, fst: Fst, beam_size=8) -> None:
+    def __init__(self, fst: Union[Fst, Sequence[Fst]], beam_size=8, pool_size=8) -> None:
+        if not isinstance(fst, Fst):
+            fst = ComposedFst(fst)
         self._fst = fst
         self._beam_size = beam_size
 
-        self._beam: list[_Token]
+        self._pool_size = pool_size
+        self._contexts: list[_DecodeContext] = []
+        self._lock = threading.Lock()
 
-        # mapping unknown symbol to real str value of input symbol
-        self._unk_symbols: list[str] = []
+    @property
+    def fst(self) -> Fst:
+        r''' the FST to decode '''
+        return self._fst
 
     def decode_sequence(self, inputs: Sequence[str]) -> Sequence[str]:
         r''' decode the input sequence using Fst and return the best output sequence '''
 
-        # initialize beam with start state
-        self._beam = [_Token(0, EPS_SYM, None, 0)]
+        with self._lock:
+            context = self._contexts.pop() if self._contexts else _DecodeContext()
+        self._fst.begin_decode()
+        try:
+            return self._decode(context, inputs)
+        finally:
+            self._fst.end_decode()
+            context.reset()
+            if len(context.tokens) > _MAX_POOLED_TOKENS:
+                del context.tokens[_MAX_POOLED_TOKENS:]
+            with self._lock:
+                if len(self._contexts) < self._pool_size:
+                    self._contexts.append(context)
+
+    def _decode(self, context: _DecodeContext, inputs: Sequence[str]) -> Sequence[str]:
+        r''' decode the input sequence with context '''
 
-        # #unk_0 is never used
-        self._unk_symbols = ['']
+        # initialize beam with start state
+        context.beam.append(context.new_token(0, EPS_SYM, None, 0))
 
         symbol_inputs = self._process_inputs(inputs)
 
         for symbol in symbol_inputs:
             # prune beam
-            self._prune_beam()
+            self._prune_beam(context)
 
             # extend beam by processing epsilon arc from its tokens
-            self._process_epsilon_arcs()
+            self._process_epsilon_arcs(context)
 
             # generate next frame of beam
-            beam_agent: list[_Token] = []
-            self._process_symbol_arcs(symbol, beam_agent)
-            self._beam = beam_agent
+            self._process_symbol_arcs(context, symbol)
 
             # early exit if no state in beam
-            if not self._beam:
+            if not context.beam:
                 return []
 
         # add final weights to active tokens in beam
-        self._add_final_weights()
+        self._add_final_weights(context)
 
         # early exit if no state in beam
-        if not self._beam:
+        if not context.beam:
             return []
 
         # get best path
-        osymbols, captures = self._best_path()
-        
+        osymbols, captures = self._best_path(context)
+
         return self._process_outputs(osymbols, captures)
 
-    def _prune_beam(self) -> None:
+    def _prune_beam(self, context: _DecodeContext) -> None:
         r''' prune beam to self._beam_size '''
 
-        self._beam.sort()
-        self._beam = self._beam[:self._beam_size]
+        context.beam.sort()
+        del context.beam[self._beam_size:]
 
     def _process_inputs(self, inputs: Sequence[str]) -> Sequence[InputSymbol]:
         ''' 
@@ -145,61 +223,64 @@ class FstDecoder:
         
         return outputs
 
-    def _process_symbol_arcs(self, symbol: InputSymbol, beam_agent: list[_Token]) -> None:
+    def _process_symbol_arcs(self, context: _DecodeContext, symbol: InputSymbol) -> None:
         r''' generate next frame of beam '''
 
+        next_beam = context.next_beam
+        new_token = context.new_token
         if isinstance(symbol, str):
-            for tok in self._beam:
+            for tok in context.beam:
                 arcs = self._fst.get_arcs(tok.state, symbol)
                 for arc in arcs:
                     dest_state, osymbol, weight = arc
-                    beam_agent.append(_Token(dest_state, osymbol, tok, tok.cost + weight))
+                    next_beam.append(new_token(dest_state, osymbol, tok, tok.cost + weight))
 
         elif isinstance(symbol, tuple) and symbol[0] == UNK_SYM:
-            for tok in self._beam:
+            for tok in context.beam:
                 arcs = self._fst.get_arcs(tok.state, UNK_SYM)
                 for arc in arcs:
                     dest_state, osymbol, weight = arc
-                    beam_agent.append(
-                        _Token(dest_state, osymbol, tok, tok.cost + weight, capture=symbol[1]))
+                    next_beam.append(
+                        new_token(dest_state, osymbol, tok, tok.cost + weight, capture=symbol[1]))
 
         else:
             raise Exception(f'unexpected symbol type')
+        context.swap_beams()
 
-    def _process_epsilon_arcs(self) -> None:
+    def _process_epsilon_arcs(self, context: _DecodeContext) -> None:
         r''' extend beam by processing epsilon arc from its tokens '''
 
-        tok_queue = deque(self._beam)
-        beam_agent: list[_Token] = []
+        tok_queue = context.queue
+        tok_queue.extend(context.beam)
+        next_beam = context.next_beam
         while tok_queue:
             tok = tok_queue.popleft()
-            beam_agent.append(tok)
+            next_beam.append(tok)
 
             arcs = self._fst.get_arcs(tok.state, EPS_SYM)
             for arc in arcs:
                 dest_state, osymbol, weight = arc
-                tok_queue.append(_Token(dest_state, osymbol, tok, tok.cost + weight))
-        self._beam = beam_agent
+                tok_queue.append(context.new_token(dest_state, osymbol, tok, tok.cost + weight))
+        context.swap_beams()
 
-    def _add_final_weights(self) -> None:
-        r''' for each token in self._beam, if it is a final state, add final costs to it. If not, just
+    def _add_final_weights(self, context: _DecodeContext) -> None:
+        r''' for each token in beam, if it is a final state, add final costs to it. If not, just
         remove it from beam '''
 
-        self._process_epsilon_arcs()
-        beam_agent: list[_Token] = []
-        for tok in self._beam:
-            cost = -self._fst.get_final_weight(tok.state)
+        self._process_epsilon_arcs(context)
+        for tok in context.beam:
+            cost = self._fst.get_final_weight(tok.state)
             if not math.isnan(cost):
                 tok.cost += cost
-                beam_agent.append(tok)
-        self._beam = beam_agent
+                context.next_beam.append(tok)
+        context.swap_beams()
 
-    def _best_path(self) -> tuple[list[str], list[str]]:
+    def _best_path(self, context: _DecodeContext) -> tuple[list[str], list[str]]:
         r''' get best path from beam returns (output symbols, captured symbols) '''
 
         symbols: list[str] = []
         captures: list[str] = []
-        best_tok: Optional[_Token] = min(self._beam)
+        best_tok: Optional[_Token] = min(context.beam)
         while best_tok:
             symbols.append(best_tok.olabel)
             if best_tok.capture:
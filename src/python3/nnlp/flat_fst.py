@@ -0,0 +1,152 @@
+''' FST on the immutable flat buffers of memory-mapped binary file, for servers forking workers '''
+from __future__ import annotations
+
+import bisect
+import gc
+import json
+import math
+import mmap
+import sys
+from typing import TYPE_CHECKING, Optional
+
+from . import binary_format
+from .fst import NAN, Fst
+
+if TYPE_CHECKING:
+    # (dest_state, osymbol, weight)
+    FstArc = tuple[int, str, float]
+
+_TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+# flat FSTs loaded by preload(), filename -> FST
+_preloaded: dict[str, FlatFst] = {}
+
+
+class FlatFst(Fst):
+    r'''
+    FST on the flat buffers of the binary file written by MutableFst.write_binary(flat=True). The
+    file is mapped to memory and arcs are read from the buffers when they are requested, so no
+    Python objects are created for states or arcs. The pages are shared by all processes mapping the
+    file, and reference counting or GC never writes to them, so forked workers don't copy the model
+    Usage:
+        fst = FlatFst('model.bin')
+    Args:
+        filename: the flat binary FST file
+        verify: true to check the checksums of sections '''
+
+    def __init__(self, filename: str, verify: bool = False) -> None:
+        super().__init__()
+
+        if sys.byteorder != 'little':
+            raise Exception('FlatFst: only little-endian platforms are supported')
+
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = binary_format.SectionReader(self._mmap, verify)
+        flags = 0
+        if 'flags' in reader.sections:
+            flags, = binary_format.FLAGS.unpack(reader.read('flags'))
+        if not flags & binary_format.FLAG_FLAT:
+            raise Exception(f'FlatFst: not a flat FST: {filename}')
+
+        _, version, num_states, num_arcs, ilabel_width, olabel_width, state_width, weight_bits = \
+            reader.header
+        if version not in binary_format.SUPPORTED_VERSIONS:
+            raise Exception(f'FlatFst: unsupported version {version}')
+        self._fingerprint = binary_format.fingerprint(reader)
+
+        isymbols: list[Optional[str]] = json.loads(bytes(reader.read('isymbols')))
+        self._isymbol_dict = {
+            isymbol: isymbol_id
+            for isymbol_id, isymbol in enumerate(isymbols) if isymbol is not None
+        }
+        self._osymbols: list[Optional[str]] = json.loads(bytes(reader.read('osymbols')))
+
+        self._arc_offsets = reader.read('arc_offsets').cast('I')
+        self._final_weight_buffer = reader.read('final_weights').cast('f')
+        self._ilabels = reader.read('ilabels').cast(_TYPECODES[ilabel_width])
+        self._olabels = reader.read('olabels').cast(_TYPECODES[olabel_width])
+        self._dest_states = reader.read('dest_states').cast(_TYPECODES[state_width])
+        self._codebook: Optional[tuple[float, ...]] = None
+        if weight_bits:
+            self._codebook = tuple(reader.read('codebook').cast('f'))
+            self._weights = reader.read('weights').cast(_TYPECODES[weight_bits // 8])
+        else:
+            self._weights = reader.read('weights').cast('f')
+        if not (len(self._arc_offsets) == num_states + 1 and
+                len(self._final_weight_buffer) == num_states and self._arc_offsets[-1] == num_arcs
+                and len(self._ilabels) == len(self._olabels) == len(self._dest_states) ==
+                len(self._weights) == num_arcs):
+            raise Exception('FlatFst: invalid number of states or arcs')
+
+    def get_arcs(self, state: int, isymbol: str) -> list[FstArc]:
+        r''' get arcs by specific input label of state returns (dest_state, osymbol, weight) '''
+
+        ilabel = self._isymbol_dict.get(isymbol)
+        if ilabel is None:
+            return []
+
+        # arcs of each state are sorted by input label
+        ilabels = self._ilabels
+        end = self._arc_offsets[state + 1]
+        arc = bisect.bisect_left(ilabels, ilabel, self._arc_offsets[state], end)
+        if arc == end or ilabels[arc] != ilabel:
+            return []
+
+        dest_states = self._dest_states
+        olabels = self._olabels
+        osymbols = self._osymbols
+        weights = self._weights
+        codebook = self._codebook
+        arcs: list[FstArc] = []
+        while arc < end and ilabels[arc] == ilabel:
+            weight = weights[arc] if codebook is None else codebook[weights[arc]]
+            arcs.append((dest_states[arc], osymbols[olabels[arc]], weight))
+            arc += 1
+
+        return arcs
+
+    def get_final_weight(self, state: int) -> float:
+        r''' get weights for final state, return NAN if it's not a final state '''
+
+        weight = self._final_weight_buffer[state]
+        return weight if math.isfinite(weight) else NAN
+
+    def close(self) -> None:
+        r''' release the buffers and unmap the file, the FST could not be used after it '''
+
+        for buffer in (self._arc_offsets, self._final_weight_buffer, self._ilabels, self._olabels,
+                       self._dest_states, self._weights):
+            buffer.release()
+        self._mmap.close()
+
+
+def preload(filename: str) -> FlatFst:
+    r''' load the flat FST in the parent process before forking the workers, then freeze the heap
+    by freeze_heap(). Workers get the FST by get_preloaded(filename) '''
+
+    fst = get_preloaded(filename)
+    freeze_heap()
+
+    return fst
+
+
+def get_preloaded(filename: str) -> FlatFst:
+    r''' returns the FST loaded by preload() in the parent process. In the workers started without
+    fork, the file is mapped again, and its pages are still shared through the page cache '''
+
+    fst = _preloaded.get(filename)
+    if fst is None:
+        fst = FlatFst(filename)
+        _preloaded[filename] = fst
+
+    return fst
+
+
+def freeze_heap() -> None:
+    r''' collect garbage and move all objects to the permanent generation of GC. It should be called
+    in the parent process right before forking workers, so that GC in the workers doesn't write to
+    the pages of objects inherited from the parent '''
+
+    gc.collect()
+    gc.freeze()
@@ -1,12 +1,20 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, TextIO, Union
+from typing import TYPE_CHECKING, BinaryIO, Optional, TextIO, Union
+import hashlib
 import json
+import math
+import os
+import zlib
 
+from . import binary_format, binary_graph
 from .symbol import EPS_SYM, UNK_SYM
 
 NAN = float('nan')
 
+# bytes read from the end of json file to find its sections
+_JSON_TAIL_SIZE = 4096
+
 if TYPE_CHECKING:
     FstArcTarget = tuple[int, int, float]
 
@@ -31,9 +39,19 @@ class Fst:
         # all input string symbols
         self._isymbol_dict: dict[str, int] = {}
 
+        # content hash, see fingerprint()
+        self._fingerprint: Optional[str] = None
+
     @classmethod
-    def from_json(cls, f_json: Union[TextIO, str]) -> Fst:
-        ''' load FST from json file '''
+    def from_json(cls, f_json: Union[TextIO, str], verify: bool = False) -> Fst:
+        r''' load FST from json file. When verify is true, the checksums of file f_json are checked
+        before parsing it, see verify_json() '''
+
+        if verify:
+            if not isinstance(f_json, str):
+                raise Exception('Fst.from_json: only json file could be verified')
+            if not cls.verify_json(f_json):
+                raise Exception(f'Fst.from_json: checksum mismatch: {f_json}')
 
         fst = Fst()
         if isinstance(f_json, str):
@@ -49,6 +67,129 @@ class Fst:
 
         return fst
 
+    @classmethod
+    def from_binary(cls,
+                    f_binary: Union[BinaryIO, str],
+                    verify: bool = False,
+                    cache_blocks: int = 64,
+                    lazy: bool = False) -> Fst:
+        r''' load FST from the binary file written by MutableFst.write_binary(). The packed labels
+        and quantized weights are decoded, so the loaded FST is the same as the one from json except
+        the precision of weights. When verify is true, the checksums of sections and blocks are
+        checked. For the compressed or sharded FST, only the symbols and the blocks of prefetch
+        states are loaded, the other blocks are decoded on the first access of their states, and at
+        most cache_blocks decoded blocks are kept. When lazy is true, f_binary must be a filename,
+        the file is kept open and the blocks are read from it on demand '''
+
+        if lazy:
+            if not isinstance(f_binary, str):
+                raise Exception('Fst.from_binary: only binary file could be loaded lazily')
+            reader = binary_format.SectionReader(f_binary, verify)
+        elif isinstance(f_binary, str):
+            with open(f_binary, 'rb') as f:
+                reader = binary_format.SectionReader(f.read(), verify)
+        else:
+            reader = binary_format.SectionReader(f_binary.read(), verify)
+
+        _, version, num_states, num_arcs, ilabel_width, olabel_width, state_width, weight_bits = \
+            reader.header
+        if version not in binary_format.SUPPORTED_VERSIONS:
+            raise Exception(f'Fst.from_binary: unsupported version {version}')
+
+        block_index = reader.read('block_index') if 'block_index' in reader.sections else None
+        codec_id = 0
+        if block_index is not None:
+            codec_id, block_states = binary_format.BLOCK_INDEX.unpack_from(block_index)
+            num_blocks = (num_states + block_states - 1) // block_states
+            offsets_end = binary_format.BLOCK_INDEX.size + (num_blocks + 1) * 8
+            crcs_size = num_blocks * 4 if version >= 2 else 0
+            if len(block_index) != offsets_end + crcs_size:
+                raise Exception('Fst.from_binary: invalid number of blocks')
+            block_offsets = binary_format.unpack_ints(
+                block_index[binary_format.BLOCK_INDEX.size:offsets_end], 8)
+            block_crcs = None
+            if crcs_size:
+                block_crcs = binary_format.unpack_ints(block_index[offsets_end:], 4)
+
+        def read_symbols(name: str) -> list[Optional[str]]:
+            return json.loads(bytes(binary_format.decompress(codec_id, reader.read(name))))
+
+        isymbols = read_symbols('isymbols')
+        osymbols = read_symbols('osymbols')
+        arc_offsets = binary_format.unpack_ints(reader.read('arc_offsets'), 4)
+        final_weights = binary_format.unpack_floats(reader.read('final_weights'))
+        codebook = binary_format.unpack_floats(reader.read('codebook')) if weight_bits else None
+        if not (len(arc_offsets) == num_states + 1 and len(final_weights) == num_states and
+                arc_offsets[-1] == num_arcs):
+            raise Exception('Fst.from_binary: invalid number of states or arcs')
+
+        weight_width = weight_bits // 8 if weight_bits else 4
+        decoder = binary_graph.StateDecoder(isymbols, osymbols,
+                                            (ilabel_width, olabel_width, state_width, weight_width),
+                                            codebook)
+        fst = Fst()
+        if block_index is not None:
+            graph = binary_graph.BlockGraph(decoder, reader, block_states, codec_id, block_offsets,
+                                            block_crcs if verify else None, arc_offsets,
+                                            cache_blocks)
+            if 'prefetch_states' in reader.sections:
+                graph.prefetch(binary_format.unpack_ints(reader.read('prefetch_states'), 4))
+            fst._graph = graph  # type: ignore
+        else:
+            columns = [reader.read(name) for name in binary_graph.ARC_COLUMNS]
+            if any(len(column) != num_arcs * width
+                   for column, width in zip(columns, decoder.widths)):
+                raise Exception('Fst.from_binary: invalid number of arcs')
+            fst._graph = decoder.decode(columns, arc_offsets, 0, num_states)
+            reader.close()
+        fst._fingerprint = binary_format.fingerprint(reader)
+
+        fst._isymbol_dict = {
+            isymbol: isymbol_id
+            for isymbol_id, isymbol in enumerate(isymbols) if isymbol is not None
+        }
+        fst._final_weights = {
+            state: weight
+            for state, weight in enumerate(final_weights) if math.isfinite(weight)
+        }
+
+        return fst
+
+    @staticmethod
+    def verify_json(filename: str) -> bool:
+        r''' check the checksums of the sections in json file written by MutableFst.write_json(). The
+        sections record is located from the end of file, and only the byte range of each section is
+        read, so the file is not parsed. Returns false if any checksum mismatches or the file has no
+        checksums '''
+
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            file_size = f.tell()
+            f.seek(max(0, file_size - _JSON_TAIL_SIZE))
+            tail = f.read()
+
+            # tail is: ... ,"sections":{"graph":[offset,length,crc32],...}}
+            index = tail.rfind(b',"sections":')
+            if index < 0 or not tail.endswith(b'}'):
+                return False
+            sections = json.loads(tail[index + len(b',"sections":'):-1])
+
+            for offset, length, crc in sections.values():
+                if offset + length > file_size:
+                    return False
+                f.seek(offset)
+                section_crc = 0
+                while length > 0:
+                    data = f.read(min(length, 1 << 20))
+                    if not data:
+                        return False
+                    section_crc = zlib.crc32(data, section_crc)
+                    length -= len(data)
+                if section_crc != crc:
+                    return False
+
+        return True
+
     @property
     def isymbol_dict(self) -> dict[str, int]:
         ''' get the input symbol to input symbol id mapping dict '''
@@ -65,3 +206,27 @@ class Fst:
     def get_final_weight(self, state: int) -> float:
         r''' get weights for final state, return NAN if it's not a final state '''
         return self._final_weights.get(state, NAN)
+
+    def fingerprint(self) -> str:
+        r''' content hash of the FST, to check the data derived from it like the cache of
+        LazyDeterminizedFst. For binary FST, it's computed from the crc32 of sections without reading
+        them, otherwise from the graph on the first call '''
+
+        if self._fingerprint is None:
+            o = [self._graph, sorted(self._final_weights.items()), sorted(self._isymbol_dict)]
+            data = json.dumps(o, separators=(',', ':'), sort_keys=True).encode('utf-8')
+            self._fingerprint = hashlib.sha1(data).hexdigest()
+        return self._fingerprint
+
+    def begin_decode(self) -> None:
+        r''' called by the decoder before each decode, see the lazy FSTs '''
+
+    def end_decode(self) -> None:
+        r''' called by the decoder after each decode '''
+
+    def close(self) -> None:
+        r''' release the resources of FST, like the file kept open by from_binary(lazy=True). It's a
+        no-op for the FST loaded in memory. The FST could not be used after it '''
+
+        if isinstance(self._graph, binary_graph.BlockGraph):
+            self._graph.close()
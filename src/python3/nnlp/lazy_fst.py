@@ -0,0 +1,538 @@
+''' FSTs whose states are expanded lazily when the decoder reaches them '''
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, Sequence, Union
+import abc
+import hashlib
+import json
+import math
+import threading
+
+from .fst import NAN, Fst
+from .symbol import EPS_SYM, is_nonterminal_symbol
+
+if TYPE_CHECKING:
+    # (dest_state, osymbol, weight)
+    FstArc = tuple[int, str, float]
+
+    # element of a subset: (state, residual weight, residual output symbols)
+    _Element = tuple[int, float, tuple[str, ...]]
+
+    # ('s', elements) for subset of states in source FST
+    # ('c', output symbols, next_state) for the chain of epsilon arcs that
+    #     emits output symbols one by one
+    # ('f', final_weight) for the final state at the end of a chain
+    _LazyState = Union[tuple[str, tuple[_Element, ...]],
+                       tuple[str, tuple[str, ...], int], tuple[str, float]]
+
+# residual weights are rounded to this number of digits, otherwise subsets
+# differ only in floating point errors would be different states
+_WEIGHT_DIGITS = 6
+
+CACHE_VERSION = 2
+
+
+class _LazyFst(Fst, abc.ABC):
+    r'''
+    base class of the FSTs whose states are expanded lazily. Each state is
+    identified by a hashable value, and is assigned an integer id
+    when it's reached for the first time. Arcs expanded by _expand() are kept
+    in a bounded LRU cache. State ids should not change during a decode, so
+    when there are more than max_states states, they are dropped by the next
+    begin_decode() after the decodes in progress complete. begin_decode() and
+    end_decode() are forwarded to the FSTs it's made of, and the states are
+    also dropped when a lazy one of them dropped its states, since they refer
+    to its state ids.
+    Args:
+        isymbol_dict (dict[str, int]): input symbols of the FST
+        cache_size (int): max number of (state, input symbol) to cache
+        max_states (int): number of states to drop the expanded states '''
+
+    def __init__(self, isymbol_dict: dict[str, int], cache_size: int, max_states: int) -> None:
+        super().__init__()
+
+        self._isymbol_dict = isymbol_dict
+        self._cache_size = cache_size
+        self._max_states = max_states
+
+        # all states reached by the decoders since last reset
+        self._states: list[Any] = []
+        self._state_ids: dict[Any, int] = {}
+
+        # LRU cache of (state, isymbol) -> arcs
+        self._arc_cache: OrderedDict[tuple[int, str], list[FstArc]] = OrderedDict()
+
+        # states and cache are updated by get_arcs() of the decoders in threads
+        self._lock = threading.Lock()
+
+        # number of decodes in progress, notified when all of them complete
+        self._num_decodes = 0
+        self._no_decodes = threading.Condition(self._lock)
+
+        # number of times the states are dropped, and the ones of the FSTs it's made of when the
+        # states were dropped last time
+        self._generation = 0
+        self._operand_generations: list[int] = []
+
+    def begin_decode(self) -> None:
+        r''' called by the decoder before each decode. Drops the expanded states if there are more
+        than max_states, or the states of the FSTs it's made of are dropped, after the decodes in
+        progress complete '''
+
+        # the decodes in progress of this FST are also in progress of the operands, so they don't
+        # drop their states until these decodes complete
+        for fst in self._operands():
+            fst.begin_decode()
+
+        with self._lock:
+            if self._need_reset():
+                self._no_decodes.wait_for(lambda: self._num_decodes == 0)
+                if self._need_reset():
+                    self._reset()
+            self._num_decodes += 1
+
+    def end_decode(self) -> None:
+        r''' called by the decoder after each decode '''
+
+        with self._lock:
+            self._num_decodes -= 1
+            if self._num_decodes == 0:
+                self._no_decodes.notify_all()
+
+        for fst in self._operands():
+            fst.end_decode()
+
+    def fingerprint(self) -> str:
+        r''' content hash of the lazy FST, from its type and the FSTs it's made of '''
+
+        if self._fingerprint is None:
+            parts = [type(self).__name__] + self._fingerprint_parts()
+            self._fingerprint = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def get_arcs(self, state: int, isymbol: str) -> list[FstArc]:
+        r''' get arcs by specific input label of state returns (dest_state, osymbol, weight) '''
+
+        key = (state, isymbol)
+        with self._lock:
+            arcs = self._arc_cache.get(key)
+            if arcs is not None:
+                self._arc_cache.move_to_end(key)
+                return arcs
+
+        # expand without the lock, the arcs might be expanded by several threads. Since state ids
+        # are assigned under the lock, they get the same arcs
+        arcs = self._expand(state, isymbol)
+        with self._lock:
+            self._arc_cache[key] = arcs
+            if len(self._arc_cache) > self._cache_size:
+                self._arc_cache.popitem(last=False)
+
+        return arcs
+
+    def _get_operand_generations(self) -> list[int]:
+        ''' generations of the lazy FSTs it's made of '''
+        return [fst._generation for fst in self._operands() if isinstance(fst, _LazyFst)]
+
+    def _need_reset(self) -> bool:
+        ''' returns true if the expanded states should be dropped '''
+        return (len(self._states) > self._max_states or
+                self._get_operand_generations() != self._operand_generations)
+
+    def _reset(self) -> None:
+        ''' drop the expanded states and the cached arcs, only the initial state 0 is added again.
+        It's called with the lock held, or in the constructor '''
+
+        initial_state = self._initial_state()
+        self._states = [initial_state]
+        self._state_ids = {initial_state: 0}
+        self._arc_cache.clear()
+        self._generation += 1
+        self._operand_generations = self._get_operand_generations()
+
+    @abc.abstractmethod
+    def _operands(self) -> Sequence[Fst]:
+        ''' the FSTs it's made of '''
+
+    @abc.abstractmethod
+    def _initial_state(self) -> Any:
+        ''' the value of initial state 0 '''
+
+    @abc.abstractmethod
+    def _fingerprint_parts(self) -> list[Any]:
+        ''' values that identify the lazy FST besides its type, for fingerprint() '''
+
+    def _get_state_id(self, lazy_state: Any) -> int:
+        ''' get id of lazy_state, add it if not exist '''
+
+        with self._lock:
+            state_id = self._state_ids.get(lazy_state)
+            if state_id is None:
+                state_id = len(self._states)
+                self._states.append(lazy_state)
+                self._state_ids[lazy_state] = state_id
+
+        return state_id
+
+    @abc.abstractmethod
+    def _expand(self, state: int, isymbol: str) -> list[FstArc]:
+        ''' expand the arcs by input symbol of state '''
+
+
+class LazyDeterminizedFst(_LazyFst):
+    r'''
+    decodes a non-deterministic FST as if it was determinized, so that the
+    ahead-of-time determinize() could be skipped. A state of this FST is a
+    subset of (state, residual weight, residual outputs) in the source FST,
+    its arcs are expanded only when the decoder asks for them. Since the
+    decoder only keeps the best path, only the best residual is kept for each
+    source state, and the subsets are closed under epsilon arcs.
+    Expanded arcs are kept in a bounded LRU cache, and the cache could be
+    saved to a file to warm-start another process.
+    Usage:
+        fst = LazyDeterminizedFst(Fst.from_json(json_file))
+        fst.load_cache(cache_file)  # optional
+        decoder = FstDecoder(fst)
+    Args:
+        fst (Fst): the non-deterministic FST
+        cache_size (int): max number of (state, input symbol) to cache
+        max_states (int): number of states to drop the expanded states '''
+
+    _states: list[_LazyState]
+
+    def __init__(self, fst: Fst, cache_size: int = 100000, max_states: int = 1000000) -> None:
+        super().__init__(fst.isymbol_dict, cache_size, max_states)
+        self._fst = fst
+        self._reset()
+
+    def get_final_weight(self, state: int) -> float:
+        r''' get weights for final state, return NAN if it's not a final state '''
+
+        lazy_state = self._states[state]
+        if lazy_state[0] == 'f':
+            return lazy_state[1]
+        elif lazy_state[0] == 'c':
+            return NAN
+
+        # residual weights and outputs are emitted by the epsilon arcs to
+        # 'f' states, see _expand_final()
+        final_weight = math.inf
+        for source_state, weight, outputs in lazy_state[1]:
+            source_final = self._fst.get_final_weight(source_state)
+            if weight == 0 and not outputs and not math.isnan(source_final):
+                final_weight = min(final_weight, source_final)
+
+        return final_weight if math.isfinite(final_weight) else NAN
+
+    def _operands(self) -> Sequence[Fst]:
+        ''' the FSTs it's made of '''
+        return [self._fst]
+
+    def _initial_state(self) -> _LazyState:
+        ''' the epsilon closure of state 0 in source FST '''
+        return ('s', self._closure({0: (0.0, ())}))
+
+    def _fingerprint_parts(self) -> list[Any]:
+        ''' values that identify the lazy FST besides its type, for fingerprint() '''
+        return [self._fst.fingerprint()]
+
+    def save_cache(self, filename: str) -> None:
+        ''' save the expanded states and the cached arcs to file '''
+
+        with self._lock:
+            lazy_states = list(self._states)
+            arc_cache = list(self._arc_cache.items())
+
+        states = []
+        for lazy_state in lazy_states:
+            if lazy_state[0] == 's':
+                states.append(['s', [[s, w, list(o)] for s, w, o in lazy_state[1]]])
+            elif lazy_state[0] == 'c':
+                states.append(['c', list(lazy_state[1]), lazy_state[2]])
+            else:
+                states.append(list(lazy_state))
+
+        arcs = [[state, isymbol, arcs] for (state, isymbol), arcs in arc_cache]
+        o = dict(version=CACHE_VERSION,
+                 fingerprint=self._fst.fingerprint(),
+                 states=states,
+                 arcs=arcs)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(o, f, separators=(',', ':'))
+
+    def load_cache(self, filename: str) -> None:
+        ''' load the states and arcs saved by save_cache(). It should be called
+        before decoding since the state ids will be changed. The cache must be
+        saved with the same source FST, which is checked by its fingerprint '''
+
+        with open(filename, encoding='utf-8') as f:
+            o = json.load(f)
+        if o['version'] != CACHE_VERSION or o['fingerprint'] != self._fst.fingerprint():
+            raise Exception(f'cache file mismatch: {filename}')
+
+        self._states = []
+        self._state_ids = {}
+        for state in o['states']:
+            if state[0] == 's':
+                lazy_state = ('s', tuple((s, w, tuple(out)) for s, w, out in state[1]))
+            elif state[0] == 'c':
+                lazy_state = ('c', tuple(state[1]), state[2])
+            else:
+                lazy_state = tuple(state)
+            self._get_state_id(lazy_state)
+
+        self._arc_cache = OrderedDict()
+        for state, isymbol, arcs in o['arcs'][-self._cache_size:]:
+            self._arc_cache[(state, isymbol)] = list(map(tuple, arcs))
+
+    def _expand(self, state: int, isymbol: str) -> list[FstArc]:
+        ''' expand the arcs by input symbol of state '''
+
+        lazy_state = self._states[state]
+        if lazy_state[0] == 'f':
+            return []
+        elif lazy_state[0] == 'c':
+            if isymbol != EPS_SYM:
+                return []
+            outputs, next_state = lazy_state[1], lazy_state[2]
+            return [(self._get_chain_state_id(outputs[1:], next_state), outputs[0], 0.0)]
+        elif isymbol == EPS_SYM:
+            return self._expand_final(lazy_state[1])
+
+        # elements of the next subset: state -> (weight, outputs)
+        next_elements: dict[int, tuple[float, tuple[str, ...]]] = {}
+        for source_state, weight, outputs in lazy_state[1]:
+            for dest_state, osymbol, arc_weight in self._fst.get_arcs(source_state, isymbol):
+                next_weight = weight + arc_weight
+                if dest_state in next_elements and next_elements[dest_state][0] <= next_weight:
+                    continue
+                next_outputs = outputs if osymbol == EPS_SYM else outputs + (osymbol,)
+                next_elements[dest_state] = (next_weight, next_outputs)
+
+        if not next_elements:
+            return []
+        elements = self._closure(next_elements)
+
+        # move the minimal weight and the common prefix of outputs to the arc
+        min_weight = min(map(lambda e: e[1], elements))
+        prefix = elements[0][2]
+        for _, _, outputs in elements:
+            prefix_len = 0
+            max_len = min(len(prefix), len(outputs))
+            while prefix_len < max_len and prefix[prefix_len] == outputs[prefix_len]:
+                prefix_len += 1
+            prefix = prefix[:prefix_len]
+
+        elements = tuple((s, round(w - min_weight, _WEIGHT_DIGITS), o[len(prefix):])
+                         for s, w, o in elements)
+        next_state = self._get_state_id(('s', elements))
+        return [self._make_arc(prefix, next_state, min_weight)]
+
+    def _expand_final(self, elements: tuple[_Element, ...]) -> list[FstArc]:
+        ''' generate epsilon arcs that emit residual weight and outputs for the
+        final source states in subset '''
+
+        arcs: list[FstArc] = []
+        for source_state, weight, outputs in elements:
+            source_final = self._fst.get_final_weight(source_state)
+            if math.isnan(source_final) or (weight == 0 and not outputs):
+                continue
+
+            final_state = self._get_state_id(('f', source_final))
+            arcs.append(self._make_arc(outputs, final_state, weight))
+
+        return arcs
+
+    def _make_arc(self, outputs: tuple[str, ...], next_state: int, weight: float) -> FstArc:
+        ''' make an arc that emits outputs, and then goes to next_state '''
+
+        if not outputs:
+            return (next_state, EPS_SYM, weight)
+
+        return (self._get_chain_state_id(outputs[1:], next_state), outputs[0], weight)
+
+    def _get_chain_state_id(self, outputs: tuple[str, ...], next_state: int) -> int:
+        ''' get the state to emit outputs with epsilon arcs, and then go to next_state '''
+
+        if not outputs:
+            return next_state
+        return self._get_state_id(('c', outputs, next_state))
+
+    def _closure(self, elements: dict[int, tuple[float, tuple[str, ...]]]) -> tuple[_Element, ...]:
+        ''' epsilon closure of the subset, returns the elements sorted by state '''
+
+        queue = deque(elements.keys())
+        while queue:
+            source_state = queue.popleft()
+            weight, outputs = elements[source_state]
+            for dest_state, osymbol, arc_weight in self._fst.get_arcs(source_state, EPS_SYM):
+                next_weight = weight + arc_weight
+                if dest_state in elements and elements[dest_state][0] <= next_weight:
+                    continue
+                next_outputs = outputs if osymbol == EPS_SYM else outputs + (osymbol,)
+                elements[dest_state] = (next_weight, next_outputs)
+                queue.append(dest_state)
+
+        return tuple((s, w, o) for s, (w, o) in sorted(elements.items()))
+
+
+class ComposedFst(_LazyFst):
+    r'''
+    composition of two or more FSTs on the fly, so that small component models
+    could be combined at decode time instead of building the composed graph.
+    A state of ComposedFst is (state_a, state_b, filter_state), where state_a
+    is the state in left FST and state_b is the state in right FST. For more
+    than two FSTs, the left FST is the composition of all except the last one.
+    A sequence filter avoids redundant epsilon paths: once the right FST moved
+    alone by an input epsilon arc, the left FST could not move alone by an
+    output epsilon arc until both FSTs move together.
+    Usage:
+        fst = ComposedFst([lexicon_fst, breaker_fst])
+        decoder = FstDecoder(fst)
+    Args:
+        fsts (Sequence[Fst]): the FSTs to compose, output symbols of each FST
+            are the input symbols of the next one
+        cache_size (int): max number of (state, input symbol) to cache
+        max_states (int): number of states to drop the expanded states '''
+
+    # filter states
+    _FILTER_FREE = 0
+    _FILTER_RIGHT_MOVED = 1
+
+    _states: list[tuple[int, int, int]]
+
+    def __init__(self,
+                 fsts: Sequence[Fst],
+                 cache_size: int = 100000,
+                 max_states: int = 1000000) -> None:
+        if len(fsts) < 2:
+            raise Exception('ComposedFst: at least 2 FSTs are required')
+
+        fst_a = fsts[0] if len(fsts) == 2 else ComposedFst(fsts[:-1], cache_size, max_states)
+        super().__init__(fst_a.isymbol_dict, cache_size, max_states)
+        self._fst_a = fst_a
+        self._fst_b = fsts[-1]
+        self._reset()
+
+    def get_final_weight(self, state: int) -> float:
+        r''' get weights for final state, return NAN if it's not a final state '''
+
+        state_a, state_b, _ = self._states[state]
+        return self._fst_a.get_final_weight(state_a) + self._fst_b.get_final_weight(state_b)
+
+    def _operands(self) -> Sequence[Fst]:
+        ''' the FSTs it's made of '''
+        return [self._fst_a, self._fst_b]
+
+    def _initial_state(self) -> tuple[int, int, int]:
+        ''' the initial states of both FSTs '''
+        return (0, 0, self._FILTER_FREE)
+
+    def _fingerprint_parts(self) -> list[Any]:
+        ''' values that identify the lazy FST besides its type, for fingerprint() '''
+        return [self._fst_a.fingerprint(), self._fst_b.fingerprint()]
+
+    def _expand(self, state: int, isymbol: str) -> list[FstArc]:
+        ''' expand the arcs by input symbol of state '''
+
+        state_a, state_b, filter_state = self._states[state]
+        arcs: list[FstArc] = []
+        for next_a, osymbol_a, weight_a in self._fst_a.get_arcs(state_a, isymbol):
+            if osymbol_a == EPS_SYM:
+                # left FST moves alone
+                if filter_state == self._FILTER_FREE:
+                    next_state = self._get_state_id((next_a, state_b, self._FILTER_FREE))
+                    arcs.append((next_state, EPS_SYM, weight_a))
+                continue
+
+            # both FSTs move
+            for next_b, osymbol_b, weight_b in self._fst_b.get_arcs(state_b, osymbol_a):
+                next_state = self._get_state_id((next_a, next_b, self._FILTER_FREE))
+                arcs.append((next_state, osymbol_b, weight_a + weight_b))
+
+        if isymbol == EPS_SYM:
+            # right FST moves alone
+            for next_b, osymbol_b, weight_b in self._fst_b.get_arcs(state_b, EPS_SYM):
+                next_state = self._get_state_id((state_a, next_b, self._FILTER_RIGHT_MOVED))
+                arcs.append((next_state, osymbol_b, weight_b))
+
+        return arcs
+
+
+class ReplaceFst(_LazyFst):
+    r'''
+    expands the nonterminal arcs of an FST with the FSTs they refer to on the fly, so that a grammar
+    could be shipped as one FST for each class (see GrammarFstBuilder.build_classes()) and the shared
+    classes are not copied for every reference. A state of ReplaceFst is (stack, fst_index, state),
+    where stack holds (fst_index, return_state) of the callers as a flat tuple. An arc whose output is
+    a nonterminal symbol calls the FST of that symbol, and the final states of a called FST return
+    to the caller by epsilon arcs with the final weights.
+    Usage:
+        fst = ReplaceFst(root_fst, {'<class:city>': city_fst})
+        decoder = FstDecoder(fst)
+    Args:
+        fst (Fst): the root FST
+        fsts (dict[str, Fst]): nonterminal symbol -> FST it refers to
+        cache_size (int): max number of (state, input symbol) to cache
+        max_states (int): number of states to drop the expanded states '''
+
+    _states: list[tuple[tuple[int, ...], int, int]]
+
+    def __init__(self,
+                 fst: Fst,
+                 fsts: dict[str, Fst],
+                 cache_size: int = 100000,
+                 max_states: int = 1000000) -> None:
+        super().__init__(fst.isymbol_dict, cache_size, max_states)
+
+        self._fsts = [fst] + list(fsts.values())
+        self._fst_indices = {symbol: index + 1 for index, symbol in enumerate(fsts)}
+        self._reset()
+
+    def get_final_weight(self, state: int) -> float:
+        r''' get weights for final state, return NAN if it's not a final state '''
+
+        stack, fst_index, source_state = self._states[state]
+        if stack:
+            return NAN
+        return self._fsts[fst_index].get_final_weight(source_state)
+
+    def _operands(self) -> Sequence[Fst]:
+        ''' the FSTs it's made of '''
+        return self._fsts
+
+    def _initial_state(self) -> tuple[tuple[int, ...], int, int]:
+        ''' state 0 of the root FST with an empty stack '''
+        return ((), 0, 0)
+
+    def _fingerprint_parts(self) -> list[Any]:
+        ''' values that identify the lazy FST besides its type, for fingerprint() '''
+        return list(self._fst_indices) + [fst.fingerprint() for fst in self._fsts]
+
+    def _expand(self, state: int, isymbol: str) -> list[FstArc]:
+        ''' expand the arcs by input symbol of state '''
+
+        stack, fst_index, source_state = self._states[state]
+        fst = self._fsts[fst_index]
+
+        arcs: list[FstArc] = []
+        for dest_state, osymbol, weight in fst.get_arcs(source_state, isymbol):
+            callee_index = self._fst_indices.get(osymbol) if is_nonterminal_symbol(osymbol) else None
+            if callee_index is None:
+                next_state = self._get_state_id((stack, fst_index, dest_state))
+                arcs.append((next_state, osymbol, weight))
+                continue
+
+            if callee_index == fst_index or callee_index in stack[0::2]:
+                raise Exception(f'ReplaceFst: found a reference cycle of {osymbol}')
+            next_state = self._get_state_id((stack + (fst_index, dest_state), callee_index, 0))
+            arcs.append((next_state, EPS_SYM, weight))
+
+        if isymbol == EPS_SYM and stack:
+            final_weight = fst.get_final_weight(source_state)
+            if not math.isnan(final_weight):
+                next_state = self._get_state_id((stack[:-2], stack[-2], stack[-1]))
+                arcs.append((next_state, EPS_SYM, final_weight))
+
+        return arcs
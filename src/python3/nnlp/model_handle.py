@@ -0,0 +1,182 @@
+''' handle of the model used by Converter and Segmenter, the model could be swapped while running '''
+from __future__ import annotations
+
+import contextlib
+import os
+import threading
+from typing import Callable, Iterator, Optional
+
+from .decoder import FstDecoder
+from .fst import Fst
+
+
+class _Version:
+    r''' a model swapped in the handle, the number of its users and its decoders '''
+
+    def __init__(self, fst: Fst) -> None:
+        self.fst = fst
+        self.num_users = 0
+        self.retired = False
+
+        # beam_size -> decoder of fst, they are dropped with the model
+        self.decoders: dict[int, FstDecoder] = {}
+
+
+class ModelHandle:
+    r'''
+    handle of the current model. Decoders get the model by acquire() for each decode, and swap()
+    atomically replaces it with a newly loaded model. Decodes in progress finish on the old model,
+    and the old model is released by Fst.close(), or by on_release if it's set, when its last user
+    completes.
+    Optionally, watch() reloads the model when its file changes. New model files should be written
+    to a temporary file and renamed to filename, so the file is never read partially
+    Usage:
+        handle = ModelHandle(FlatFst(filename))
+        segmenter = Segmenter(handle)
+        with handle.acquire_decoder() as decoder:
+            outputs = decoder.decode_sequence(inputs)
+        handle.watch(filename, FlatFst)
+    Args:
+        fst: the initial model
+        on_release: called with the old model when it's swapped out and has no users, None to
+            close the old model '''
+
+    def __init__(self, fst: Fst, on_release: Optional[Callable[[Fst], None]] = None) -> None:
+        self._lock = threading.Lock()
+        self._version = _Version(fst)
+        self._on_release = on_release
+
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self._file_stat: Optional[tuple[int, int, int]] = None
+
+        # the exception of last failed reload, None if last reload succeeded
+        self.reload_error: Optional[Exception] = None
+
+    @property
+    def fst(self) -> Fst:
+        r''' the current model '''
+        return self._version.fst
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[Fst]:
+        r''' get the current model, it's not released until the with block exits even if it's swapped
+        out
+        Usage:
+            with handle.acquire() as fst:
+                decoder = FstDecoder(fst) '''
+
+        with self._acquire_version() as version:
+            yield version.fst
+
+    @contextlib.contextmanager
+    def acquire_decoder(self, beam_size: int = 8) -> Iterator[FstDecoder]:
+        r''' get the decoder of the current model, like acquire(). The decoder is created once for
+        each model and beam_size, shared by threads, and dropped when the model is swapped out
+        Usage:
+            with handle.acquire_decoder() as decoder:
+                outputs = decoder.decode_sequence(inputs) '''
+
+        with self._acquire_version() as version:
+            with self._lock:
+                decoder = version.decoders.get(beam_size)
+                if decoder is None:
+                    decoder = FstDecoder(version.fst, beam_size)
+                    version.decoders[beam_size] = decoder
+            yield decoder
+
+    @contextlib.contextmanager
+    def _acquire_version(self) -> Iterator[_Version]:
+        r''' get the current version and count it as a user until the with block exits '''
+
+        with self._lock:
+            version = self._version
+            version.num_users += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.num_users -= 1
+                release = version.retired and version.num_users == 0
+            if release:
+                self._release(version)
+
+    def swap(self, fst: Fst) -> Fst:
+        r''' replace the current model with fst, returns the old one. The old model is released when
+        its last user completes, or now if it has no users '''
+
+        with self._lock:
+            version = self._version
+            self._version = _Version(fst)
+            version.retired = True
+            release = version.num_users == 0
+        if release:
+            self._release(version)
+
+        return version.fst
+
+    def reload_if_changed(self, filename: str, loader: Callable[[str], Fst]) -> bool:
+        r''' load the model from filename by loader and swap to it if the file changed since last
+        reload. Returns true if the model is swapped. When loader fails, the current model is kept,
+        the exception is stored in reload_error and the reload is tried again next time '''
+
+        try:
+            stat = os.stat(filename)
+        except OSError as e:
+            self.reload_error = e
+            return False
+
+        file_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if file_stat == self._file_stat:
+                return False
+
+        try:
+            fst = loader(filename)
+        except Exception as e:
+            self.reload_error = e
+            return False
+
+        with self._lock:
+            self._file_stat = file_stat
+        self.reload_error = None
+        self.swap(fst)
+        return True
+
+    def watch(self, filename: str, loader: Callable[[str], Fst], interval: float = 5.0) -> None:
+        r''' start a daemon thread to check the file every interval seconds, and reload the model by
+        reload_if_changed() when the file changes. The current model is assumed to be loaded from
+        the current file, so it's not reloaded at start '''
+
+        if self._watch_thread is not None:
+            raise Exception('ModelHandle: already watching')
+
+        stat = os.stat(filename)
+        with self._lock:
+            self._file_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self._watch_stop.clear()
+
+        def watch_file() -> None:
+            while not self._watch_stop.wait(interval):
+                self.reload_if_changed(filename, loader)
+
+        self._watch_thread = threading.Thread(target=watch_file, name='ModelHandle.watch',
+                                              daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self) -> None:
+        r''' stop the thread started by watch() '''
+
+        if self._watch_thread is not None:
+            self._watch_stop.set()
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def _release(self, version: _Version) -> None:
+        r''' release the model of version '''
+
+        version.decoders.clear()
+        if self._on_release is not None:
+            self._on_release(version.fst)
+        else:
+            version.fst.close()
@@ -1,21 +1,24 @@
 from __future__ import annotations
 
-from .decoder import FstDecoder
+from typing import Union
+
 from .fst import Fst
+from .model_handle import ModelHandle
 from .symbol import BRK_SYM
 
 class Segmenter:
     ''' segment a string into small pieces 
     Args:
-        fst (Fst): the FST model for segmentation
+        fst (Fst | ModelHandle): the FST model for segmentation, or its ModelHandle to swap the model
+            while running
         beam_size (int): beam_size for decoder
     Usage:
         segmenter = Segmenter(fst_model)
         outputs = segmenter.segment_string(input_str)
     '''
 
-    def __init__(self, fst: Fst, beam_size: int = 8) -> None:
-        self._fst = fst
+    def __init__(self, fst: Union[Fst, ModelHandle], beam_size: int = 8) -> None:
+        self._model = fst if isinstance(fst, ModelHandle) else ModelHandle(fst)
         self._beam_size = beam_size
 
     def segment_string(self, input: str) -> list[str]:
@@ -27,8 +30,8 @@ class Segmenter:
         '''
 
         input_symbols = list(input)
-        decoder = FstDecoder(self._fst, self._beam_size)
-        output_symbols = decoder.decode_sequence(input_symbols)
+        with self._model.acquire_decoder(self._beam_size) as decoder:
+            output_symbols = decoder.decode_sequence(input_symbols)
         
         segments = ['']
         for symbol in output_symbols:
@@ -44,6 +44,16 @@ def make_disambig_symbol(disambig_id: int) -> str:
 
     return f'#{disambig_id}'
 
+def make_nonterminal_symbol(class_name: str) -> str:
+    ''' returns the output symbol that calls the FST of a grammar class '''
+
+    return f'<class:{class_name}>'
+
+def is_nonterminal_symbol(symbol: str) -> bool:
+    ''' returns true if it is a nonterminal symbol '''
+
+    return symbol.startswith('<class:') and symbol.endswith('>')
+
 # both input and output symbol
 EPS_SYM = '<eps>'
 
@@ -1 +1,2 @@
-from .lexicon_fst_builder import build_lexicon_fst
+from .lexicon_fst_builder import build_lexicon_fst, build_sharded_lexicon_fst
+from .pipeline import Pipeline, Stage
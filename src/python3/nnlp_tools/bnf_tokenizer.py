@@ -4,203 +4,153 @@ import re
 from .util import BNFSyntaxError
 from .common import BNFToken
 
+# <class-name> ::=
+_RE_HEAD = re.compile(r'\s*<([^>]*)>\s*::=')
+
+# one token and the spaces before it, the expression is scanned by this regex in a single pass.
+# The kind of token is the name of the outermost group matched
+_RE_TOKEN = re.compile(r'''\s*(?:
+    (?P<operator>[|()?*])                                # | ( ) ? *
+    | (?P<symbol>("[^"]*"|_)(?::("[^"]*"|_))?)           # "hello", _, "hello":_, _:"hello"
+    | (?P<class><([^>]*)>)                               # <hello>
+    | (?P<macro>!([^(]*)\("(.*?)"\))                     # !read_lexicon("lexicon.txt")
+    | (?P<weight>;\ ([0-9]+\.[0-9]+))                     # ; 0.9
+    | (?P<end>$)
+)''', re.VERBOSE)
+
+_RE_SPECIAL_CHAR = re.compile(r'[ \t:]')
+
+_OPERATORS = {
+    '|': BNFToken.OR,
+    '(': BNFToken.LEFT_PARENTHESIS,
+    ')': BNFToken.RIGHT_PARENTHESIS,
+    '?': BNFToken.QUESTION,
+    '*': BNFToken.ASTERISK,
+}
+
+
 class BNFTokenizer:
-    ''' convert BNF experession string to tokens '''
-
-    def __init__(self):
-        self._re_special_char = re.compile(r'[ \t:]')
-        self._offset = 0
-        self._expression = ''
-
-        self._re_weight = re.compile(r'; ([0-9]+(:?\.[0-9]+))')
-
-    def _discard_space(self) -> None:
-        r''' read and discard spaces '''
-        while self._offset < len(self._expression) and self._expression[self._offset].isspace():
-            self._offset += 1
-
-    def _is_end(self) -> bool:
-        r''' returns true if end of expression reached '''
-        if self._offset >= len(self._expression):
-            return True
-        return False
-    
-    def _read_weight(self) -> Optional[BNFToken]:
-        ''' read a weight token from self._expression[self._offset: ], for example, "; 0.9" '''
-
-        match = self._re_weight.match(self._expression, self._offset)
-        if not match:
-            return None
-        
-        self._offset += len(match.group(0))
-        return BNFToken(BNFToken.WEIGHT, match.group(1))
+    ''' convert BNF experession string to tokens. The expression is scanned by a compiled regex in a
+    single pass, so the time is linear to its length '''
 
-    def _read_symbol(self) -> Optional[BNFToken]:
-        r''' read a symbol token from self._expression[self._offset: ], the symbol token contains
-        following types:
-            _                ->  BNFToken(EPSILON, value="_")
-            "hello"          ->  BNFToken(SYMBOL, value="hello")
-            "hello":_        ->  BNFToken(I_SYMBOL, value="hello")
-            _:"hello"        ->  BNFToken(O_SYMBOL, value="hello")
-        On success, returns BNFToken else returns None'''
-
-        def _read_one_symbol():
-            r''' read one single symbol from self._expression[self._offset] '''
-            if self._expression[self._offset] == '_':
-                self._offset += 1
-                return None
-            if self._expression[self._offset] != '"':
-                raise BNFSyntaxError(f'symbol expected in position {self._offset}')
-
-            end_pos = self._expression.find('"', self._offset + 1)
-            if end_pos == -1:
-                raise BNFSyntaxError(f'quote mismatch')
-            value = self._expression[self._offset + 1:end_pos]
-            if value == '':
-                raise BNFSyntaxError(f'symbol is empty')
-            self._offset = end_pos + 1
-
-            return value
-
-        if self._expression[self._offset] in {'"', '_'}:
-            i_symbol = None
-            o_symbol = None
-            symbol = _read_one_symbol()
-            if self._offset < len(self._expression) and self._expression[self._offset] == ':':
-                self._offset += 1
-                i_symbol = symbol
-                o_symbol = _read_one_symbol()
-                symbol = None
-
-            if symbol:
-                return BNFToken(BNFToken.SYMBOL, symbol)
-            elif not i_symbol and not o_symbol:
-                return BNFToken(BNFToken.EPSILON)
-            elif not i_symbol and o_symbol:
-                return BNFToken(BNFToken.O_SYMBOL, o_symbol)
-            elif i_symbol and not o_symbol:
-                return BNFToken(BNFToken.I_SYMBOL, i_symbol)
-            else:
-                # both i_symbol and o_symbol have values
-                raise BNFSyntaxError(f'either input or output symbols should be _')
-        else:
-            return None
+    def __call__(self, bnf_expression: str) -> Tuple[str, List[BNFToken]]:
+        r''' apply tokenizer on bnf experssion, returns tuple (rule name, list of tokens) '''
 
-    def _read_class(self) -> Optional[BNFToken]:
-        r''' read a class token like <hello> from self._expression[self._offset: ]
-        On success, returns (CLASS, None) else returns None'''
+        expression = bnf_expression
+        if not expression.strip():
+            raise BNFSyntaxError(f'unexpected end of expression')
 
-        if self._expression[self._offset] == '<':
-            end_pos = self._expression.find('>', self._offset + 1)
-            if end_pos == -1:
-                raise BNFSyntaxError(f'invalid rule name')
-            value = self._expression[self._offset + 1:end_pos]
-            value = value.strip()
-            if value == "" or self._re_special_char.search(value):
-                raise BNFSyntaxError(f'invalid class name')
+        match = _RE_HEAD.match(expression)
+        if not match:
+            self._raise_head_error(expression)
+        class_name = self._check_class_name(match.group(1))
+        offset = match.end()
 
-            # update _offset
-            self._offset = end_pos + 1
+        tokens: List[BNFToken] = []
+        while True:
+            match = _RE_TOKEN.match(expression, offset)
+            if not match:
+                offset = len(expression) - len(expression[offset:].lstrip())
+                self._raise_error(expression, offset)
+            elif match.lastgroup == 'end':
+                break
 
-            return BNFToken(BNFToken.CLASS, value)
-        else:
-            return None
+            tokens.append(self._make_token(match))
+            offset = match.end()
 
-    def _read_macro(self) -> Optional[BNFToken]:
-        ''' read a macro from self._expression[self._offset: ], returns (MACRO_*, paramater) if
-        success, otherwise returns None'''
-
-        if self._expression[self._offset] == '!':
-            lp_pos = self._expression.find('("', self._offset + 1)
-            if lp_pos == -1:
-                raise BNFSyntaxError(f'invalid macro')
-            macro_name = self._expression[self._offset + 1: lp_pos].strip()
-            rp_pos = self._expression.find('")', lp_pos + 2)
-            if rp_pos == -1:
-                raise BNFSyntaxError(f'invalid macro')
-            macro_param = self._expression[lp_pos + 2: rp_pos]
-            self._offset = rp_pos + 2
+        if tokens == []:
+            raise BNFSyntaxError(f'unexpected end of expression')
 
+        return class_name, tokens
+
+    def _make_token(self, match: 're.Match[str]') -> BNFToken:
+        r''' make the token from a match of _RE_TOKEN '''
+
+        kind = match.lastgroup
+        if kind == 'operator':
+            return BNFToken(_OPERATORS[match.group(1)])
+        elif kind == 'symbol':
+            return self._make_symbol_token(match.group(3), match.group(4))
+        elif kind == 'class':
+            return BNFToken(BNFToken.CLASS, self._check_class_name(match.group(6)))
+        elif kind == 'macro':
+            macro_name = match.group(8).strip()
             if macro_name == 'read_lexicon':
-                return BNFToken(BNFToken.MACRO_READ_LEXICON, macro_param)
+                return BNFToken(BNFToken.MACRO_READ_LEXICON, match.group(9))
             else:
                 raise BNFSyntaxError(f'invalid macro name: {macro_name}')
-        else:
-            return None
 
-    def _read_define(self) -> Optional[BNFToken]:
-        r''' read a define token ::= from self._expression[self._offset: ]
-        On success, returns (DEFINE, '') else returns None'''
+        assert kind == 'weight'
+        return BNFToken(BNFToken.WEIGHT, match.group(11))
 
-        if self._expression[self._offset:self._offset + 3] == '::=':
-            self._offset += 3
+    def _make_symbol_token(self, symbol: str, osymbol: Optional[str]) -> BNFToken:
+        r''' make the symbol token, it contains following types:
+            _                ->  BNFToken(EPSILON, value="_")
+            "hello"          ->  BNFToken(SYMBOL, value="hello")
+            "hello":_        ->  BNFToken(I_SYMBOL, value="hello")
+            _:"hello"        ->  BNFToken(O_SYMBOL, value="hello") '''
 
-            return BNFToken(BNFToken.DEFINE)
+        i_value = self._get_symbol_value(symbol)
+        if osymbol is None:
+            if i_value is None:
+                return BNFToken(BNFToken.EPSILON)
+            return BNFToken(BNFToken.SYMBOL, i_value)
+
+        o_value = self._get_symbol_value(osymbol)
+        if not i_value and not o_value:
+            return BNFToken(BNFToken.EPSILON)
+        elif not i_value and o_value:
+            return BNFToken(BNFToken.O_SYMBOL, o_value)
+        elif i_value and not o_value:
+            return BNFToken(BNFToken.I_SYMBOL, i_value)
         else:
-            return None
-
-    def __call__(self, bnf_expression: str) -> Tuple[str, List[BNFToken]]:
-        r''' apply tokenizer on bnf experssion, returns tuple (rule name, list of tokens) '''
+            # both i_symbol and o_symbol have values
+            raise BNFSyntaxError(f'either input or output symbols should be _')
 
-        self._expression = bnf_expression
-        self._offset = 0
+    def _get_symbol_value(self, symbol: str) -> Optional[str]:
+        r''' get value of "hello" or _, returns None for _ '''
 
-        self._discard_space()
-        if self._is_end():
-            raise BNFSyntaxError(f'unexpected end of expression')
+        if symbol == '_':
+            return None
+        if symbol == '""':
+            raise BNFSyntaxError(f'symbol is empty')
+        return symbol[1:-1]
 
-        token = self._read_class()
-        if not token:
-            raise BNFSyntaxError(f'<class-name> expected at {self._offset}')
-        class_name = token.value
-        assert class_name
+    def _check_class_name(self, value: str) -> str:
+        r''' strip and check the class name '''
 
-        self._discard_space()
-        if self._is_end():
-            raise BNFSyntaxError(f'unexpected end of expression')
-        token = self._read_define()
-        if token == None:
-            raise BNFSyntaxError(f'token ::= expected at {self._offset}')
+        value = value.strip()
+        if value == "" or _RE_SPECIAL_CHAR.search(value):
+            raise BNFSyntaxError(f'invalid class name')
 
-        tokens: List[BNFToken] = []
-        while True:
-            self._discard_space()
-            if self._is_end():
-                break
+        return value
 
-            ch = self._expression[self._offset]
-            if ch == '"' or ch == '_':
-                token = self._read_symbol()
-            elif ch == '!':
-                token = self._read_macro()
-            elif ch == ';':
-                token = self._read_weight()
-            elif ch == '|':
-                token = BNFToken(BNFToken.OR)
-                self._offset += 1
-            elif ch == '(':
-                token = BNFToken(BNFToken.LEFT_PARENTHESIS)
-                self._offset += 1
-            elif ch == ')':
-                token = BNFToken(BNFToken.RIGHT_PARENTHESIS)
-                self._offset += 1
-            elif ch == '?':
-                token = BNFToken(BNFToken.QUESTION)
-                self._offset += 1
-            elif ch == '*':
-                token = BNFToken(BNFToken.ASTERISK)
-                self._offset += 1
-            elif ch == '<':
-                token = self._read_class()
-            else:
-                raise BNFSyntaxError(f'invalid character "{ch}" at {self._offset}')
+    def _raise_head_error(self, expression: str) -> None:
+        r''' raise the BNFSyntaxError for the invalid head "<class-name> ::=" of expression '''
 
-            if not token:
-                raise BNFSyntaxError(f'invalid character at {self._offset}')
+        offset = len(expression) - len(expression.lstrip())
+        if expression[offset] != '<':
+            raise BNFSyntaxError(f'<class-name> expected at {offset}')
 
-            tokens.append(token)
+        end_pos = expression.find('>', offset + 1)
+        if end_pos == -1:
+            raise BNFSyntaxError(f'invalid rule name')
+        self._check_class_name(expression[offset + 1:end_pos])
 
-        if tokens == []:
+        offset = len(expression) - len(expression[end_pos + 1:].lstrip())
+        if offset == len(expression):
             raise BNFSyntaxError(f'unexpected end of expression')
-
-        return class_name, tokens
+        raise BNFSyntaxError(f'token ::= expected at {offset}')
+
+    def _raise_error(self, expression: str, offset: int) -> None:
+        r''' raise the BNFSyntaxError for the invalid token at offset '''
+
+        ch = expression[offset]
+        if ch == '"':
+            raise BNFSyntaxError(f'quote mismatch at {offset}')
+        elif ch == '<':
+            raise BNFSyntaxError(f'invalid rule name at {offset}')
+        elif ch == '!':
+            raise BNFSyntaxError(f'invalid macro at {offset}')
+        else:
+            raise BNFSyntaxError(f'invalid character "{ch}" at {offset}')
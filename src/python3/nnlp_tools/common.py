@@ -29,6 +29,9 @@ class BNFToken:
         else:
             return False
 
+    def __hash__(self) -> int:
+        return hash((self.type, self.value))
+
     def __str__(self) -> str:
         if self.type == self.SYMBOL:
             return f'"{self.value}"'
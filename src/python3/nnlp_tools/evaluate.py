@@ -0,0 +1,81 @@
+''' evaluate a FST model against a reference model, like a pruned model
+against the unpruned one '''
+from __future__ import annotations
+
+import difflib
+from typing import Iterable
+
+from nnlp.decoder import FstDecoder
+from nnlp.fst import Fst
+
+
+class Agreement:
+    '''
+    agreement of the outputs of a model with the reference model
+    Attributes:
+        num_sentences: number of sentences decoded
+        num_agreed_sentences: number of sentences with the same output
+        num_symbols: number of output symbols of the reference model
+        num_agreed_symbols: number of reference output symbols matched by the
+            output of the model
+    '''
+
+    def __init__(self) -> None:
+        self.num_sentences = 0
+        self.num_agreed_sentences = 0
+        self.num_symbols = 0
+        self.num_agreed_symbols = 0
+
+    @property
+    def sentence_agreement(self) -> float:
+        ''' ratio of sentences with the same output '''
+        return self.num_agreed_sentences / max(self.num_sentences, 1)
+
+    @property
+    def symbol_agreement(self) -> float:
+        ''' ratio of reference output symbols matched by the model '''
+        return self.num_agreed_symbols / max(self.num_symbols, 1)
+
+    def __str__(self) -> str:
+        return (f'sentences: {self.num_agreed_sentences}/{self.num_sentences} '
+                f'({self.sentence_agreement:.2%}), symbols: '
+                f'{self.num_agreed_symbols}/{self.num_symbols} '
+                f'({self.symbol_agreement:.2%})')
+
+
+def evaluate_agreement(reference: Fst,
+                       model: Fst,
+                       sentences: Iterable[str],
+                       beam_size: int = 8) -> Agreement:
+    '''
+    decode the sentences by both models, and count the agreement of their
+    output symbols. For segmentation models, the output symbols include the
+    <brk> symbols, so the agreement counts both characters and boundaries.
+    It's used to decide how much a model could be pruned
+    Args:
+        reference: the reference model, like the unpruned one
+        model: the model to evaluate
+        sentences: the input sentences, each character is an input symbol
+        beam_size: beam size of the decoders
+    Returns:
+        the agreement of model with reference
+    '''
+    reference_decoder = FstDecoder(reference, beam_size)
+    model_decoder = FstDecoder(model, beam_size)
+    agreement = Agreement()
+    for sentence in sentences:
+        symbols = list(sentence)
+        expected = reference_decoder.decode_sequence(symbols)
+        outputs = model_decoder.decode_sequence(symbols)
+
+        agreement.num_sentences += 1
+        agreement.num_symbols += len(expected)
+        if outputs == expected:
+            agreement.num_agreed_sentences += 1
+            agreement.num_agreed_symbols += len(expected)
+        else:
+            matcher = difflib.SequenceMatcher(None, expected, outputs, False)
+            agreement.num_agreed_symbols += sum(
+                block.size for block in matcher.get_matching_blocks())
+
+    return agreement
@@ -0,0 +1,262 @@
+''' columnar export and import of the arcs and final weights of a FST '''
+from __future__ import annotations
+
+import collections
+import functools
+import itertools
+import operator
+import struct
+from array import array
+from typing import Iterator, Optional, Sequence
+
+import pywrapfst
+
+# header of the OpenFst binary format, see fst/fst.h
+_FST_MAGIC_NUMBER = 2125659606
+_FST_HAS_ISYMBOLS = 0x1
+_FST_HAS_OSYMBOLS = 0x2
+_FST_IS_ALIGNED = 0x4
+
+# properties written to the header of imported FST, kExpanded | kMutable. The
+# other properties are unknown and computed by OpenFst when needed
+_VECTOR_FST_PROPERTIES = 0x3
+
+# version of VectorFst binary format, see fst/vector-fst.h
+_VECTOR_FST_VERSION = 2
+
+_INT32 = struct.Struct('=i')
+_FLOAT32 = struct.Struct('=f')
+# version, flags, properties, start, num_states, num_arcs (not set by VectorFst)
+_HEADER_TAIL = struct.Struct('=iiQqqq')
+_STATE = struct.Struct('=fq')  # final weight, number of arcs
+_ARC = struct.Struct('=iifi')  # ilabel, olabel, weight, nextstate
+
+
+class FstArrays:
+    '''
+    arcs and final weights of a FST in columns. Arcs are ordered by source
+    state, and the columns are array.array, which could be converted to numpy
+    arrays without copying by numpy.frombuffer()
+    Attributes:
+        src_states: source state of each arc
+        ilabels: input symbol-id of each arc
+        olabels: output symbol-id of each arc
+        weights: weight of each arc
+        dest_states: destination state of each arc
+        final_weights: final weight of each state, inf for non-final states
+        isymbols: input symbol of each symbol-id, None for unused ids
+        osymbols: output symbol of each symbol-id, None for unused ids
+    '''
+
+    def __init__(self, src_states: array, ilabels: array, olabels: array,
+                 weights: array, dest_states: array, final_weights: array,
+                 isymbols: list[Optional[str]],
+                 osymbols: list[Optional[str]]) -> None:
+        self.src_states = src_states
+        self.ilabels = ilabels
+        self.olabels = olabels
+        self.weights = weights
+        self.dest_states = dest_states
+        self.final_weights = final_weights
+        self.isymbols = isymbols
+        self.osymbols = osymbols
+
+    @property
+    def num_states(self) -> int:
+        ''' number of states '''
+        return len(self.final_weights)
+
+    @property
+    def num_arcs(self) -> int:
+        ''' number of arcs '''
+        return len(self.src_states)
+
+    def arcs(self) -> Iterator[tuple[int, int, int, int, float]]:
+        ''' returns an iterator of (src_state, dest_state, ilabel, olabel,
+        weight) of all arcs, weights are rounded by round_float32() '''
+        return zip(self.src_states, self.dest_states, self.ilabels,
+                   self.olabels, map(round_float32, self.weights))
+
+    def final_states(self) -> dict[int, float]:
+        ''' returns dict of (final state, final weight), weights are rounded
+        by round_float32() '''
+        inf = float('inf')
+        return {
+            state: round_float32(weight)
+            for state, weight in enumerate(self.final_weights)
+            if weight != inf
+        }
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def round_float32(value: float) -> float:
+    ''' returns the shortest float that converts to the same float32 as value,
+    so the float32 weight 0.1 is 0.1 instead of 0.10000000149011612 '''
+    for precision in range(1, 10):
+        rounded = float(f'{value:.{precision}g}')
+        if _FLOAT32.unpack(_FLOAT32.pack(rounded))[0] == value:
+            return rounded
+
+    return value
+
+
+def export_arrays(fst: pywrapfst.VectorFst, isymbols: list[Optional[str]],
+                  osymbols: list[Optional[str]]) -> FstArrays:
+    '''
+    export the arcs and final weights of fst to FstArrays. The FST is
+    serialized by OpenFst and the columns are sliced from its binary format,
+    so there is no python call per arc. FSTs that could not be parsed this way
+    are exported by iterating the arcs, like the binary format of another
+    version of OpenFst, which is detected by the version in header and the
+    number of states and arcs
+    '''
+    arrays = _parse_vector_fst(fst.write_to_string())
+    if arrays is None or not _match_counts(fst, arrays):
+        arrays = _iterate_vector_fst(fst)
+
+    return FstArrays(*arrays, isymbols, osymbols)
+
+
+def import_arrays(src_states: Sequence[int], ilabels: Sequence[int],
+                  olabels: Sequence[int], weights: Sequence[float],
+                  dest_states: Sequence[int], final_weights: Sequence[float],
+                  start: int) -> Optional[pywrapfst.VectorFst]:
+    '''
+    build a VectorFst from the columns of arcs and the final weight of each
+    state (inf for non-final states), the reverse of export_arrays(). The
+    columns are serialized to the binary format of VectorFst and read by
+    OpenFst, so there is no python call per arc. Arcs of each state keep
+    their order in the columns. Returns None if the binary format is not
+    supported by this version of OpenFst
+    '''
+    num_states = len(final_weights)
+    num_arcs = len(src_states)
+    if num_arcs and not (0 <= min(src_states) and max(src_states) < num_states
+                         and 0 <= min(dest_states) and
+                         max(dest_states) < num_states):
+        raise Exception('import_arrays: state not exist')
+
+    # arcs are grouped by source state, the sort is stable
+    if any(map(operator.gt, src_states, itertools.islice(src_states, 1,
+                                                        None))):
+        arc_rows = list(map(_ARC.pack, ilabels, olabels, weights,
+                            dest_states))
+        order = sorted(range(num_arcs), key=src_states.__getitem__)
+        arc_bytes = b''.join(map(arc_rows.__getitem__, order))
+    else:
+        arc_data = array('i', bytes(_ARC.size * num_arcs))
+        arc_data[0::4] = array('i', ilabels)
+        arc_data[1::4] = array('i', olabels)
+        arc_data[2::4] = array('i', array('f', weights).tobytes())
+        arc_data[3::4] = array('i', dest_states)
+        arc_bytes = arc_data.tobytes()
+
+    blocks = [
+        _INT32.pack(_FST_MAGIC_NUMBER),
+        _INT32.pack(6), b'vector',
+        _INT32.pack(8), b'standard',
+        _HEADER_TAIL.pack(_VECTOR_FST_VERSION, 0, _VECTOR_FST_PROPERTIES,
+                          start, num_states, num_arcs)
+    ]
+    # each state is followed by the block of its arcs
+    arc_counts = collections.Counter(src_states)
+    state_counts = list(
+        map(arc_counts.get, range(num_states), itertools.repeat(0)))
+    block_ends = list(
+        itertools.accumulate(map(_ARC.size.__mul__, state_counts)))
+    arc_blocks = map(arc_bytes.__getitem__,
+                     map(slice, [0] + block_ends[:-1], block_ends))
+    blocks.extend(
+        itertools.chain.from_iterable(
+            zip(map(_STATE.pack, final_weights, state_counts), arc_blocks)))
+
+    try:
+        fst = pywrapfst.VectorFst.read_from_string(b''.join(blocks))
+    except pywrapfst.FstError:
+        return None
+    if (fst.num_states() != num_states or fst.start() != start or
+            sum(map(fst.num_arcs, range(num_states))) != num_arcs):
+        return None
+
+    return fst
+
+
+def _parse_vector_fst(data: bytes) -> Optional[tuple[array, ...]]:
+    ''' get the columns from binary VectorFst of standard arc, returns None if
+    the format is not supported '''
+
+    offset = 0
+    (magic,) = _INT32.unpack_from(data, offset)
+    if magic != _FST_MAGIC_NUMBER:
+        return None
+    offset += _INT32.size
+
+    types: list[bytes] = []
+    for _ in range(2):
+        (length,) = _INT32.unpack_from(data, offset)
+        offset += _INT32.size
+        types.append(data[offset:offset + length])
+        offset += length
+    if types != [b'vector', b'standard']:
+        return None
+
+    version, flags, _, _, num_states, _ = _HEADER_TAIL.unpack_from(
+        data, offset)
+    offset += _HEADER_TAIL.size
+    if version != _VECTOR_FST_VERSION or flags & (
+            _FST_HAS_ISYMBOLS | _FST_HAS_OSYMBOLS | _FST_IS_ALIGNED):
+        return None
+
+    final_weights = array('f', bytes(4 * num_states))
+    arc_counts: list[int] = []
+    arc_blocks: list[bytes] = []
+    unpack_state = _STATE.unpack_from
+    for state in range(num_states):
+        final_weights[state], state_num_arcs = unpack_state(data, offset)
+        offset += _STATE.size
+        arc_counts.append(state_num_arcs)
+        arc_blocks.append(data[offset:offset + state_num_arcs * _ARC.size])
+        offset += state_num_arcs * _ARC.size
+    if offset != len(data):
+        return None
+
+    arc_data = memoryview(b''.join(arc_blocks))
+    int_columns = arc_data.cast('i')
+    src_states = array(
+        'i',
+        itertools.chain.from_iterable(
+            itertools.repeat(state, count)
+            for state, count in enumerate(arc_counts)))
+
+    return (src_states, array('i', int_columns[0::4]),
+            array('i', int_columns[1::4]), array('f', arc_data.cast('f')[2::4]),
+            array('i', int_columns[3::4]), final_weights)
+
+
+def _match_counts(fst: pywrapfst.VectorFst, arrays: tuple[array, ...]) -> bool:
+    ''' returns true if the number of states and arcs of the parsed columns
+    are the same as fst '''
+    states = list(fst.states())
+    return (len(arrays[5]) == len(states) and
+            len(arrays[0]) == sum(map(fst.num_arcs, states)))
+
+
+def _iterate_vector_fst(fst: pywrapfst.VectorFst) -> tuple[array, ...]:
+    ''' get the columns by iterating states and arcs of fst '''
+
+    src_states = array('i')
+    ilabels = array('i')
+    olabels = array('i')
+    weights = array('f')
+    dest_states = array('i')
+    final_weights = array('f')
+    for state in fst.states():
+        final_weights.append(float(fst.final(state)))
+        for arc in fst.arcs(state):
+            src_states.append(state)
+            ilabels.append(arc.ilabel)
+            olabels.append(arc.olabel)
+            weights.append(float(arc.weight))
+            dest_states.append(arc.nextstate)
+
+    return src_states, ilabels, olabels, weights, dest_states, final_weights
@@ -0,0 +1,396 @@
+''' streaming writers of the runtime FST formats '''
+from __future__ import annotations
+
+import bisect
+import collections
+import itertools
+import json
+import zlib
+from array import array
+from typing import IO, Optional, Sequence, Union
+
+from nnlp import binary_format
+from .fst_arrays import FstArrays
+
+# number of states serialized before each write to the file handle
+_STATES_PER_WRITE = 4096
+
+
+class SectionWriter:
+    '''
+    writes data to file handle f and tracks offset, length and crc32 of the
+    named sections, so that a loader could check a section by reading its
+    byte range only. Text is counted as utf-8 bytes, and f could be opened
+    in text or binary mode according to the type of data written. Offsets
+    are from the start of file by default: the current position of f if it's
+    seekable, otherwise f must be at the start of file
+    Args:
+        f: the file handle
+        offset: offset of the current position of f, None for the default
+    Usage:
+        writer = SectionWriter(f)
+        writer.begin_section('graph')
+        writer.write(...)
+        writer.end_section()
+        sections = writer.sections  # name -> [offset, length, crc32]
+    '''
+
+    def __init__(self, f: IO, offset: Optional[int] = None) -> None:
+        self._f = f
+        if offset is None:
+            offset = f.tell() if f.seekable() else 0
+        self._offset = offset
+        self._section_name: Optional[str] = None
+        self._section_offset = 0
+        self._section_crc = 0
+
+        self.sections: dict[str, list[int]] = {}
+
+    def write(self, data: Union[str, bytes]) -> None:
+        ''' write data to file and update the checksum of current section '''
+
+        encoded = data.encode('utf-8') if isinstance(data, str) else data
+        if self._section_name is not None:
+            self._section_crc = zlib.crc32(encoded, self._section_crc)
+        self._offset += len(encoded)
+        self._f.write(data)
+
+    @property
+    def offset(self) -> int:
+        ''' number of bytes written '''
+        return self._offset
+
+    def pad(self, alignment: int) -> None:
+        ''' write zeros until the offset is a multiple of alignment '''
+        self.write(b'\0' * (-self._offset % alignment))
+
+    def begin_section(self, name: str) -> None:
+        ''' start a section, data written after it belongs to the section '''
+
+        if self._section_name is not None:
+            raise Exception(f'section {self._section_name} is not ended')
+        self._section_name = name
+        self._section_offset = self._offset
+        self._section_crc = 0
+
+    def end_section(self) -> None:
+        ''' end current section and record its offset, length and crc32 '''
+
+        assert self._section_name is not None
+        self.sections[self._section_name] = [
+            self._section_offset, self._offset - self._section_offset,
+            self._section_crc
+        ]
+        self._section_name = None
+
+
+def write_json(arrays: FstArrays, f: IO[str], checksums: bool = True) -> None:
+    '''
+    write the FST to f in the json format read by nnlp.Fst. States are
+    serialized in order and written in batches, so the nested graph is never
+    built in memory. When checksums is true, the offset, length and crc32 of
+    the sections are written to the last key "sections", see
+    nnlp.Fst.verify_json(). All non-ASCII characters are escaped, so the
+    offsets are the same for any encoding of f
+    Args:
+        arrays: the FST to write, see MutableFst.to_arrays()
+        f: file handle opened in text mode
+        checksums: true to write the sections
+    '''
+    writer = SectionWriter(f)
+    writer.write('{"version":1,"graph":')
+
+    writer.begin_section('graph')
+    writer.write('[')
+    isymbols = arrays.isymbols
+    osymbols = arrays.osymbols
+    states: list[dict[str, list[tuple[int, str, float]]]] = []
+    arc_iter = iter(arrays.arcs())
+    arc = next(arc_iter, None)
+    for state in range(arrays.num_states):
+        state_arcs: dict[str, list[tuple[int, str, float]]] = {}
+        while arc is not None and arc[0] == state:
+            _, dest_state, ilabel, olabel, weight = arc
+            state_arcs.setdefault(isymbols[ilabel], []).append(
+                (dest_state, osymbols[olabel], weight))
+            arc = next(arc_iter, None)
+
+        states.append(state_arcs)
+        if len(states) >= _STATES_PER_WRITE:
+            # strip the brackets of the batch
+            writer.write(json.dumps(states, separators=(',', ':'))[1:-1])
+            writer.write(',' if state < arrays.num_states - 1 else '')
+            states = []
+    if states:
+        writer.write(json.dumps(states, separators=(',', ':'))[1:-1])
+    writer.write(']')
+    writer.end_section()
+
+    isymbol_dict = {
+        isymbol: isym_id
+        for isym_id, isymbol in enumerate(isymbols)
+        if isymbol is not None
+    }
+    writer.write(',"isymbol_dict":')
+    writer.begin_section('isymbol_dict')
+    writer.write(json.dumps(isymbol_dict, separators=(',', ':')))
+    writer.end_section()
+
+    writer.write(',"final_weights":')
+    writer.begin_section('final_weights')
+    writer.write(
+        json.dumps(list(arrays.final_states().items()), separators=(',', ':')))
+    writer.end_section()
+
+    if checksums:
+        writer.write(',"sections":')
+        writer.write(json.dumps(writer.sections, separators=(',', ':')))
+    writer.write('}')
+
+
+def quantize_weights(weights: array, bits: int) -> tuple[array, array]:
+    '''
+    quantize the weights to codes of bits bits. Code 0 is always the exact
+    zero weight. When there are fewer distinct non-zero weights than codes,
+    each weight has its own code, otherwise the codebook is the quantiles of
+    the distinct non-zero weights, interpolated between the neighbouring
+    weights and including the minimal and maximal one, and each weight takes
+    the code of its nearest codebook entry. So the codes are dense where the
+    weights are dense, and a few outliers don't stretch the step between codes
+    Args:
+        weights: the weights to quantize
+        bits: 8 or 16
+    Returns:
+        (codes, codebook), the weight of code is codebook[code]
+    '''
+    num_codes = 1 << bits
+    values = sorted(set(weights) - {0.0})
+    if len(values) < num_codes:
+        codebook = array('f', [0.0] + values)
+        code_of = {value: code + 1 for code, value in enumerate(values)}
+    else:
+        scale = (len(values) - 1) / (num_codes - 2)
+        entries = []
+        for i in range(num_codes - 2):
+            idx, frac = divmod(i * scale, 1)
+            idx = int(idx)
+            entries.append(values[idx] + (values[idx + 1] - values[idx]) * frac)
+        entries.append(values[-1])
+        codebook = array('f', [0.0] + entries)
+        code_of = {}
+        for value in values:
+            idx = bisect.bisect_left(entries, value)
+            if idx > 0 and (idx == len(entries) or
+                            value - entries[idx - 1] < entries[idx] - value):
+                idx -= 1
+            code_of[value] = idx + 1
+    code_of[0.0] = 0
+
+    typecode = 'B' if bits == 8 else 'H'
+    return array(typecode, map(code_of.__getitem__, weights)), codebook
+
+
+def hot_states(arrays: FstArrays, num_states: int) -> list[int]:
+    '''
+    returns at most num_states states in breadth-first order from the start
+    state 0. Decoding starts from state 0 and most inputs are short words, so
+    the states near the start state are the most visited ones
+    '''
+    arc_offsets = _get_arc_offsets(arrays)
+    states = [0] if arrays.num_states and num_states > 0 else []
+    visited = set(states)
+    for state in states:
+        arcs_end = arc_offsets[state + 1]
+        for dest_state in arrays.dest_states[arc_offsets[state]:arcs_end]:
+            if len(states) >= num_states:
+                return states
+            if dest_state not in visited:
+                visited.add(dest_state)
+                states.append(dest_state)
+
+    return states
+
+
+def write_binary(arrays: FstArrays,
+                 f: IO[bytes],
+                 weight_bits: int = 0,
+                 compression: Optional[str] = None,
+                 block_states: int = 1024,
+                 sharded: bool = False,
+                 prefetch_states: Optional[Sequence[int]] = None,
+                 flat: bool = False) -> None:
+    '''
+    write the FST to f in the binary format read by nnlp.Fst.from_binary(),
+    see nnlp.binary_format. Labels and states are stored with the minimal
+    byte width, and weights could be quantized to 8- or 16-bit codes. When
+    compression is set, the symbols are compressed, and the arcs are
+    compressed in blocks of block_states states, each block could be
+    decompressed independently. When sharded is true, the arcs are written in
+    blocks without compression, so that the loader could read them from file
+    on demand. When flat is true, the FST is written for nnlp.FlatFst: the
+    columns have native widths of 1, 2 or 4 bytes and are 8-byte aligned, and
+    the arcs of each state are sorted by input label
+    Args:
+        arrays: the FST to write, see MutableFst.to_arrays()
+        f: file handle opened in binary mode
+        weight_bits: number of bits of weight codes, 0 to store the weights
+            as float32
+        compression: 'zlib', 'lzma' or None for no compression
+        block_states: number of states in each block
+        sharded: true to write the arcs in blocks without compression
+        prefetch_states: the hot states, their blocks are loaded with the
+            FST. Only for compressed or sharded FST, see hot_states()
+        flat: true to write the FST for nnlp.FlatFst
+    '''
+    if weight_bits not in binary_format.WEIGHT_BITS:
+        raise Exception(f'write_binary: unsupported weight bits {weight_bits}')
+    if compression is not None and compression not in binary_format.CODECS:
+        raise Exception(f'write_binary: unsupported compression {compression}')
+    blocked = compression is not None or sharded
+    if prefetch_states and not blocked:
+        raise Exception('write_binary: prefetch_states requires blocks')
+    if flat and blocked:
+        raise Exception('write_binary: flat FST could not be in blocks')
+
+    ilabel_width = binary_format.get_width(len(arrays.isymbols))
+    olabel_width = binary_format.get_width(len(arrays.osymbols))
+    state_width = binary_format.get_width(arrays.num_states)
+    if flat:
+        ilabel_width, olabel_width, state_width = (
+            4 if width == 3 else width
+            for width in (ilabel_width, olabel_width, state_width))
+        arrays = _sort_arcs_by_ilabel(arrays)
+    arc_offsets = _get_arc_offsets(arrays)
+
+    if weight_bits:
+        codes, codebook = quantize_weights(arrays.weights, weight_bits)
+        weights = binary_format.pack_ints(codes, weight_bits // 8)
+    else:
+        codebook = array('f')
+        weights = binary_format.pack_floats(arrays.weights)
+
+    columns = [
+        ('ilabels', binary_format.pack_ints(arrays.ilabels, ilabel_width)),
+        ('olabels', binary_format.pack_ints(arrays.olabels, olabel_width)),
+        ('dest_states',
+         binary_format.pack_ints(arrays.dest_states, state_width)),
+        ('weights', weights),
+    ]
+    isymbols = json.dumps(arrays.isymbols).encode('utf-8')
+    osymbols = json.dumps(arrays.osymbols).encode('utf-8')
+    if compression:
+        isymbols = binary_format.compress(compression, isymbols)
+        osymbols = binary_format.compress(compression, osymbols)
+
+    # sections of binary FST are relative to its header
+    writer = SectionWriter(f, offset=0)
+    writer.write(
+        binary_format.HEADER.pack(binary_format.MAGIC, binary_format.VERSION,
+                                  arrays.num_states, arrays.num_arcs,
+                                  ilabel_width, olabel_width, state_width,
+                                  weight_bits))
+    sections = [
+        ('isymbols', isymbols),
+        ('osymbols', osymbols),
+        ('arc_offsets', binary_format.pack_ints(arc_offsets, 4)),
+        ('final_weights', binary_format.pack_floats(arrays.final_weights)),
+        ('codebook', binary_format.pack_floats(codebook)),
+    ]
+    if prefetch_states:
+        sections.append(('prefetch_states',
+                         binary_format.pack_ints(array('I', prefetch_states),
+                                                 4)))
+    if flat:
+        sections.append(('flags',
+                         binary_format.FLAGS.pack(binary_format.FLAG_FLAT)))
+    if not blocked:
+        sections.extend(columns)
+    for name, data in sections:
+        if flat:
+            writer.pad(8)
+        writer.begin_section(name)
+        writer.write(data)
+        writer.end_section()
+
+    if blocked:
+        _write_arc_blocks(writer, columns, arc_offsets, compression or 'none',
+                          block_states)
+
+    _write_section_table(writer)
+
+
+def _sort_arcs_by_ilabel(arrays: FstArrays) -> FstArrays:
+    ''' returns the FST with arcs of each state sorted by input label, the
+    order of arcs with the same input label is kept '''
+
+    src_states = arrays.src_states
+    ilabels = arrays.ilabels
+    order = sorted(range(arrays.num_arcs),
+                   key=lambda arc: (src_states[arc], ilabels[arc]))
+
+    def reorder(column: array) -> array:
+        return array(column.typecode, map(column.__getitem__, order))
+
+    return FstArrays(reorder(src_states), reorder(ilabels),
+                     reorder(arrays.olabels), reorder(arrays.weights),
+                     reorder(arrays.dest_states), arrays.final_weights,
+                     arrays.isymbols, arrays.osymbols)
+
+
+def _get_arc_offsets(arrays: FstArrays) -> array:
+    ''' returns the offset of the first arc of each state, and the number of
+    arcs. The arcs are sorted by source state '''
+
+    arc_counts = collections.Counter(arrays.src_states)
+    return array(
+        'I',
+        itertools.accumulate(
+            (arc_counts[state] for state in range(arrays.num_states)),
+            initial=0))
+
+
+def _write_arc_blocks(writer: SectionWriter, columns: list[tuple[str, bytes]],
+                      arc_offsets: array, compression: str,
+                      block_states: int) -> None:
+    ''' write the packed arc columns in blocks compressed by codec compression
+    to section arc_blocks, and the offsets and crc32 of blocks to section
+    block_index '''
+
+    num_states = len(arc_offsets) - 1
+    num_arcs = arc_offsets[-1]
+    widths = [len(data) // num_arcs if num_arcs else 0 for _, data in columns]
+
+    writer.begin_section('arc_blocks')
+    block_offsets = array('Q', [0])
+    block_crcs = array('I')
+    for first_state in range(0, num_states, block_states):
+        first_arc = arc_offsets[first_state]
+        last_arc = arc_offsets[min(first_state + block_states, num_states)]
+        block = b''.join(data[first_arc * width:last_arc * width]
+                         for (_, data), width in zip(columns, widths))
+        compressed = binary_format.compress(compression, block)
+        writer.write(compressed)
+        block_crcs.append(zlib.crc32(compressed))
+        block_offsets.append(block_offsets[-1] + len(compressed))
+    writer.end_section()
+
+    writer.begin_section('block_index')
+    writer.write(
+        binary_format.BLOCK_INDEX.pack(binary_format.CODECS[compression],
+                                       block_states))
+    writer.write(binary_format.pack_ints(block_offsets, 8))
+    writer.write(binary_format.pack_ints(block_crcs, 4))
+    writer.end_section()
+
+
+def _write_section_table(writer: SectionWriter) -> None:
+    ''' write the section table and footer of binary format '''
+
+    table_offset = writer.offset
+    for name, (offset, length, crc) in writer.sections.items():
+        writer.write(
+            binary_format.SECTION_ENTRY.pack(name.encode('utf-8'), offset,
+                                             length, crc))
+    writer.write(
+        binary_format.FOOTER.pack(len(writer.sections), table_offset,
+                                  binary_format.MAGIC))
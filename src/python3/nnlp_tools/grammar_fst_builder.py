@@ -1,32 +1,121 @@
 from __future__ import annotations
 
+from typing import Optional
+
+import hashlib
+import json
+import math
+import os
+
 from nnlp_tools.grammar import Grammar
 
 from .common import BNFToken
 from .rule import Rule
-from .util import BNFSyntaxError
+from .lexicon_fst_builder import build_lexicon_word_fst
+from .util import BNFSyntaxError, iter_lexicon
 
-from nnlp.symbol import EPS_SYM
+from nnlp.symbol import EPS_SYM, make_nonterminal_symbol
 
 from nnlp_tools.mutable_fst import MutableFst
 
+# version of the FST cache, change it when the generated FSTs changed
+_CACHE_VERSION = 3
+
+# columns of arcs for MutableFst.add_arcs(): src_states, dest_states, isymbols, osymbols, weights
+_ArcColumns = tuple[list[int], list[int], list[str], list[str], list[float]]
+
+
+def _append_arc(columns: _ArcColumns, src_state: int, dest_state: int, isymbol: str, osymbol: str,
+                weight: float) -> None:
+    r''' append an arc to the columns '''
+
+    for column, value in zip(columns, (src_state, dest_state, isymbol, osymbol, weight)):
+        column.append(value)
+
 
 class GrammarFstBuilder:
-    ''' generate FST from grammar '''
+    ''' generate FST from grammar. Each class is compiled only once into its own FST, and the
+    references to it are arcs with its nonterminal symbol as output. The rules of a class share its
+    start and final states and weights are folded onto the first arc of rules, so the generated FSTs
+    are epsilon-free. !read_lexicon("<lexicon-file>") is compiled by build_lexicon_word_fst() into
+    an epsilon-free sub-FST, and it's cached by the content hash of lexicon file, so that the
+    grammars built by the same builder could reuse it.
+    When cache_dir is set, the FST of each class and each lexicon is also cached on disk, keyed by
+    the hash of the arcs generated from its rules, or the content hash of lexicon file. Since the
+    other classes are referenced by nonterminal arcs, the FST of a class only changes when its own
+    rules change, so after editing a grammar only the edited classes are compiled again. The
+    replaced FST of the whole grammar is cached by the keys of all its classes, so an unchanged
+    grammar is loaded from cache without compiling. Cache files are written to temporary files and
+    renamed, and the meta file is written at last, so a cache entry is valid only if its meta file
+    exists.
+    Args:
+        minimize_classes (bool): determinize and minimize the FST of each class
+        cache_dir (str): directory of the class FST cache, no cache if it's None
+        lexicon_escaped (bool): true if the lexicon files of !read_lexicon are escaped, see
+            read_lexicon() '''
+
+    def __init__(self,
+                 minimize_classes: bool = False,
+                 cache_dir: Optional[str] = None,
+                 lexicon_escaped: bool = False) -> None:
+        self._minimize_classes = minimize_classes
+        self._lexicon_escaped = lexicon_escaped
+        self._cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # content hash of lexicon file -> FST of the lexicon
+        self._lexicon_fsts: dict[str, MutableFst] = {}
 
     def __call__(self, grammar: Grammar, mutable_fst: MutableFst) -> None:
-        r''' generate FST from grammar, and write the FST to file using fst_writer
+        r''' generate FST from grammar, and write the FST to mutable_fst. FSTs of the classes are
+        replaced into the root one, and the epsilon arcs of calls and returns are removed
              Args:
                  grammar (Grammar): the grammar to build FST
-                 fst_writer (FstWriter): the fst writer'''
+                 mutable_fst (MutableFst): the FST to write'''
+
+        self._begin(grammar, mutable_fst)
+        cache_prefix = self._get_grammar_cache_prefix() if self._cache_dir else None
+        if cache_prefix:
+            cached_fst = self._read_cache(cache_prefix)
+            if cached_fst is not None:
+                self._copy_fst(cached_fst, mutable_fst)
+                return
+
+        self._generate_class(grammar.root_class, [], mutable_fst)
+        if self._class_fsts:
+            mutable_fst.replace(self._class_fsts)
+            mutable_fst.rmepsilon()
+
+        if cache_prefix:
+            self._write_cache(cache_prefix, mutable_fst)
+
+    def build_classes(self, grammar: Grammar, mutable_fst: MutableFst) -> dict[str, MutableFst]:
+        r''' generate FST of root class to mutable_fst and one FST for each class it references,
+        the nonterminal arcs are kept. So that the size is linear to the grammar, and these FSTs could
+        be decoded by nnlp.ReplaceFst
+             Args:
+                 grammar (Grammar): the grammar to build FST
+                 mutable_fst (MutableFst): the FST to write root class
+             Returns:
+                 dict of nonterminal symbol -> FST of the class'''
+
+        self._begin(grammar, mutable_fst)
+        self._generate_class(grammar.root_class, [], mutable_fst)
+        return self._class_fsts
+
+    def _begin(self, grammar: Grammar, mutable_fst: MutableFst) -> None:
+        r''' reset the states of building grammar to mutable_fst '''
 
         self._grammar = grammar
         self._mutable_fst = mutable_fst
+        self._class_fsts: dict[str, MutableFst] = {}
+
+        # name of class -> (rule, arcs) of its rules
+        self._class_rule_arcs: dict[str, list[tuple[Rule, list[tuple[str, str]]]]] = {}
 
-        # build the FST
-        begin_state = 0
-        final_state = self._generate_class(grammar.root_class, [], begin_state)
-        mutable_fst.set_final_state(final_state)
+        # lexicon file -> its content hash, each file is read only once for a grammar
+        self._lexicon_digests: dict[str, str] = {}
 
     def _get_symbols(self, token: BNFToken, symbol_type: str) -> list[str]:
         r''' get symbols from a token, return list[str]. symbol_type == 'i' for input
@@ -49,8 +138,8 @@ class GrammarFstBuilder:
 
         return symbols
 
-    def _generate_class(self, name: str, class_history: list[str], src_state: int) -> int:
-        r''' generate FST for one class, returns the last state '''
+    def _generate_class(self, name: str, class_history: list[str], fst: MutableFst) -> None:
+        r''' generate FST for one class from state 0 of fst '''
 
         # check class history to avoid dead loop. FST only accept regular grammer, and we are using
         # flag '*' for repeating. Hence, the class dependency graph should be a DAG.
@@ -60,78 +149,239 @@ class GrammarFstBuilder:
         class_history = class_history.copy()
         class_history.append(name)
 
-        rules = self._grammar.rule_set[name]
-        dest_state = self._mutable_fst.create_state()
-
-        # if there is more than 1 rules in the class, we need the disambig symbol
-        need_disambig = len(rules) > 1
-
-        for rule in rules:
-            state = self._generate_rule(rule, class_history, src_state)
-            self._mutable_fst.add_arc(state, dest_state, EPS_SYM, EPS_SYM)
-
-        return dest_state
-
-    def _generate_token(self, token: BNFToken, class_history: list[str], src_state: int,
-                        weight: float) -> int:
-        r''' generate FST for one token, returns the last state '''
+        # generate the classes and lexicons referenced by the rules
+        for rule in self._grammar.rule_set[name]:
+            for token in rule.tokens:
+                if token.type == BNFToken.CLASS:
+                    assert token.value
+                    self._generate_referenced_class(token.value, class_history)
+                elif token.type == BNFToken.MACRO_READ_LEXICON:
+                    assert token.value
+                    self._generate_lexicon(token.value)
+
+        rule_arcs = self._get_class_rule_arcs(name)
+        cache_prefix = None
+        if self._cache_dir:
+            cache_prefix = self._get_cache_prefix(['class', self._get_rule_keys(rule_arcs)])
+            cached_fst = self._read_cache(cache_prefix)
+            if cached_fst is not None:
+                self._copy_fst(cached_fst, fst)
+                return
+
+        # all rules start from state 0 and end at final_state. Instead of epsilon arcs, empty rules
+        # and repeat rules make state 0 final. The arcs are collected as columns and added at last
+        columns: _ArcColumns = ([], [], [], [], [])
+        final_state = None
+        start_final_weight = math.inf
+        for rule, arcs in rule_arcs:
+            if not arcs or rule.flag == '*':
+                start_final_weight = min(start_final_weight, rule.weight)
+            if not arcs:
+                continue
+
+            if rule.flag == '*':
+                # loop_state -> ... -> loop_state, and the first arc is copied from state 0 to enter
+                # the loop
+                loop_state = fst.create_state()
+                fst.set_final_state(loop_state)
+                state = self._generate_arcs(fst, columns, arcs, loop_state, loop_state, 0)
+                isym, osym = arcs[0]
+                _append_arc(columns, 0, state, isym, osym, rule.weight)
+            else:
+                if final_state is None:
+                    final_state = fst.create_state()
+                    fst.set_final_state(final_state)
+                self._generate_arcs(fst, columns, arcs, 0, final_state, rule.weight)
+
+        fst.add_arcs(*columns)
+
+        if math.isfinite(start_final_weight):
+            fst.set_final_state(0, start_final_weight)
+
+        if self._minimize_classes:
+            fst.minimize_encoded()
+
+        if cache_prefix:
+            self._write_cache(cache_prefix, fst)
+
+    def _generate_referenced_class(self, name: str, class_history: list[str]) -> None:
+        r''' generate the FST of a class referenced by nonterminal arcs if not exist '''
+
+        symbol = make_nonterminal_symbol(name)
+        if symbol not in self._class_fsts:
+            class_fst = self._mutable_fst.create_fst(name=name)
+            self._generate_class(name, class_history, class_fst)
+            self._class_fsts[symbol] = class_fst
+
+    def _get_class_rule_arcs(self, name: str) -> list[tuple[Rule, list[tuple[str, str]]]]:
+        r''' get (rule, arcs) of the rules of a class '''
+
+        rule_arcs = self._class_rule_arcs.get(name)
+        if rule_arcs is None:
+            rule_arcs = [(rule, self._get_rule_arcs(rule)) for rule in self._grammar.rule_set[name]]
+            self._class_rule_arcs[name] = rule_arcs
+
+        return rule_arcs
+
+    def _get_rule_keys(self, rule_arcs: list[tuple[Rule, list[tuple[str, str]]]]) -> list:
+        r''' get the part of cache key of a class from the arcs of its rules '''
+        return sorted((rule.flag, rule.weight, arcs) for rule, arcs in rule_arcs)
+
+    def _get_grammar_cache_prefix(self) -> str:
+        r''' get the cache file prefix of the FST of whole grammar, from the rules of all classes
+        reachable from the root class. The lexicons are keyed by their hash in nonterminal arcs '''
+
+        class_keys = []
+        visited: set[str] = set()
+        names = [self._grammar.root_class]
+        while names:
+            name = names.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+
+            rule_arcs = self._get_class_rule_arcs(name)
+            class_keys.append([name, self._get_rule_keys(rule_arcs)])
+            for rule, _ in rule_arcs:
+                names.extend(token.value for token in rule.tokens
+                             if token.type == BNFToken.CLASS and token.value)
+
+        return self._get_cache_prefix(['grammar', self._grammar.root_class, sorted(class_keys)])
+
+    def _get_cache_prefix(self, key: list) -> str:
+        r''' get the cache file prefix from the key of cached FST '''
+
+        assert self._cache_dir
+        key_json = json.dumps([_CACHE_VERSION, self._minimize_classes, self._lexicon_escaped] + key)
+        digest = hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+        return os.path.join(self._cache_dir, digest)
+
+    def _read_cache(self, prefix: str) -> Optional[MutableFst]:
+        r''' read the cached FST, returns None if not exist '''
+
+        # meta file is written at last, so the cache is valid if it exists
+        if not os.path.exists(f'{prefix}.json'):
+            return None
+
+        with open(f'{prefix}.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        return MutableFst.read(prefix, name=meta['name'])
+
+    def _write_cache(self, prefix: str, fst: MutableFst) -> None:
+        r''' write the FST to cache. Files are written to temporary names and renamed, so that a
+        concurrent build never reads a partially written cache '''
+
+        tmp_prefix = f'{prefix}.{os.getpid()}.tmp'
+        fst.write(tmp_prefix)
+        for suffix in ('fst', 'isyms.txt', 'osyms.txt'):
+            os.replace(f'{tmp_prefix}.{suffix}', f'{prefix}.{suffix}')
+
+        with open(f'{tmp_prefix}.json', 'w', encoding='utf-8') as f:
+            json.dump(dict(version=_CACHE_VERSION, name=fst.name), f)
+        os.replace(f'{tmp_prefix}.json', f'{prefix}.json')
+
+    def _copy_fst(self, src_fst: MutableFst, dest_fst: MutableFst) -> None:
+        r''' copy src_fst to dest_fst by symbols, state 0 of src_fst is mapped to state 0 of
+        dest_fst. The arcs are copied by columns '''
+
+        arrays = src_fst.to_arrays()
+        state_map = [0] + [dest_fst.create_state() for _ in range(1, arrays.num_states)]
+        dest_fst.add_arcs(list(map(state_map.__getitem__, arrays.src_states)),
+                          list(map(state_map.__getitem__, arrays.dest_states)),
+                          list(map(arrays.isymbols.__getitem__, arrays.ilabels)),
+                          list(map(arrays.osymbols.__getitem__, arrays.olabels)), arrays.weights)
+        for state, weight in arrays.final_states().items():
+            dest_fst.set_final_state(state_map[state], weight)
+
+    def _generate_arcs(self, fst: MutableFst, columns: _ArcColumns, arcs: list[tuple[str, str]],
+                       src_state: int, dest_state: int, weight: float) -> int:
+        r''' generate a path of arcs from src_state to dest_state, the weight is added to the first
+        arc. The states are created in fst and the arcs are appended to columns. Returns the state
+        after the first arc '''
+
+        first_state = dest_state
+        state = src_state
+        for i, (isym, osym) in enumerate(arcs):
+            next_state = dest_state if i == len(arcs) - 1 else fst.create_state()
+            _append_arc(columns, state, next_state, isym, osym, weight)
+            weight = 0
+            if i == 0:
+                first_state = next_state
+            state = next_state
 
-        dest_state = src_state
+        return first_state
 
-        # weight will add only once and the weight for remaining arcs is zero
+    def _get_token_arcs(self, token: BNFToken) -> list[tuple[str, str]]:
+        r''' get (isymbol, osymbol) of arcs for one token '''
 
         if token.type == BNFToken.SYMBOL:
             isymbols = self._get_symbols(token, 'i')
             osymbols = self._get_symbols(token, 'o')
             assert len(isymbols) == len(osymbols)
-
-            for isym, osym in zip(isymbols, osymbols):
-                state = self._mutable_fst.create_state()
-                self._mutable_fst.add_arc(dest_state, state, isym, osym, weight)
-                weight = 0
-                dest_state = state
+            return list(zip(isymbols, osymbols))
 
         elif token.type == BNFToken.I_SYMBOL:
-            isymbols = self._get_symbols(token, 'i')
-            for isym in isymbols:
-                state = self._mutable_fst.create_state()
-                self._mutable_fst.add_arc(dest_state, state, isym, EPS_SYM, weight)
-                weight = 0
-                dest_state = state
+            return [(isym, EPS_SYM) for isym in self._get_symbols(token, 'i')]
 
         elif token.type == BNFToken.O_SYMBOL:
-            osymbols = self._get_symbols(token, 'o')
-            for osym in osymbols:
-                state = self._mutable_fst.create_state()
-                self._mutable_fst.add_arc(dest_state, state, EPS_SYM, osym, weight)
-                weight = 0
-                dest_state = state
+            return [(EPS_SYM, osym) for osym in self._get_symbols(token, 'o')]
 
         elif token.type == BNFToken.CLASS:
             assert token.value
-            dest_state = self._generate_class(token.value, class_history, dest_state)
+            return [(EPS_SYM, make_nonterminal_symbol(token.value))]
 
-        return dest_state
-
-    def _generate_rule(self, rule: Rule, class_history: list[str], src_state: int) -> int:
-        r''' generate FST from one single rule, returns the last state '''
-
-        start_state = src_state
-        weight = rule.weight
-        if rule.flag == '*':
-            # we need an additional state for repeat rules
-            start_state = self._mutable_fst.create_state()
-            self._mutable_fst.add_arc(src_state, start_state, EPS_SYM, EPS_SYM, weight)
-            weight = 0
-
-        # generate FST for each rule
-        state = start_state
+        elif token.type == BNFToken.MACRO_READ_LEXICON:
+            assert token.value
+            return [(EPS_SYM, self._get_lexicon_symbol(token.value))]
+
+        return []
+
+    def _get_lexicon_symbol(self, filename: str) -> str:
+        r''' returns the nonterminal symbol of lexicon file, it's named by the content hash '''
+
+        digest = self._lexicon_digests.get(filename)
+        if digest is None:
+            file_hash = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    file_hash.update(chunk)
+            digest = file_hash.hexdigest()
+            self._lexicon_digests[filename] = digest
+
+        return make_nonterminal_symbol(f'lexicon:{digest}')
+
+    def _generate_lexicon(self, filename: str) -> None:
+        r''' generate the sub-FST for lexicon file if not exist '''
+
+        symbol = self._get_lexicon_symbol(filename)
+        if symbol in self._class_fsts:
+            return
+
+        digest = self._lexicon_digests[filename]
+        if digest not in self._lexicon_fsts:
+            cache_prefix = None
+            lexicon_fst = None
+            if self._cache_dir:
+                cache_prefix = self._get_cache_prefix(['lexicon', digest])
+                lexicon_fst = self._read_cache(cache_prefix)
+            if lexicon_fst is None:
+                lexicon_fst = build_lexicon_word_fst(iter_lexicon(filename, self._lexicon_escaped),
+                                                     name=filename)
+                if cache_prefix:
+                    self._write_cache(cache_prefix, lexicon_fst)
+            self._lexicon_fsts[digest] = lexicon_fst
+
+        # copy the cached FST, since its symbol tables are different from the grammar
+        class_fst = self._mutable_fst.create_fst(name=filename)
+        self._copy_fst(self._lexicon_fsts[digest], class_fst)
+        self._class_fsts[symbol] = class_fst
+
+    def _get_rule_arcs(self, rule: Rule) -> list[tuple[str, str]]:
+        r''' get (isymbol, osymbol) of arcs for one single rule '''
+
+        arcs: list[tuple[str, str]] = []
         for token in rule.tokens:
-            state = self._generate_token(token, class_history, state, weight)
-
-        # add an epsilon arc from state to start_state if we have a repeat flag
-        if rule.flag == '*':
-            self._mutable_fst.add_arc(state, start_state, EPS_SYM, EPS_SYM)
-            state = start_state
+            arcs.extend(self._get_token_arcs(token))
 
-        return state
+        return arcs
@@ -1,31 +1,209 @@
 ''' generate FST from lexicon '''
 from __future__ import annotations
-from typing import Sequence, TYPE_CHECKING
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Sequence, TYPE_CHECKING
+
+import collections
+import functools
+import itertools
+import math
+import os
+import pywrapfst
 
 from nnlp.symbol import EPS_SYM, make_disambig_symbol
+from .fst_arrays import export_arrays
 from .mutable_fst import MutableFst
+from .util import sort_lexicon
 
 if TYPE_CHECKING:
-    Lexicon = list[tuple[str, Sequence[str], float]]
+    LexiconEntry = tuple[str, Sequence[str], float]
+    Lexicon = list[LexiconEntry]
+
+    # (symbol, state, min weight, number of entries, word) of a closed trie node
+    _TrieChild = tuple[str, int, float, int, str]
 
+# max number of arcs buffered by the lexicon builders before adding them
+_ARC_BATCH_SIZE = 65536
 
-def build_lexicon_fst(lexicon: Lexicon, name: str = 'L') -> MutableFst:
+
+def build_lexicon_fst(lexicon: Iterable[LexiconEntry],
+                      name: str = 'L',
+                      minimal: bool = False) -> MutableFst:
     '''
     Build a FST for input lexicon, returns the MutableFst. it will add disambig
     symbols automatically
+    Args:
+        lexicon: The input lexicon
+        minimal: true to build the deterministic and minimal FST directly with
+            MinimalLexiconFstBuilder instead of one chain of states per entry.
+            In both modes lexicon is consumed incrementally and sorted by
+            sort_lexicon(), so it could be a generator larger than memory
+    Returns:
+        the FST for lexicon (after add disambig symbols)
+    '''
+
+    mutable_fst = MutableFst(name=name)
+    if minimal:
+        MinimalLexiconFstBuilder()(sort_lexicon(lexicon), mutable_fst)
+    else:
+        LexiconFstBuilder().add_sorted(sort_lexicon(lexicon), mutable_fst)
+
+    return mutable_fst
+
+
+def build_lexicon_word_fst(lexicon: Iterable[LexiconEntry],
+                           name: str = 'L') -> MutableFst:
+    '''
+    Build a FST that accepts exactly one entry of the lexicon, it is used as
+    a sub-graph of other FSTs, like a slot in grammar. The FST is epsilon-free
+    and has no disambig symbols. It's built by MinimalLexiconFstBuilder
+    without disambig symbols, so the entries share their prefixes and the
+    word is emitted on the arc where the path becomes unique. An entry that
+    is the same as or a prefix of another one has its own last arc to the
+    final state, which emits the word.
     Args:
         lexicon: The input lexicon
+    Returns:
+        the FST for lexicon (without disambig symbols)
+    '''
+
+    mutable_fst = MutableFst(name=name)
+    final_state = mutable_fst.create_state()
+    MinimalLexiconFstBuilder(disambig=False)(sort_lexicon(lexicon),
+                                             mutable_fst, final_state)
+
+    return mutable_fst
+
+
+def build_sharded_lexicon_fst(lexicon: Iterable[LexiconEntry],
+                              name: str = 'L',
+                              minimal: bool = False,
+                              num_workers: Optional[int] = None,
+                              shard_size: int = 100000) -> MutableFst:
+    '''
+    Build the determinized and minimized FST for input lexicon in parallel.
+    Entries are partitioned by their first symbol, since the sub-graphs under
+    state 0 for different first symbols are independent. The lexicon is
+    sorted by sort_lexicon() and cut into shards as it streams, each shard is
+    built, determinized and minimized in a process pool, then all shards are
+    stitched under the shared state 0.
+    Args:
+        lexicon: The input lexicon, could be a generator larger than memory
+        minimal: true to build shards with MinimalLexiconFstBuilder instead of
+            determinize() and minimize()
+        num_workers: number of processes, defaults to the number of CPUs
+        shard_size: number of entries in each shard, the entries with the
+            same first symbol are never split, so a shard could be larger
     Returns:
         the FST for lexicon (after add disambig symbols)
     '''
 
+    num_workers = num_workers or os.cpu_count() or 1
+
+    # columns of the arcs of all shards, they are added at once in the end
     mutable_fst = MutableFst(name=name)
-    fst_builder = LexiconFstBuilder()
-    fst_builder(lexicon, mutable_fst)
+    columns: tuple[list[int], list[int], list[int], list[int],
+                   list[float]] = ([], [], [], [], [])
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        build_shard = functools.partial(_build_lexicon_shard, minimal=minimal)
 
+        # only 2 shards per worker are held in memory
+        pending: collections.deque[Future] = collections.deque()
+        for shard in _partition_lexicon(sort_lexicon(lexicon), shard_size):
+            pending.append(executor.submit(build_shard, shard))
+            if len(pending) >= num_workers * 2:
+                _add_lexicon_shard(mutable_fst, columns,
+                                   *pending.popleft().result())
+        while pending:
+            _add_lexicon_shard(mutable_fst, columns,
+                               *pending.popleft().result())
+
+    mutable_fst.add_arcs(*columns)
+    mutable_fst.set_final_state(0)
     return mutable_fst
 
 
+def _partition_lexicon(lexicon: Iterable[LexiconEntry],
+                       shard_size: int) -> Iterator[Lexicon]:
+    ''' partition the lexicon sorted by symbols into shards of about
+    shard_size entries, entries with the same first symbol are in the same
+    shard '''
+
+    shard: Lexicon = []
+    for _, group in itertools.groupby(lexicon, key=_first_symbol):
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+        shard.extend(group)
+
+    if shard:
+        yield shard
+
+
+def _first_symbol(entry: LexiconEntry) -> str:
+    ''' returns the first symbol of lexicon entry '''
+
+    _, symbols, _ = entry
+    if not symbols:
+        raise Exception(f'invalid lexicon entry: {entry}')
+
+    return symbols[0]
+
+
+def _build_lexicon_shard(
+        lexicon: Lexicon,
+        minimal: bool) -> tuple[bytes, list[tuple[int, str]], list[tuple[int, str]]]:
+    ''' build FST for one shard of lexicon in worker process. Returns the
+    serialized FST, its input symbols and output symbols '''
+
+    mutable_fst = build_lexicon_fst(lexicon, minimal=minimal)
+    if not minimal:
+        mutable_fst.determinize(inplace=True).minimize(inplace=True)
+
+    return (mutable_fst._fst.write_to_string(), list(mutable_fst._isymbols),
+            list(mutable_fst._osymbols))
+
+
+def _add_lexicon_shard(mutable_fst: MutableFst,
+                       columns: tuple[list[int], list[int], list[int],
+                                      list[int], list[float]],
+                       fst_data: bytes, isymbols: list[tuple[int, str]],
+                       osymbols: list[tuple[int, str]]) -> None:
+    ''' add the states of a lexicon shard to mutable_fst and its arcs to the
+    columns, the start state of shard is merged into state 0. The shard is
+    exported by export_arrays(), and the states and symbol-ids are relabeled
+    column by column. Symbols are mapped by their string values, so the
+    symbol tables are consistent across shards '''
+
+    shard_fst = pywrapfst.VectorFst.read_from_string(fst_data)
+    arrays = export_arrays(shard_fst, [], [])
+
+    # states of shard are appended to mutable_fst in order, except the start
+    state_map = list(mutable_fst.create_states(arrays.num_states - 1))
+    state_map.insert(shard_fst.start(), 0)
+
+    ilabel_map = dict(
+        zip((symbol_id for symbol_id, _ in isymbols),
+            mutable_fst._isymbols.get_ids([symbol for _, symbol in isymbols],
+                                          mutable_fst._isymbols_readonly)))
+    olabel_map = dict(
+        zip((symbol_id for symbol_id, _ in osymbols),
+            mutable_fst._osymbols.get_ids([symbol for _, symbol in osymbols],
+                                          mutable_fst._osymbols_readonly)))
+
+    columns[0].extend(map(state_map.__getitem__, arrays.src_states))
+    columns[1].extend(map(state_map.__getitem__, arrays.dest_states))
+    columns[2].extend(map(ilabel_map.__getitem__, arrays.ilabels))
+    columns[3].extend(map(olabel_map.__getitem__, arrays.olabels))
+    columns[4].extend(arrays.weights)
+
+    for state in itertools.compress(range(arrays.num_states),
+                                    map(math.isfinite, arrays.final_weights)):
+        if state != shard_fst.start():
+            mutable_fst.set_final_state(state_map[state],
+                                        arrays.final_weights[state])
+
+
 class LexiconFstBuilder:
     r''' generate FST from lexicon '''
 
@@ -39,6 +217,32 @@ class LexiconFstBuilder:
             intermediate lexicon after adding diambig symbols'''
 
         disambig_lexicon = self._add_disambig(lexicon)
+        self._add_chains(disambig_lexicon, mutable_fst)
+
+        return disambig_lexicon
+
+    def add_sorted(self, lexicon: Iterable[LexiconEntry],
+                   mutable_fst: MutableFst) -> None:
+        '''
+        build FST from the lexicon sorted by symbols, like sort_lexicon()
+        does. Unlike __call__(), the lexicon is consumed incrementally, since
+        the disambig symbols of a sorted lexicon only depend on the next
+        entry. Disambig ids of the same symbols follow the order in lexicon
+        Args:
+            lexicon: lexicon with (word, symbols, weight) sorted by symbols
+            mutable_fst (MutableFst): the FST to write
+        '''
+
+        self._add_chains(_iter_sorted_disambig(lexicon, True), mutable_fst)
+
+    def _add_chains(self, disambig_lexicon: Iterable[LexiconEntry],
+                    mutable_fst: MutableFst) -> None:
+        ''' add one chain of states from state 0 to state 0 for each entry of
+        the lexicon with disambig symbols '''
+
+        # columns of arcs, they are added by add_arcs() in batches
+        columns: tuple[list[int], list[int], list[str], list[str],
+                       list[float]] = ([], [], [], [], [])
         for word, symbols, weight in disambig_lexicon:
             state = 0
             if not word or not symbols:
@@ -52,13 +256,18 @@ class LexiconFstBuilder:
                     symbols) - 1 else mutable_fst.create_state()
                 osymbol: str = word if idx == 0 else EPS_SYM
 
-                mutable_fst.add_arc(state, next_state, symbol, osymbol,
-                                    arc_weight)
+                for column, value in zip(
+                        columns,
+                    (state, next_state, symbol, osymbol, arc_weight)):
+                    column.append(value)
                 state = next_state
 
-        mutable_fst.set_final_state(0)
+            if len(columns[0]) >= _ARC_BATCH_SIZE:
+                mutable_fst.add_arcs(*columns)
+                columns = ([], [], [], [], [])
 
-        return disambig_lexicon
+        mutable_fst.add_arcs(*columns)
+        mutable_fst.set_final_state(0)
 
     def _add_disambig(self, lexicon: Lexicon) -> Lexicon:
         ''' add disambiguation symbols to lexicon in order to make make decoding graphs
@@ -69,37 +278,214 @@ class LexiconFstBuilder:
         Returns:
             lexicon after adding disambiguation symbols '''
 
-        disambig_lexicon: Lexicon = []
-
-        # compute prefix and disambiguation set
-        prefix: set[tuple[str, ...]] = set()
-        all_symbol_seq: set[tuple[str, ...]] = set()
-        ambig_symbol_seq: set[tuple[str, ...]] = set()
+        # build the prefix trie of all symbol sequences
+        root = _TrieNode()
         for _, symbols, _ in lexicon:
-            symbols = tuple(symbols)
-            for idx in range(1, len(symbols)):
-                prefix.add(tuple(symbols[:idx]))
-
-            if symbols in all_symbol_seq:
-                ambig_symbol_seq.add(symbols)
-            all_symbol_seq.add(symbols)
+            node = root
+            for symbol in symbols:
+                node = node.get_or_add_child(symbol)
+            node.num_entries += 1
 
-        # free all_symbol_seq
-        all_symbol_seq = set()
-
-        disambig: dict[tuple[str, ...], int] = {}
+        # a symbol sequence is ambiguous if it occurs more than once or it is
+        # a prefix of another one. Disambig ids start from #1 for each
+        # ambiguous sequence, so only #1 ... #N are added to the symbol table,
+        # where N is the size of the largest group of ambiguous entries
+        disambig_lexicon: Lexicon = []
         for word, symbols, weight in lexicon:
-            symbols = tuple(symbols)
+            node = root
+            for symbol in symbols:
+                node = node.children[symbol]
+
             disambig_symbols: tuple[str, ...] = tuple(symbols)
-            if symbols in disambig:
-                disambig[symbols] += 1
-                disambig_symbols += (make_disambig_symbol(disambig[symbols]),)
-            elif symbols in prefix or symbols in ambig_symbol_seq:
-                disambig[symbols] = 1
-                disambig_symbols += (make_disambig_symbol(disambig[symbols]),)
-            else:
-                disambig[symbols] = 0
+            if node.num_entries > 1 or node.children:
+                node.disambig_id += 1
+                disambig_symbols += (make_disambig_symbol(node.disambig_id),)
 
             disambig_lexicon.append((word, disambig_symbols, weight))
 
         return disambig_lexicon
+
+
+class _TrieNode:
+    r''' node of the prefix trie of symbol sequences in lexicon '''
+
+    __slots__ = ('children', 'num_entries', 'disambig_id')
+
+    def __init__(self) -> None:
+        self.children: dict[str, _TrieNode] = {}
+
+        # number of lexicon entries ends at this node
+        self.num_entries = 0
+
+        # last disambig id assigned to the entries ends at this node
+        self.disambig_id = 0
+
+    def get_or_add_child(self, symbol: str) -> _TrieNode:
+        ''' returns the child node by symbol, create it if not exist '''
+
+        node = self.children.get(symbol)
+        if node is None:
+            node = _TrieNode()
+            self.children[symbol] = node
+
+        return node
+
+
+class MinimalLexiconFstBuilder:
+    r''' generate the deterministic and minimal FST from lexicon in a single pass.
+
+    The lexicon MUST be sorted by symbols. Entries are inserted into a trie one
+    by one, and once a trie node will never be changed again (the next entry
+    does not share its prefix) it is replaced by an equivalent registered state
+    or registered as a new one (Daciuk et al. 2000). Weights are pushed towards
+    state 0 and the word is emitted as soon as the path is unique, so the
+    output is the same as determinize() and minimize() on the FST generated by
+    LexiconFstBuilder, without building the intermediate graphs.
+    When disambig is false, no disambig symbols are added. The entries that
+    are the same as or a prefix of another one end with their own arc to the
+    final state instead, so the FST is not deterministic on these arcs.
+    '''
+
+    def __init__(self, disambig: bool = True) -> None:
+        self._disambig = disambig
+
+    def __call__(self,
+                 lexicon: Iterable[LexiconEntry],
+                 mutable_fst: MutableFst,
+                 final_state: int = 0) -> None:
+        '''
+        build FST from the sorted lexicon and write it to mutable_fst
+        Args:
+            lexicon: lexicon with (word, symbols, weight) sorted by symbols
+            mutable_fst (MutableFst): the FST to write
+            final_state (int): the state where all entries end. By default
+                it's state 0, so the FST accepts any sequence of entries
+        '''
+
+        self._mutable_fst = mutable_fst
+        self._register: dict[tuple[tuple[str, str, float, int], ...], int] = {}
+
+        # columns of arcs not added to mutable_fst yet
+        self._arc_columns: tuple[list[int], list[int], list[str], list[str],
+                                 list[float]] = ([], [], [], [], [])
+
+        # path[d] is the children list of the open trie node in depth d, which
+        # is reached by prev_symbols[:d]. path[0] is state 0
+        path: list[list[_TrieChild]] = [[]]
+        prev_symbols: tuple[str, ...] = ()
+        for word, symbols, weight in _iter_sorted_disambig(
+                lexicon, self._disambig):
+            prefix_len = 0
+            while prefix_len < len(prev_symbols) and symbols[
+                    prefix_len] == prev_symbols[prefix_len]:
+                prefix_len += 1
+
+            # the node reached by prev_symbols is not open since its entry
+            # goes to the final state, it's opened when prev_symbols is a
+            # prefix of symbols (only without disambig symbols)
+            self._close_nodes(path, prev_symbols, prefix_len)
+            while len(path) < len(symbols):
+                path.append([])
+
+            # the last symbol goes to the final state
+            path[-1].append((symbols[-1], final_state, weight, 1, word))
+            prev_symbols = symbols
+
+        self._close_nodes(path, prev_symbols, 0)
+        for symbol, state, min_weight, num_entries, word in path[0]:
+            osymbol = word if num_entries == 1 else EPS_SYM
+            self._add_arc(0, state, symbol, osymbol, min_weight)
+        self._flush_arcs()
+        mutable_fst.set_final_state(final_state)
+
+        self._register = {}
+
+    def _close_nodes(self, path: list[list[_TrieChild]],
+                     symbols: tuple[str, ...], depth: int) -> None:
+        ''' close the open trie nodes deeper than depth, and add them as
+        children of their parents '''
+
+        while len(path) > depth + 1:
+            children = path.pop()
+            path[-1].append((symbols[len(path) - 1],) +
+                            self._replace_or_register(children))
+
+    def _replace_or_register(
+            self, children: list[_TrieChild]) -> tuple[int, float, int, str]:
+        ''' get the state for a closed trie node, create a new one if no
+        equivalent state registered. Returns (state, min weight, number of
+        entries, word) '''
+
+        min_weight = min(map(lambda child: child[2], children))
+        num_entries = sum(map(lambda child: child[3], children))
+
+        arcs: list[tuple[str, str, float, int]] = []
+        for symbol, state, weight, child_entries, word in children:
+            # the word is emitted on the arc where the path becomes unique
+            osymbol = word if num_entries > 1 and child_entries == 1 else EPS_SYM
+            arcs.append((symbol, osymbol, weight - min_weight, state))
+
+        signature = tuple(arcs)
+        if signature not in self._register:
+            src_state = self._mutable_fst.create_state()
+            for symbol, osymbol, weight, dest_state in arcs:
+                self._add_arc(src_state, dest_state, symbol, osymbol, weight)
+            self._register[signature] = src_state
+
+        return (self._register[signature], min_weight, num_entries,
+                children[0][4])
+
+    def _add_arc(self, src_state: int, dest_state: int, isymbol: str,
+                 osymbol: str, weight: float) -> None:
+        ''' add an arc to the columns, they are flushed to mutable_fst in
+        batches '''
+
+        for column, value in zip(
+                self._arc_columns,
+            (src_state, dest_state, isymbol, osymbol, weight)):
+            column.append(value)
+
+        if len(self._arc_columns[0]) >= _ARC_BATCH_SIZE:
+            self._flush_arcs()
+
+    def _flush_arcs(self) -> None:
+        ''' add the arcs in columns to mutable_fst '''
+
+        self._mutable_fst.add_arcs(*self._arc_columns)
+        self._arc_columns = ([], [], [], [], [])
+
+
+def _iter_sorted_disambig(lexicon: Iterable[LexiconEntry],
+                          disambig: bool) -> Iterator[LexiconEntry]:
+    ''' add disambiguation symbols to the sorted lexicon, the same as
+    LexiconFstBuilder._add_disambig(). Since lexicon is sorted, a sequence is
+    ambiguous iff the next entry starts with it. Only the entries are checked
+    if disambig is false '''
+
+    entries = iter(lexicon)
+    prev_symbols: tuple[str, ...] = ()
+    disambig_id = 0
+    entry = next(entries, None)
+    while entry is not None:
+        next_entry = next(entries, None)
+        word, symbols, weight = entry
+        if not word or not symbols:
+            raise Exception(f'invalid lexicon entry: {entry}')
+
+        symbols = tuple(symbols)
+        if symbols < prev_symbols:
+            raise Exception(f'lexicon is not sorted by symbols: {entry}')
+
+        if symbols == prev_symbols:
+            disambig_id += 1
+        elif next_entry and tuple(next_entry[1][:len(symbols)]) == symbols:
+            disambig_id = 1
+        else:
+            disambig_id = 0
+
+        prev_symbols = symbols
+        if disambig_id and disambig:
+            symbols += (make_disambig_symbol(disambig_id),)
+        yield (word, symbols, weight)
+
+        entry = next_entry
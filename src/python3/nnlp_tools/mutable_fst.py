@@ -1,16 +1,40 @@
 from __future__ import annotations
 
 import pywrapfst
-import pyfstext
+import itertools
 import math
-import json
-from typing import Iterator, Union, Optional
-from nnlp.symbol import EPS_SYM, is_disambig_symbol
+import operator
+import io
+from typing import IO, Iterator, Optional, Sequence, TypeVar, Union
+try:
+    import pyfstext
+except ImportError:
+    # only needed by the local epsilon removal
+    pyfstext = None
+from nnlp.symbol import is_disambig_symbol
 from nnlp.fst import Fst
+from .fst_arrays import FstArrays, export_arrays, import_arrays, round_float32
+from .fst_writer import hot_states, write_binary, write_json
 from .symbol_table import SymbolTable
 
 NAN = float('nan')
 
+# add_arcs() rebuilds the graph by import_arrays() when there are at least
+# _MIN_IMPORT_ARCS arcs to add, and the number of arcs in the graph is at most
+# _IMPORT_RATIO times of them. Rebuilding costs much less than adding the arcs
+# one by one for each arc
+_MIN_IMPORT_ARCS = 256
+_IMPORT_RATIO = 8
+
+# properties printed by print_info()
+_INFO_PROPERTIES = (pywrapfst.FstProperties.ACCEPTOR |
+                    pywrapfst.FstProperties.I_DETERMINISTIC |
+                    pywrapfst.FstProperties.O_DETERMINISTIC |
+                    pywrapfst.FstProperties.I_LABEL_SORTED |
+                    pywrapfst.FstProperties.CYCLIC)
+
+T = TypeVar('T')
+
 
 class MutableFst:
     ''' mutable FST that support add arcs dynamically '''
@@ -42,38 +66,94 @@ class MutableFst:
         state_zero = self._fst.add_state()
         self._fst.set_start(state_zero)
 
+        # final state -> final weight, it's tracked by set_final_state(), and
+        # None after the graph is changed by OpenFst algorithms, then it's
+        # collected from the graph in final_states()
+        self._final_weights: Optional[dict[int, float]] = {}
+
+        # arrays exported by to_arrays(), with the graph and the sizes of
+        # symbol tables they are exported from. It's reset when the graph is
+        # changed in place
+        self._arrays: Optional[tuple[pywrapfst.VectorFst, int, int,
+                                     FstArrays]] = None
+
         self.name = name
 
+    def create_fst(self, name: str = 'FST') -> MutableFst:
+        ''' create an empty FST that shares the symbol tables with this FST '''
+        fst = MutableFst(name=name)
+        fst._isymbols = self._isymbols
+        fst._isymbols_readonly = self._isymbols_readonly
+        fst._osymbols = self._osymbols
+        fst._osymbols_readonly = self._osymbols_readonly
+
+        return fst
+
     def create_state(self) -> int:
         ''' add a new state '''
+        self._arrays = None
         return self._fst.add_state()
 
+    def create_states(self, num_states: int) -> range:
+        ''' add num_states new states at once, returns the range of them '''
+        self._arrays = None
+        first_state = self._fst.num_states()
+        self._fst.add_states(num_states)
+        return range(first_state, first_state + num_states)
+
     def set_final_state(self, state: int, weight: float = 0.0) -> None:
         ''' set final state with weight '''
         self._fst.set_final(state, weight)
+        self._arrays = None
+        if self._final_weights is not None:
+            # the weight stored by OpenFst is float32
+            weight = round_float32(float(self._fst.final(state)))
+            if math.isfinite(weight):
+                self._final_weights[state] = weight
+            else:
+                self._final_weights.pop(state, None)
+
+    def num_states(self) -> int:
+        ''' returns number of states '''
+        return self._fst.num_states()
+
+    def num_arcs(self) -> int:
+        ''' returns number of arcs, it's counted by states instead of
+        iterating all arcs '''
+        return _num_arcs(self._fst)
 
     def print_info(self) -> None:
-        ''' print information of FST to stdout '''
-        num_iepsilons = 0
-        num_oepsilons = 0
+        ''' print information of FST to stdout. The counts are queried by
+        state from OpenFst, only the epsilons need the columnar export '''
+        states = list(self._fst.states())
+        num_iepsilons = sum(map(self._fst.num_input_epsilons, states))
+        num_oepsilons = sum(map(self._fst.num_output_epsilons, states))
         num_epsilons = 0
-        num_arcs = 0
-        for _, _, isym, osym, _ in self.arcs():
-            num_arcs += 1
-            if isym == EPS_SYM:
-                num_iepsilons += 1
-            if osym == EPS_SYM:
-                num_oepsilons += 1
-            if isym == EPS_SYM and osym == EPS_SYM:
-                num_epsilons += 1
+        if num_iepsilons and num_oepsilons:
+            arrays = self.to_arrays()
+            num_epsilons = list(map(operator.or_, arrays.ilabels,
+                                    arrays.olabels)).count(0)
+
+        properties = self._fst.properties(_INFO_PROPERTIES, True)
+
+        def has_property(prop: pywrapfst.FstProperties) -> str:
+            return 'y' if properties & prop else 'n'
 
         print(f'fstinfo: {self.name}')
-        print(f'# of states: {self._fst.num_states()}')
+        print(f'# of states: {len(states)}')
         print(f'# of final states: {len(self.final_states())}')
-        print(f'# of arcs: {num_arcs}')
+        print(f'# of arcs: {sum(map(self._fst.num_arcs, states))}')
         print(f'# of epsilons: {num_epsilons}')
         print(f'# of input epsilons: {num_iepsilons}')
         print(f'# of output epsilons: {num_oepsilons}')
+        print(f'acceptor: {has_property(pywrapfst.FstProperties.ACCEPTOR)}')
+        print('input deterministic: '
+              f'{has_property(pywrapfst.FstProperties.I_DETERMINISTIC)}')
+        print('output deterministic: '
+              f'{has_property(pywrapfst.FstProperties.O_DETERMINISTIC)}')
+        print('input label sorted: '
+              f'{has_property(pywrapfst.FstProperties.I_LABEL_SORTED)}')
+        print(f'cyclic: {has_property(pywrapfst.FstProperties.CYCLIC)}')
         print()
 
     def add_arc(self,
@@ -91,6 +171,64 @@ class MutableFst:
 
         arc = pywrapfst.Arc(isymbol_id, osymbol_id, weight, dest_state)
         self._fst.add_arc(src_state, arc)
+        self._arrays = None
+
+    def add_arcs(self,
+                 src_states: Sequence[int],
+                 dest_states: Sequence[int],
+                 isymbols: Sequence[Union[str, int]],
+                 osymbols: Sequence[Union[str, int]],
+                 weights: Optional[Sequence[float]] = None) -> None:
+        '''
+        add arcs to FST in batch. Each argument is a column of the arcs, it
+        could be a list, or an array with tolist() like array.array and
+        numpy.ndarray. Symbols are interned in one pass for each column, and
+        integer symbols are treated as resolved symbol-ids. When there are
+        many arcs compared to the FST, like building a new FST, the graph is
+        rebuilt from the columns by import_arrays() instead of adding the
+        arcs one by one
+        Args:
+            src_states: source states of arcs
+            dest_states: destination states of arcs
+            isymbols: input symbols or symbol-ids of arcs
+            osymbols: output symbols or symbol-ids of arcs
+            weights: weights of arcs, all zeros if it's None
+        '''
+        src_states = _to_list(src_states)
+        dest_states = _to_list(dest_states)
+        ilabels = self._isymbols.get_ids(_to_list(isymbols),
+                                         self._isymbols_readonly)
+        olabels = self._osymbols.get_ids(_to_list(osymbols),
+                                         self._osymbols_readonly)
+        if weights is None:
+            weights = [0.0] * len(src_states)
+        else:
+            weights = _to_list(weights)
+
+        if not (len(src_states) == len(dest_states) == len(ilabels) ==
+                len(olabels) == len(weights)):
+            raise Exception('add_arcs: length of columns mismatch')
+
+        self._arrays = None
+        if len(src_states) >= _MIN_IMPORT_ARCS and len(
+                src_states) * _IMPORT_RATIO >= self.num_arcs():
+            # rebuild the graph with the arcs from columns
+            arrays = export_arrays(self._fst, [], [])
+            fst = import_arrays(arrays.src_states.tolist() + src_states,
+                                arrays.ilabels.tolist() + ilabels,
+                                arrays.olabels.tolist() + olabels,
+                                arrays.weights.tolist() + weights,
+                                arrays.dest_states.tolist() + dest_states,
+                                arrays.final_weights, self._fst.start())
+            if fst is not None:
+                self._fst = fst
+                return
+
+        arc = pywrapfst.Arc
+        add_arc = self._fst.add_arc
+        for src_state, dest_state, ilabel, olabel, weight in zip(
+                src_states, dest_states, ilabels, olabels, weights):
+            add_arc(src_state, arc(ilabel, olabel, weight, dest_state))
 
     def write(self, prefix: str) -> None:
         '''
@@ -100,6 +238,20 @@ class MutableFst:
         self._isymbols.write_text(f'{prefix}.isyms.txt')
         self._osymbols.write_text(f'{prefix}.osyms.txt')
 
+    @classmethod
+    def read(cls, prefix: str, name: str = 'FST') -> MutableFst:
+        '''
+        Read FST, isymbols, osymbols from <prefix>.{fst, isyms.txt, osyms.txt}
+        written by write()
+        '''
+        fst = MutableFst(name=name)
+        fst._isymbols = SymbolTable.read_text(f'{prefix}.isyms.txt')
+        fst._osymbols = SymbolTable.read_text(f'{prefix}.osyms.txt')
+        fst._fst = pywrapfst.VectorFst.read(f'{prefix}.fst')
+        fst._final_weights = None
+
+        return fst
+
     def to_text(self, with_symbols: bool = True) -> str:
         '''
         serialize the FST to AT&T format string
@@ -117,128 +269,299 @@ class MutableFst:
         return self._fst.states()
 
     def final_states(self) -> dict[int, float]:
-        ''' returns dict of (final states, final weight) in FST. This method
-        will go through all states in FST, so it will take long time if FST is
-        large
-        '''
-        # final weights
-        final: dict[int, float] = {}
-        for state in self.states():
-            weight = float(self._fst.final(state))
-            if math.isfinite(weight):
-                final[state] = weight
-        
-        return final
+        ''' returns dict of (final states, final weight) in FST. They are
+        tracked while building the FST, and collected from the graph once
+        after it's changed by OpenFst algorithms '''
+        if self._final_weights is None:
+            self._final_weights = self.to_arrays().final_states()
+
+        return dict(self._final_weights)
 
     def arcs(self) -> Iterator[tuple[int, int, str, str, float]]:
         ''' returns an iterator of all arcs in FST '''
-        for state in self._fst.states():
-            for arc in self._fst.arcs(state):
-                yield (
-                    state,
-                    arc.nextstate,
-                    self._isymbols.get_symbol(arc.ilabel),
-                    self._osymbols.get_symbol(arc.olabel),
-                    float(arc.weight),
-                )
-
-    def rmdisambig(self) -> MutableFst:
-        ''' returns a new FST the same as current one excepts that all
-        disambiguation symbols have be converted to <eps> '''
-        fst = MutableFst(name=f'rds({self.name})')
-        fst._isymbols = self._isymbols.copy()
-        fst._osymbols = self._osymbols.copy()
-        fst._fst = self._fst.copy()
-
-        # get set of disambig symbols
-        idisambig_labels = set()
-        rds_isymbols = pywrapfst.SymbolTable()
-        for label, symbol in fst._isymbols._symbol_table:
+        arrays = self.to_arrays()
+        for src_state, dest_state, ilabel, olabel, weight in arrays.arcs():
+            yield (
+                src_state,
+                dest_state,
+                arrays.isymbols[ilabel],
+                arrays.osymbols[olabel],
+                weight,
+            )
+
+    def to_arrays(self) -> FstArrays:
+        '''
+        export all arcs and final weights of FST as columns in one pass, and
+        the symbol tables as lists indexed by symbol-id. It's much faster than
+        iterating the arcs one by one for large FSTs. The arrays are cached
+        until the FST is changed, the callers should not modify them
+        '''
+        num_isymbols = self._isymbols._symbol_table.available_key()
+        num_osymbols = self._osymbols._symbol_table.available_key()
+        if self._arrays is None or self._arrays[:3] != (
+                self._fst, num_isymbols, num_osymbols):
+            arrays = export_arrays(self._fst, self._isymbols.to_list(),
+                                   self._osymbols.to_list())
+            self._arrays = (self._fst, num_isymbols, num_osymbols, arrays)
+
+        return self._arrays[3]
+
+    def rmdisambig(self, inplace: bool = False) -> MutableFst:
+        ''' returns a FST the same as current one excepts that all
+        disambiguation symbols have be converted to <eps>. When inplace is
+        true, this FST is modified and returned instead of a new one '''
+        fst = self._transform(f'rds({self.name})',
+                              self._fst if inplace else self._fst.copy(),
+                              inplace)
+
+        # get set of disambig symbols, and relabel them to <eps>
+        ipairs: list[tuple[int, int]] = []
+        symbol_ids: list[int] = []
+        for label, symbol in self._isymbols:
             if is_disambig_symbol(symbol):
-                idisambig_labels.add(label)
+                ipairs.append((label, 0))
             else:
-                rds_isymbols.add_symbol(symbol, label)
-
-        for state in self._fst.states():
-            mutable_arc_iter = fst._fst.mutable_arcs(state)
-            for arc in mutable_arc_iter:
-                if arc.ilabel in idisambig_labels:
-                    arc = pywrapfst.Arc(0, arc.olabel, arc.weight,
-                                        arc.nextstate)
-                    mutable_arc_iter.set_value(arc)
+                symbol_ids.append(label)
+        if ipairs:
+            fst._fst.relabel_pairs(ipairs=ipairs)
 
         # replace isymbols with the new symbol table without disambig symbols
-        fst._isymbols._symbol_table = rds_isymbols
+        fst._isymbols = self._isymbols.subset(symbol_ids)
         return fst
 
-    def determinize(self) -> MutableFst:
-        ''' returns equivalent deterministic FST '''
-        fst = MutableFst(name=f'det({self.name})')
-        fst._isymbols = self._isymbols.copy()
-        fst._osymbols = self._osymbols.copy()
-        fst._fst = pywrapfst.determinize(self._fst)
+    def determinize(self, inplace: bool = False) -> MutableFst:
+        ''' returns equivalent deterministic FST. When inplace is true, the
+        result replaces the graph of this FST, so the input graph is released
+        once it's determinized '''
+        return self._transform(f'det({self.name})',
+                               pywrapfst.determinize(self._fst), inplace)
 
-        return fst
-
-    def rmepslocal(self) -> MutableFst:
+    def rmepslocal(self, inplace: bool = False) -> MutableFst:
         ''' returns equivalent FST after removing epsilon arcs as much as
-        possible
+        possible. When inplace is true, this FST is modified and returned
         '''
-        fst = MutableFst(name=f'rel({self.name})')
-        fst._isymbols = self._isymbols.copy()
-        fst._osymbols = self._osymbols.copy()
-        fst._fst = self._fst.copy()
+        if pyfstext is None:
+            raise Exception('rmepslocal: pyfstext is not installed')
 
+        fst = self._transform(f'rel({self.name})',
+                              self._fst if inplace else self._fst.copy(),
+                              inplace)
         pyfstext.RemoveEpsilonLocal(fst._fst)
 
         return fst
 
-    def minimize(self, allow_nondet: bool = False) -> MutableFst:
-        ''' performs the minimization of FST '''
-        fst = MutableFst(name=f'min({self.name})')
-        fst._isymbols = self._isymbols.copy()
-        fst._osymbols = self._osymbols.copy()
-        fst._fst = self._fst.minimize(allow_nondet=allow_nondet)
+    def minimize(self,
+                 allow_nondet: bool = False,
+                 inplace: bool = False) -> MutableFst:
+        ''' performs the minimization of FST. When inplace is true, this FST
+        is modified and returned '''
+        fst = self._transform(f'min({self.name})',
+                              self._fst if inplace else self._fst.copy(),
+                              inplace)
+        fst._fst.minimize(allow_nondet=allow_nondet)
+
+        return fst
+
+    def rmepsilon(self) -> None:
+        ''' removes the epsilon arcs in place '''
+        self._fst.rmepsilon()
+        self._final_weights = None
+        self._arrays = None
+
+    def arcsort(self, sort_type: str = 'ilabel') -> None:
+        ''' sorts the arcs of each state by 'ilabel' or 'olabel' in place '''
+        self._fst.arcsort(sort_type)
+        self._arrays = None
+
+    def minimize_encoded(self) -> None:
+        ''' determinizes and minimizes the FST in place as an acceptor of
+        (isymbol, osymbol, weight) triples. It works for non-functional FSTs,
+        and keeps each output symbol on its original arc
+        '''
+        mapper = pywrapfst.EncodeMapper(self._fst.arc_type(),
+                                        encode_labels=True,
+                                        encode_weights=True)
+        self._fst.encode(mapper)
+        fst = pywrapfst.determinize(self._fst)
+        fst.minimize()
+        fst.decode(mapper)
+        self._fst = fst
+        self._final_weights = None
+        self._arrays = None
+
+    def optimize_for_decoding(self,
+                              max_arc_ratio: Optional[float] = None,
+                              inplace: bool = False) -> MutableFst:
+        '''
+        optimizes the FST for nnlp.FstDecoder. It removes the epsilon arcs,
+        so the decoder expands less tokens through epsilon arcs in each frame,
+        and pushes the weights towards the initial state, so the beam is
+        pruned by the weights earlier. The start state is kept as state 0.
+        Then the states not on any successful path are trimmed, and the
+        symbols not used by any arc are removed from both symbol tables.
+        Args:
+            max_arc_ratio: when removing all epsilon arcs makes the number of
+                arcs more than max_arc_ratio times of the original, only the
+                local epsilon removal of rmepslocal() is applied, it needs
+                pyfstext. No limit if it's None
+            inplace: true to modify this FST and return it
+        Returns:
+            the optimized FST
+        '''
+        fst = self._transform(f'opt({self.name})',
+                              self._fst if inplace else self._fst.copy(),
+                              inplace)
+
+        if max_arc_ratio is None:
+            fst._fst.rmepsilon()
+        else:
+            rmeps_fst = fst._fst.copy().rmepsilon()
+            if _num_arcs(rmeps_fst) <= max_arc_ratio * _num_arcs(fst._fst):
+                fst._fst = rmeps_fst
+            else:
+                del rmeps_fst
+                if pyfstext is None:
+                    raise Exception(
+                        'optimize_for_decoding: pyfstext is not installed')
+                pyfstext.RemoveEpsilonLocal(fst._fst)
+
+        fst._fst.push(reweight_type='to_initial')
+        _fold_start_state(fst._fst)
+        fst._fst.connect()
+        assert fst._fst.start() == 0
+
+        arrays = fst.to_arrays()
+        fst._isymbols = fst._isymbols.subset(arrays.ilabels)
+        fst._osymbols = fst._osymbols.subset(arrays.olabels)
+        fst._final_weights = arrays.final_states()
+        fst._arrays = None
+
+        return fst
+
+    def prune(self,
+              weight: Optional[float] = None,
+              nstate: int = -1,
+              inplace: bool = False) -> MutableFst:
+        '''
+        prunes the states and arcs not on any path whose weight is within
+        weight of the shortest path
+        Args:
+            weight: the pruning threshold, no limit if it's None
+            nstate: max number of states to keep, no limit if it's -1
+            inplace: true to modify this FST and return it
+        Returns:
+            the pruned FST
+        '''
+        fst = self._transform(f'prune({self.name})',
+                              self._fst if inplace else self._fst.copy(),
+                              inplace)
+        fst._fst.prune(nstate=nstate, weight=weight)
 
         return fst
 
-    def compose(self, fst: MutableFst) -> MutableFst:
-        ''' composes two FSTs, returns (self o fst) '''
+    def compose(self, fst: MutableFst, inplace: bool = False) -> MutableFst:
+        ''' composes two FSTs, returns (self o fst). When inplace is true, the
+        result replaces this FST '''
         if not self._osymbols is fst._isymbols:
             raise Exception('FST compose: in-/output symbols table mismatch')
-        composed_fst = MutableFst(name=f'{self.name} o {fst.name}')
-        composed_fst._isymbols = self._isymbols.copy()
+        composed_fst = self._transform(f'{self.name} o {fst.name}',
+                                       pywrapfst.compose(self._fst, fst._fst),
+                                       inplace)
         composed_fst._osymbols = fst._osymbols.copy()
-        composed_fst._fst = pywrapfst.compose(self._fst, fst._fst)
 
         return composed_fst
 
+    def replace(self, fsts: dict[str, MutableFst]) -> None:
+        '''
+        replace the arcs whose output symbol is a key of fsts with the FST of
+        that symbol in place. The FSTs in fsts may also contain such arcs, and
+        they should share symbol tables with this FST (see create_fst())
+        Args:
+            fsts: nonterminal output symbol -> FST
+        '''
+        pairs: list[tuple[int, pywrapfst.VectorFst]] = [
+            (self._osymbols._symbol_table.available_key(), self._fst)
+        ]
+        for symbol, fst in fsts.items():
+            if not (fst._isymbols is self._isymbols and
+                    fst._osymbols is self._osymbols):
+                raise Exception('FST replace: symbol tables mismatch')
+            pairs.append((self._osymbols.get_id(symbol), fst._fst))
+
+        self._fst = pywrapfst.replace(pairs,
+                                      call_arc_labeling='neither',
+                                      return_arc_labeling='neither')
+        self._final_weights = None
+        self._arrays = None
+
     def to_json(self) -> str:
         '''
-        convert the FST to json string, this FST could be read by nnlp.Fst
+        convert the FST to json string, this FST could be read by nnlp.Fst.
+        For large FSTs, use write_json() instead
+        '''
+        f = io.StringIO()
+        write_json(self.to_arrays(), f, checksums=False)
+        return f.getvalue()
+
+    def write_json(self, f: IO[str], checksums: bool = True) -> None:
+        '''
+        write the FST to file handle f in json format, the states are streamed
+        to f without building the whole json string in memory
+        Args:
+            f: file handle opened in text mode
+            checksums: true to write checksums of the sections, they could be
+                checked by nnlp.Fst.verify_json()
+        '''
+        write_json(self.to_arrays(), f, checksums)
+
+    def write_binary(self,
+                     f: IO[bytes],
+                     weight_bits: int = 0,
+                     compression: Optional[str] = None,
+                     block_states: int = 1024,
+                     sharded: bool = False,
+                     prefetch: int = 0,
+                     flat: bool = False) -> None:
+        '''
+        write the FST to file handle f in the compact binary format, it could
+        be read by nnlp.Fst.from_binary()
+        Args:
+            f: file handle opened in binary mode
+            weight_bits: 8 or 16 to quantize the weights to codes with a
+                codebook, zero weights are kept exact. 0 to store float32
+            compression: 'zlib' or 'lzma' to compress the arcs in blocks that
+                are decompressed on demand by the loader, None for no
+                compression
+            block_states: number of states in each block
+            sharded: true to write the arcs in blocks without compression,
+                they could be read from file on demand by
+                nnlp.Fst.from_binary(lazy=True)
+            prefetch: number of hot states near the start state, their blocks
+                are loaded with the FST. Only for compressed or sharded FST
+            flat: true to write the flat FST that is mapped to memory by
+                nnlp.FlatFst, it could not be compressed or sharded
         '''
-        isymbol_dict: dict[str, int] = {}
-        for isym_id, isymbol in self._isymbols:
-            isymbol_dict[isymbol] = isym_id
-
-        # arcs
-        graph: list[dict[str, list[tuple[int, str, float]]]] = []
-        for src_state, dest_state, isymbol, osymbol, weight in self.arcs():
-            # add arc to graph
-            while len(graph) <= src_state:
-                graph.append(dict())
-            if isymbol not in graph[src_state]:
-                graph[src_state][isymbol] = []
-            graph[src_state][isymbol].append((dest_state, osymbol, weight))
-
-        # final weights
-        final = self.final_states()
-
-        o = dict(version=1,
-                 graph=graph,
-                 isymbol_dict=isymbol_dict,
-                 final_weights=list(final.items()))
-        return json.dumps(o, separators=(',', ':'))
+        arrays = self.to_arrays()
+        write_binary(arrays, f, weight_bits, compression, block_states,
+                     sharded, hot_states(arrays, prefetch), flat)
+
+    def _transform(self, name: str, fst: pywrapfst.VectorFst,
+                   inplace: bool) -> MutableFst:
+        ''' returns the MutableFst for the result fst of a transform. It's
+        this FST if inplace, otherwise a new FST with copy-on-write symbol
+        tables '''
+        if inplace:
+            mutable_fst = self
+        else:
+            mutable_fst = MutableFst(name=name)
+            mutable_fst._isymbols = self._isymbols.copy()
+            mutable_fst._osymbols = self._osymbols.copy()
+
+        mutable_fst.name = name
+        mutable_fst._fst = fst
+        mutable_fst._final_weights = None
+        mutable_fst._arrays = None
+        return mutable_fst
 
     def _get_symbol_id(self, symbol: str, symbol_table: SymbolTable,
                        readonly: bool) -> int:
@@ -247,14 +570,69 @@ class MutableFst:
         create a newsymbol id for nonexisting symbols, otherwise, raise an
         Exception
         '''
-        if symbol == '':
-            raise Exception(
-                f'empty symbol is not supported, use EPS_SYM instead?')
-
-        if symbol not in symbol_table:
-            if readonly:
-                raise Exception(f'symbol not exist: {symbol}')
-            return symbol_table.add_symbol(symbol)
-        else:
-            symbol_id = symbol_table.get_id(symbol)
-            return symbol_id
+        return symbol_table.get_ids((symbol,), readonly)[0]
+
+
+def _fold_start_state(fst: pywrapfst.VectorFst) -> None:
+    ''' when the start state is on a cycle, pushing the weights to the initial
+    state adds a new start state with an epsilon arc to the original one. This
+    function replaces the epsilon arc by the arcs and final weight of the
+    original start state, and swaps the new start state with state 0 '''
+    start = fst.start()
+    if start == 0:
+        return
+
+    (eps_arc,) = fst.arcs(start)
+    assert eps_arc.ilabel == 0 and eps_arc.olabel == 0
+    weight = eps_arc.weight
+    orig_start = eps_arc.nextstate
+
+    fst.delete_arcs(start)
+    for arc in list(fst.arcs(orig_start)):
+        fst.add_arc(
+            start,
+            pywrapfst.Arc(arc.ilabel, arc.olabel,
+                          pywrapfst.times(weight, arc.weight), arc.nextstate))
+    fst.set_final(start, pywrapfst.times(weight, fst.final(orig_start)))
+
+    # swap the state ids of start and 0. Only the states with arcs to them
+    # are rewritten, they are found from the columns of all arcs
+    swap = {0: start, start: 0}
+    arrays = export_arrays(fst, [], [])
+    for state in set(
+            itertools.compress(arrays.src_states,
+                               map(swap.__contains__, arrays.dest_states))):
+        arc_iter = fst.mutable_arcs(state)
+        while not arc_iter.done():
+            arc = arc_iter.value()
+            if arc.nextstate in swap:
+                arc.nextstate = swap[arc.nextstate]
+                arc_iter.set_value(arc)
+            arc_iter.next()
+
+    arcs_0 = list(fst.arcs(0))
+    arcs_start = list(fst.arcs(start))
+    final_0 = fst.final(0)
+    fst.delete_arcs(0)
+    fst.delete_arcs(start)
+    for arc in arcs_start:
+        fst.add_arc(0, arc)
+    for arc in arcs_0:
+        fst.add_arc(start, arc)
+    fst.set_final(0, fst.final(start))
+    fst.set_final(start, final_0)
+    fst.set_start(0)
+
+
+def _num_arcs(fst: pywrapfst.VectorFst) -> int:
+    ''' returns number of arcs of fst '''
+    return sum(map(fst.num_arcs, fst.states()))
+
+
+def _to_list(column: Sequence[T]) -> list[T]:
+    ''' convert a column of add_arcs() to list '''
+    if isinstance(column, list):
+        return column
+    if hasattr(column, 'tolist'):
+        return column.tolist()
+    return list(column)
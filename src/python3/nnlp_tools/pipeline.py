@@ -0,0 +1,206 @@
+''' declarative pipeline to build FSTs with cached stages '''
+from __future__ import annotations
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import types
+from typing import Any, Callable, Optional, Sequence
+
+import nnlp
+from .mutable_fst import MutableFst
+
+# version of the stage cache, change it when the cache format changed
+_CACHE_VERSION = 1
+
+
+class Stage:
+    '''
+    one stage of Pipeline. The first stage is called as func(**params) and
+    the others are called as func(fst, **params), where fst is the output of
+    previous stage. Since the output is cached before the next stage runs,
+    a stage could also modify the input FST and return it, like the
+    MutableFst transforms with inplace=True. Then only one graph is kept in
+    memory by the pipeline.
+    Args:
+        name: name of the stage
+        func: function to build the output FST of this stage
+        inputs: files read by func, their content are part of the cache key
+        version: version of func, change it to invalidate the cache when
+            the functions called by func changed. The code of func itself
+            and the source of nnlp and nnlp_tools packages are part of the
+            cache key
+        params: keyword arguments of func, they should be JSON serializable
+    '''
+
+    def __init__(self,
+                 name: str,
+                 func: Callable[..., MutableFst],
+                 inputs: Sequence[str] = (),
+                 version: str = '',
+                 **params: Any) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.version = version
+        self.params = params
+
+    def get_key(self, prev_key: str) -> str:
+        ''' returns the cache key of this stage. It's the hash of key of
+        previous stage, the stage itself, the code of func, the source of
+        nnlp and nnlp_tools packages and content of its input files '''
+
+        key = hashlib.sha256(prev_key.encode('utf-8'))
+        stage = [
+            self.name, self.func.__module__, self.func.__qualname__,
+            self.version, self.params
+        ]
+        key.update(json.dumps(stage, sort_keys=True).encode('utf-8'))
+        key.update(_get_code_hash(self.func).encode('utf-8'))
+        key.update(_get_package_hash().encode('utf-8'))
+        for filename in self.inputs:
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    key.update(chunk)
+
+        return key.hexdigest()
+
+
+def _get_code_hash(func: Callable) -> str:
+    ''' returns the hash of the code of func. It's the source code if
+    available, otherwise the bytecode and constants, including the code of
+    nested functions. It's empty for the builtin functions without code '''
+
+    func = inspect.unwrap(func)
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(func, '__code__', None)
+        source = _dump_code(code) if code is not None else ''
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_package_hash() -> str:
+    ''' returns the hash of the source files of nnlp and nnlp_tools packages,
+    so the cache is invalidated when the library used by stages changed '''
+
+    key = hashlib.sha256()
+    for package_dir in (os.path.dirname(nnlp.__file__),
+                        os.path.dirname(__file__)):
+        for dirpath, dirnames, filenames in os.walk(package_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.py'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key.update(os.path.relpath(path, package_dir).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    key.update(hashlib.sha256(f.read()).digest())
+
+    return key.hexdigest()
+
+
+def _dump_code(code: types.CodeType) -> str:
+    ''' dump the bytecode and constants of code recursively '''
+
+    consts = [
+        _dump_code(const) if isinstance(const, types.CodeType) else repr(const)
+        for const in code.co_consts
+    ]
+    return json.dumps([code.co_code.hex(), consts, list(code.co_names)])
+
+
+class Pipeline:
+    '''
+    runs the stages one by one and caches the output FST of each stage in
+    cache_dir. The cache key of a stage depends on the keys of all the stages
+    before it, so the pipeline resumes from the last stage with a valid cache,
+    and only the stages after it (and the ones changed) are run again.
+    Usage:
+        pipeline = Pipeline([
+            Stage('L', build_lexicon, inputs=['lexicon.txt']),
+            Stage('det', MutableFst.determinize, inplace=True),
+            Stage('min', MutableFst.minimize, allow_nondet=True, inplace=True),
+        ], cache_dir='exp/cache')
+        fst = pipeline.run()
+    Args:
+        stages: stages of the pipeline
+        cache_dir: directory to store the cached FSTs
+        verbose: true to print the statistics of FST after each stage
+    '''
+
+    def __init__(self,
+                 stages: Sequence[Stage],
+                 cache_dir: str,
+                 verbose: bool = False) -> None:
+        if not stages:
+            raise Exception('pipeline: no stage')
+
+        self._stages = list(stages)
+        self._cache_dir = cache_dir
+        self._verbose = verbose
+
+    def run(self) -> MutableFst:
+        ''' run the pipeline and returns the FST of the last stage '''
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+        prefixes: list[str] = []
+        key = str(_CACHE_VERSION)
+        for idx, stage in enumerate(self._stages):
+            key = stage.get_key(key)
+            prefixes.append(
+                os.path.join(self._cache_dir, f'{idx:02}.{stage.name}.{key}'))
+
+        # find the last stage with valid cache
+        fst: Optional[MutableFst] = None
+        start_idx = 0
+        for idx in reversed(range(len(self._stages))):
+            fst = self._read_cache(prefixes[idx])
+            if fst is not None:
+                self._log(self._stages[idx], fst, 'cached')
+                start_idx = idx + 1
+                break
+
+        for idx in range(start_idx, len(self._stages)):
+            stage = self._stages[idx]
+            if fst is None:
+                fst = stage.func(**stage.params)
+            else:
+                fst = stage.func(fst, **stage.params)
+
+            self._write_cache(prefixes[idx], fst)
+            self._log(stage, fst, 'done')
+
+        assert fst
+        return fst
+
+    def _read_cache(self, prefix: str) -> Optional[MutableFst]:
+        ''' read the cached FST, returns None if not exist '''
+
+        # meta file is written at last, so the cache is valid if it exists
+        if not os.path.exists(f'{prefix}.json'):
+            return None
+
+        with open(f'{prefix}.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        return MutableFst.read(prefix, name=meta['name'])
+
+    def _write_cache(self, prefix: str, fst: MutableFst) -> None:
+        ''' write the FST to cache '''
+
+        fst.write(prefix)
+        with open(f'{prefix}.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dict(version=_CACHE_VERSION, name=fst.name), f)
+        os.replace(f'{prefix}.json.tmp', f'{prefix}.json')
+
+    def _log(self, stage: Stage, fst: MutableFst, status: str) -> None:
+        ''' print the stage status and statistics if verbose '''
+
+        if self._verbose:
+            print(f'stage {stage.name} {status}: {fst.name}, '
+                  f'{fst.num_states()} states, {fst.num_arcs()} arcs')
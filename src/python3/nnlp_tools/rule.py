@@ -36,7 +36,8 @@ class Rule:
         return t
 
     def __hash__(self):
-        return hash(self.__repr__())
+        # weight is not hashed since Grammar normalizes it after the rule is added to a set
+        return hash((self.class_name, tuple(self.tokens), self.flag))
 
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, Rule):
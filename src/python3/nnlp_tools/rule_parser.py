@@ -1,4 +1,4 @@
-from typing import Dict, Iterable, List, Set
+from typing import Dict, List, Set
 
 import itertools
 
@@ -35,12 +35,10 @@ class RuleParser:
                  tokens (List[BNFToken]): tokens of the rule
                  source (SourcePosition): position of the rule in source file '''
 
-        rules: Iterable[Rule] = [Rule(name, tokens, source)]
-
-        # one rule may generate multiple rules, so we use sum here
-        rules = sum(map(self._replace_sub_rule, rules), [])
-        rules = sum(map(self._split_alternatives, rules), [])
-        rules = list(rules)
+        # one rule may generate multiple rules, chain them instead of concatenating the lists, so
+        # the time is linear to the number of rules
+        rules = self._replace_sub_rule(Rule(name, tokens, source))
+        rules = list(itertools.chain.from_iterable(map(self._split_alternatives, rules)))
         for rule in rules:
             self._parse_weight(rule)
             self._verify_rule(rule)
@@ -84,12 +82,37 @@ class RuleParser:
                 <weather> ::= <weather:00aa> "weather" 
                 <weather:00aa> ::= <city>   flag="*" '''
 
+        if not any(token.type == BNFToken.LEFT_PARENTHESIS for token in rule.tokens):
+            return [rule]
+
         state = 'OUTSIDE'
         rule_dict: Dict[str, Rule] = {}
         rule_tokens: List[BNFToken] = []
         subrule_tokens: List[BNFToken] = []
 
         for token in itertools.chain(rule.tokens, [BNFToken(BNFToken.END)]):
+            if state == 'SUFFIX':
+                # look for '*' or '?' after the sub rule
+                subrule_flag: str = ''
+                if token.type == BNFToken.QUESTION:
+                    subrule_flag = '?'
+                elif token.type == BNFToken.ASTERISK:
+                    subrule_flag = '*'
+
+                subrule = Rule(
+                    self._generate_sub_name(rule.class_name),
+                    subrule_tokens,
+                    rule.position,
+                    subrule_flag,
+                )
+                rule_dict[subrule.class_name] = subrule
+                rule_tokens.append(BNFToken(BNFToken.CLASS, subrule.class_name))
+                subrule_tokens = []
+
+                state = 'OUTSIDE'
+                if subrule_flag:
+                    continue
+
             if state == 'OUTSIDE':
                 if token.type == BNFToken.LEFT_PARENTHESIS:
                     state = 'INSIDE'
@@ -99,7 +122,6 @@ class RuleParser:
                     rule_tokens.append(token)
             elif state == 'INSIDE':
                 if token.type == BNFToken.RIGHT_PARENTHESIS:
-                    # look for '*' or '?'
                     state = 'SUFFIX'
                 elif token.type == BNFToken.LEFT_PARENTHESIS:
                     raise BNFSyntaxError(f'only 1 level parenthesis is supported')
@@ -107,29 +129,6 @@ class RuleParser:
                     raise BNFSyntaxError(f'parenthesis mismatch')
                 else:
                     subrule_tokens.append(token)
-            elif state == 'SUFFIX':
-                subrule_flag: str = ''
-                if token.type == BNFToken.QUESTION:
-                    subrule_flag = '?'
-                    state = 'OUTSIDE'
-                elif token.type == BNFToken.ASTERISK:
-                    subrule_flag = '*'
-                    state = 'OUTSIDE'
-                elif token.type == BNFToken.END:
-                    state = 'FINISH'
-                else:
-                    rule_tokens.append(token)
-                    state = 'OUTSIDE'
-
-                subrule = Rule(
-                    self._generate_sub_name(rule.class_name),
-                    subrule_tokens,
-                    rule.position,
-                    subrule_flag,
-                )
-                rule_dict[subrule.class_name] = subrule
-                rule_tokens.append(BNFToken(BNFToken.CLASS, subrule.class_name))
-                subrule_tokens = []
 
         assert state == 'FINISH'
 
@@ -204,7 +203,7 @@ class RuleParser:
         for token in rule.tokens:
             if token.type not in {
                     BNFToken.CLASS, BNFToken.SYMBOL, BNFToken.I_SYMBOL, BNFToken.O_SYMBOL,
-                    BNFToken.EPSILON
+                    BNFToken.EPSILON, BNFToken.MACRO_READ_LEXICON
             }:
                 raise BNFSyntaxError(f'unexpected token: {token}')
             if token.type == BNFToken.EPSILON and len(rule.tokens) != 1:
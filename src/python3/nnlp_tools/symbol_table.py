@@ -1,8 +1,11 @@
 ''' SymbolTable stores the mapping table between symbol-id and symbol '''
 from __future__ import annotations
 
+import itertools
+import operator
+
 import pywrapfst
-from typing import Iterator, Union
+from typing import Iterable, Iterator, Optional, Union
 from nnlp.symbol import EPS_SYM
 
 
@@ -13,6 +16,14 @@ class SymbolTable:
         self._symbol_table = pywrapfst.SymbolTable()
         self._symbol_table.add_symbol(EPS_SYM, 0)
 
+        # python-side cache of symbol -> symbol-id, it avoids calling into
+        # pywrapfst for the symbols already seen. Symbols are never removed
+        # from a table, so the cache is always valid
+        self._symbol_ids: dict[str, int] = {EPS_SYM: 0}
+
+        # true if the table is shared with its copies, see copy()
+        self._shared = False
+
     def __contains__(self, o: Union[int, str]) -> str:
         ''' returns true if symbol or symbol-id exists '''
         return self._symbol_table.member(o)
@@ -26,24 +37,77 @@ class SymbolTable:
         return self._symbol_table.__iter__()
 
     def copy(self) -> SymbolTable:
-        ''' makes a copy of the symbol table '''
-        symbol_table = SymbolTable()
-        symbol_table._symbol_table = self._symbol_table.copy()
+        ''' makes a copy of the symbol table. It's copy-on-write, the tables
+        share the symbols until one of them adds a symbol '''
+        symbol_table = SymbolTable.__new__(SymbolTable)
+        symbol_table._symbol_table = self._symbol_table
+        symbol_table._symbol_ids = self._symbol_ids
+        symbol_table._shared = True
+        self._shared = True
         return symbol_table
 
     def add_symbol(self, symbol: str) -> int:
         ''' add a symbol and returns its symbol-id '''
-        return self._symbol_table.add_symbol(symbol)
+        if self._shared:
+            self._symbol_table = self._symbol_table.copy()
+            self._symbol_ids = self._symbol_ids.copy()
+            self._shared = False
+
+        symbol_id = self._symbol_table.add_symbol(symbol)
+        self._symbol_ids[symbol] = symbol_id
+        return symbol_id
 
     def get_id(self, symbol: str) -> int:
         ''' find id by symbol, raise KeyError if not found '''
 
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is not None:
+            return symbol_id
+
         symbol_id = self._symbol_table.find(symbol)
         if symbol_id == pywrapfst.NO_LABEL:
             raise KeyError(symbol)
 
+        self._symbol_ids[symbol] = symbol_id
         return symbol_id
 
+    def get_ids(self, symbols: Iterable[Union[str, int]],
+                readonly: bool) -> list[int]:
+        '''
+        find ids of symbols in one pass. Symbols not exist are added to the
+        table, or raise an Exception if readonly. Integers are treated as
+        symbol-ids that are already resolved, and raise an Exception if they
+        are not in the table
+        '''
+        if not isinstance(symbols, list):
+            symbols = list(symbols)
+        ids = list(map(self._symbol_ids.get, symbols))
+        if None not in ids:
+            return ids
+
+        # resolve each missing symbol once, in the order of first occurrence
+        resolved: dict[Union[str, int], int] = {}
+        for symbol in dict.fromkeys(itertools.compress(
+                symbols, map(operator.is_, ids, itertools.repeat(None)))):
+            if isinstance(symbol, int):
+                if symbol not in self:
+                    raise Exception(f'symbol-id not exist: {symbol}')
+                resolved[symbol] = symbol
+            elif symbol == '':
+                raise Exception(
+                    f'empty symbol is not supported, use EPS_SYM instead?')
+            elif symbol in self:
+                resolved[symbol] = self.get_id(symbol)
+            elif readonly:
+                raise Exception(f'symbol not exist: {symbol}')
+            else:
+                resolved[symbol] = self.add_symbol(symbol)
+
+        return [
+            resolved[symbol] if symbol_id is None else symbol_id
+            for symbol_id, symbol in zip(ids, symbols)
+        ]
+
     def get_symbol(self, symbol_id: int) -> str:
         ''' find symbol by symbol-id, raise KeyError if not found '''
 
@@ -53,6 +117,33 @@ class SymbolTable:
 
         return value
 
+    def subset(self, symbol_ids: Iterable[int]) -> SymbolTable:
+        ''' returns a new table with the symbols of symbol_ids only, the
+        symbol-ids are not changed. <eps> is always kept '''
+        symbol_table = SymbolTable()
+        for symbol_id in sorted(set(symbol_ids)):
+            if symbol_id != 0:
+                symbol_table._symbol_table.add_symbol(
+                    self.get_symbol(symbol_id), symbol_id)
+
+        return symbol_table
+
+    def to_list(self) -> list[Optional[str]]:
+        ''' returns the list of symbols indexed by symbol-id, None for the
+        ids not used '''
+        symbols: list[Optional[str]] = [None] * self._symbol_table.available_key()
+        for symbol_id, symbol in self._symbol_table:
+            symbols[symbol_id] = symbol
+
+        return symbols
+
+    @classmethod
+    def read_text(cls, filename: str) -> SymbolTable:
+        ''' read the SymbolTable from text file written by write_text() '''
+        symbol_table = SymbolTable()
+        symbol_table._symbol_table = pywrapfst.SymbolTable.read_text(filename)
+        return symbol_table
+
     def write_text(self, filename: str):
         ''' write the SymbolTable to text file '''
         self._symbol_table.write_text(filename)
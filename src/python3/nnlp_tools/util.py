@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import functools
+import heapq
+import itertools
 import math
-from operator import itemgetter
-from typing import TYPE_CHECKING
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, TypeVar
 
 from nnlp.symbol import escape_symbol
 
 if TYPE_CHECKING:
-    from .lexicon_fst_builder import Lexicon
+    from .lexicon_fst_builder import Lexicon, LexiconEntry
     from .rule import Rule
 
+T = TypeVar('T')
+
+# number of entries in each pickled record of a lexicon shard file
+_SHARD_RECORD_SIZE = 4096
+
 
 class BNFSyntaxError(Exception):
     ''' raised when an invaid BNF expression string occured '''
@@ -25,54 +37,263 @@ def read_lexicon(filename: str, is_escaped: bool) -> Lexicon:
         filename: filename of the lexicon
         is_escaped (bool): true if the lexicon is escaped '''
 
-    lexicon: Lexicon = []
+    return list(iter_lexicon(filename, is_escaped))
+
+
+def iter_lexicon(filename: str,
+                 is_escaped: bool,
+                 num_workers: int = 1,
+                 batch_size: int = 10000) -> Iterator[LexiconEntry]:
+    '''
+    read lexicon from file like read_lexicon(), but returns a generator of
+    lexicon entries instead of a list, so the whole lexicon is never loaded
+    into memory
+    Args:
+        filename: filename of the lexicon
+        is_escaped (bool): true if the lexicon is escaped
+        num_workers (int): number of processes to parse the lines, only the
+            calling process is used when num_workers <= 1
+        batch_size (int): number of lines sent to a worker process at once '''
+
     with open(filename, encoding='utf-8') as f:
-        for line in f:
+        batches = _iter_batches(f, batch_size)
+        parse_lines = functools.partial(_parse_lexicon_lines, filename,
+                                        is_escaped)
+        if num_workers <= 1:
+            for lines in batches:
+                yield from parse_lines(lines)
+            return
+
+        with multiprocessing.Pool(num_workers) as pool:
+            # only read 2 batches per worker ahead of the consumer, so that
+            # the memory is bounded even if the consumer is slow. A slot is
+            # released once a batch is consumed, so the workers are kept busy
+            slots = threading.Semaphore(num_workers * 2)
+            stopped = threading.Event()
             try:
-                row = line.strip().split()
-                assert len(row) >= 3
-                if is_escaped:
-                    word = row[0]
-                    symbols = list(row[2:])
-                else:
-                    word = escape_symbol(row[0])
-                    symbols = list(map(escape_symbol, row[2:]))
-                weight = -math.log(float(row[1]))
-
-                lexicon.append((word, symbols, weight))
-            except Exception as _:
-                raise Exception(
-                    f'unexpected line in {filename}: {line.strip()}')
+                for entries in pool.imap(
+                        parse_lines, _iter_with_slots(batches, slots,
+                                                      stopped)):
+                    slots.release()
+                    yield from entries
+            finally:
+                # wake up the feeder thread of pool if it's waiting for slot
+                stopped.set()
+                slots.release()
+
+
+def _parse_lexicon_lines(filename: str, is_escaped: bool,
+                         lines: list[str]) -> Lexicon:
+    ''' parse lines of lexicon file, see read_lexicon() for the format '''
+
+    lexicon: Lexicon = []
+    for line in lines:
+        try:
+            row = line.strip().split()
+            assert len(row) >= 3
+            if is_escaped:
+                word = row[0]
+                symbols = list(row[2:])
+            else:
+                word = escape_symbol(row[0])
+                symbols = list(map(escape_symbol, row[2:]))
+            weight = -math.log(float(row[1]))
+
+            lexicon.append((word, symbols, weight))
+        except Exception as _:
+            raise Exception(
+                f'unexpected line in {filename}: {line.strip()}')
 
     return lexicon
 
+
+def _iter_with_slots(iterable: Iterable[T], slots: threading.Semaphore,
+                     stopped: threading.Event) -> Iterator[T]:
+    ''' yield the elements of iterable, each one takes a slot. It stops when
+    the stopped event is set '''
+
+    for element in iterable:
+        slots.acquire()
+        if stopped.is_set():
+            return
+        yield element
+
+
+def _iter_batches(iterable: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    ''' split iterable into lists with at most batch_size elements '''
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def sort_lexicon(lexicon: Iterable[LexiconEntry],
+                 max_entries_in_memory: int = 1000000,
+                 tmpdir: Optional[str] = None) -> Iterator[LexiconEntry]:
+    '''
+    sort lexicon by (symbols, word) and remove the duplicated entries (only
+    the one with minimal weight is kept). If there are more than
+    max_entries_in_memory entries, the lexicon is split into sorted shards on
+    disk, and the shards are merged afterwards, so that the memory is bounded
+    Args:
+        lexicon: the input lexicon, could be a generator
+        max_entries_in_memory (int): max number of entries in each shard
+        tmpdir (str): directory for the shard files, use the default
+            temporary directory if it's None
+    Returns:
+        generator of the sorted lexicon, the symbols are tuples '''
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as shard_dir:
+        shard_files: list[str] = []
+        for batch in _iter_batches(lexicon, max_entries_in_memory):
+            shard = sorted(map(_normalize_lexicon_entry, batch),
+                           key=_lexicon_sort_key)
+            if not shard_files and len(shard) < max_entries_in_memory:
+                # the whole lexicon fits in memory
+                yield from _unique_lexicon(shard)
+                return
+
+            shard_file = os.path.join(shard_dir, f'{len(shard_files)}.shard')
+            _write_lexicon_shard(shard_file, shard)
+            shard_files.append(shard_file)
+            del shard, batch
+
+        shards = map(_read_lexicon_shard, shard_files)
+        yield from _unique_lexicon(heapq.merge(*shards, key=_lexicon_sort_key))
+
+
+def _normalize_lexicon_entry(entry: LexiconEntry) -> LexiconEntry:
+    ''' make sure symbols of lexicon entry is a tuple '''
+
+    word, symbols, weight = entry
+    return (word, tuple(symbols), weight)
+
+
+def _lexicon_sort_key(entry: LexiconEntry) -> tuple[tuple[str, ...], str]:
+    ''' key of lexicon entry for sort_lexicon() '''
+
+    return (entry[1], entry[0])
+
+
+def _unique_lexicon(lexicon: Iterable[LexiconEntry]) -> Iterator[LexiconEntry]:
+    ''' remove the duplicated (word, symbols) from sorted lexicon, keep the
+    one with the minimal weight '''
+
+    prev_entry: Optional[LexiconEntry] = None
+    for entry in lexicon:
+        if prev_entry and _lexicon_sort_key(entry) == _lexicon_sort_key(
+                prev_entry):
+            if entry[2] < prev_entry[2]:
+                prev_entry = entry
+            continue
+
+        if prev_entry:
+            yield prev_entry
+        prev_entry = entry
+
+    if prev_entry:
+        yield prev_entry
+
+
+def _write_lexicon_shard(filename: str, lexicon: Lexicon) -> None:
+    ''' write lexicon to shard file as pickled records '''
+
+    with open(filename, 'wb') as f:
+        for record in _iter_batches(lexicon, _SHARD_RECORD_SIZE):
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_lexicon_shard(filename: str) -> Iterator[LexiconEntry]:
+    ''' read lexicon from shard file record by record '''
+
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                return
+            yield from record
+
+
+def prune_lexicon(lexicon: Iterable[LexiconEntry],
+                  max_weight: Optional[float] = None,
+                  top_n: Optional[int] = None) -> Iterator[LexiconEntry]:
+    '''
+    prune the low probability entries of lexicon. The entries with a single
+    input symbol are always kept, so that the pruned lexicon still covers the
+    same input symbols, and the pruned words pass through symbol by symbol
+    Args:
+        lexicon: the input lexicon, could be a generator
+        max_weight: drop the entries with weight (-log probability) larger
+            than it
+        top_n: keep at most top_n entries with multiple input symbols, the
+            ones with the smallest weight are kept. Only these entries are
+            held in memory
+    Returns:
+        generator of the pruned lexicon. When top_n is set, the kept entries
+        with multiple input symbols are yielded at last in their original
+        order
+    '''
+    # heap of (-weight, -index, entry) for top_n, the root is the entry with
+    # largest weight, and the latest one when weights are equal
+    heap: list[tuple[float, int, LexiconEntry]] = []
+    for index, entry in enumerate(lexicon):
+        _, isyms, weight = entry
+        if len(isyms) == 1:
+            yield entry
+            continue
+        if max_weight is not None and weight > max_weight:
+            continue
+        if top_n is None:
+            yield entry
+        elif len(heap) < top_n:
+            heapq.heappush(heap, (-weight, -index, entry))
+        elif top_n > 0 and (-weight, -index) > heap[0][:2]:
+            heapq.heapreplace(heap, (-weight, -index, entry))
+
+    heap.sort(key=lambda item: -item[1])
+    for _, _, entry in heap:
+        yield entry
+
+
 def lexicon_add_ilabel_selfloop(lexicon: Lexicon) -> Lexicon:
     ''' add missing single input label selfloop to lexicon. It could speed up
     decoding process for handling <unk> symbol
     '''
+
+    return list(iter_lexicon_add_ilabel_selfloop(lexicon))
+
+
+def iter_lexicon_add_ilabel_selfloop(
+        lexicon: Iterable[LexiconEntry]) -> Iterator[LexiconEntry]:
+    ''' generator version of lexicon_add_ilabel_selfloop(), it yields the
+    entries in lexicon first, then the missing selfloops
+    '''
     # all input symbols
     vocab: set[str] = set()
 
     # the input symbols that already have selfloop in lexicon
     selfloop_syms = set()
 
-    max_weight = 0
-    for _, isyms, _ in lexicon:
+    max_weight = -math.inf
+    for entry in lexicon:
+        _, isyms, weight = entry
         vocab.update(isyms)
         if len(isyms) == 1:
             selfloop_syms.add(isyms[0])
+        max_weight = max(max_weight, weight)
 
-    max_weight = max(map(itemgetter(2), lexicon))
-    asl_weight = max_weight - math.log(0.1)
-    asl_lexicon: Lexicon = lexicon.copy()
+        yield entry
 
+    asl_weight = max_weight - math.log(0.1)
     isymbols = list(vocab)
     isymbols.sort()
     for symbol in isymbols:
         if symbol not in selfloop_syms:
-            asl_lexicon.append((symbol, (symbol,), asl_weight))
-
-    return asl_lexicon
+            yield (symbol, (symbol,), asl_weight)
 
 
 class SourcePosition:
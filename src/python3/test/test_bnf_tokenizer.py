@@ -58,6 +58,11 @@ class TestBNFTokenizer(unittest.TestCase):
         self.assertRaises(BNFSyntaxError, tokenizer, '<hello world> ::= "hello" "world')
         self.assertRaises(BNFSyntaxError, tokenizer, '<hello:world> ::= "hello" "world')
         self.assertRaises(BNFSyntaxError, tokenizer, 'hello> ::= "hello"')
+        self.assertRaisesRegex(BNFSyntaxError, 'expected at 2', tokenizer, '  hello ::= "hello"')
+        self.assertRaisesRegex(BNFSyntaxError, 'expected at 8', tokenizer, '<hello> := "hello"')
+
+        # weight should have a fractional part
+        self.assertRaises(BNFSyntaxError, tokenizer, '<hello> ::= "hello" ; 1')
 
 
     def test_tokenizer_macro(self):
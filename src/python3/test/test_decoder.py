@@ -1,8 +1,10 @@
 import io
+import threading
 import unittest
 
 from nnlp.decoder import FstDecoder
 from nnlp.fst import Fst
+from nnlp.lazy_fst import LazyDeterminizedFst
 
 from nnlp_tools.bnf_tokenizer import BNFTokenizer
 from nnlp_tools.rule_parser import RuleParser
@@ -79,3 +81,42 @@ class TestFstDecoder(unittest.TestCase):
 
         outputs = decoder.decode_sequence('hibar')
         self.assertListEqual(outputs, ['hi'])
+
+    def test_decoder_threads(self):
+        ''' test the decoder shared by threads, and reuse of the decode contexts '''
+
+        fst_builder = LexiconFstBuilder()
+        lexicon = [('hi', ('h', 'i'), 0), ('ha', ('h', 'a'), 0)]
+
+        mutable_fst = MutableFst()
+        fst_builder(lexicon, mutable_fst)
+        mutable_fst.add_arc(0, 0, '<unk>', '<capture>')
+
+        json_io = io.StringIO(mutable_fst.to_json())
+        fst = Fst.from_json(json_io)
+        decoder = FstDecoder(fst, pool_size=2)
+
+        inputs = ['hihaxhi' * (i % 5 + 1) for i in range(50)]
+        expected = [FstDecoder(fst).decode_sequence(input) for input in inputs]
+
+        # the lazy FST with a small cache is expanded by threads concurrently
+        lazy_decoder = FstDecoder(LazyDeterminizedFst(fst, cache_size=4))
+        for shared_decoder in (decoder, lazy_decoder):
+            outputs = [None] * 8
+            def decode(index: int) -> None:
+                outputs[index] = [shared_decoder.decode_sequence(input) for input in inputs]
+
+            threads = [threading.Thread(target=decode, args=(i, )) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for output in outputs:
+                self.assertListEqual(output, expected)
+
+        self.assertLessEqual(len(decoder._contexts), 2)
+        context = decoder._contexts[-1]
+        num_tokens = len(context.tokens)
+        self.assertListEqual(decoder.decode_sequence('hihaxhi'), expected[0])
+        self.assertIs(decoder._contexts[-1], context)
+        self.assertEqual(len(context.tokens), num_tokens)
@@ -0,0 +1,61 @@
+import gc
+import io
+import tempfile
+import unittest
+
+from os import path
+from nnlp import flat_fst
+from nnlp.decoder import FstDecoder
+from nnlp.flat_fst import FlatFst
+from nnlp.fst import Fst
+
+from .util import assert_fst_equal, make_chain_fst
+
+
+class TestFlatFst(unittest.TestCase):
+    r''' unit test class for FlatFst '''
+
+    def test_flat_fst(self):
+        ''' test MutableFst.write_binary(flat=True) and FlatFst '''
+        mutable_fst = make_chain_fst(loop_back=True)
+        f = io.BytesIO()
+        mutable_fst.write_binary(f, weight_bits=16)
+        expected = Fst.from_binary(io.BytesIO(f.getvalue()))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'fst.bin')
+            for weight_bits in (0, 16):
+                with open(filename, 'wb') as f:
+                    mutable_fst.write_binary(f, weight_bits=weight_bits, flat=True)
+
+                # flat FST could also be loaded by Fst
+                assert_fst_equal(self, Fst.from_binary(filename), expected, 301, delta=1e-3)
+
+                fst = FlatFst(filename, verify=True)
+                assert_fst_equal(self, fst, expected, 301, delta=1e-3)
+                self.assertListEqual(fst.get_arcs(0, 'unknown'), [])
+                self.assertEqual(fst.get_final_weight(300), 0.5)
+
+                inputs = ['i2', 'i1', 'i0', 'i6']
+                self.assertListEqual(
+                    FstDecoder(fst).decode_sequence(inputs),
+                    FstDecoder(expected).decode_sequence(inputs))
+                fst.close()
+
+            # not a flat FST
+            with open(filename, 'wb') as f:
+                mutable_fst.write_binary(f)
+            self.assertRaises(Exception, FlatFst, filename)
+
+    def test_preload(self):
+        ''' test flat_fst.preload and flat_fst.get_preloaded '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'fst.bin')
+            with open(filename, 'wb') as f:
+                make_chain_fst(loop_back=True).write_binary(f, flat=True)
+
+            fst = flat_fst.preload(filename)
+            self.assertIs(flat_fst.get_preloaded(filename), fst)
+            self.assertGreater(gc.get_freeze_count(), 0)
+            gc.unfreeze()
+            flat_fst._preloaded.pop(filename).close()
@@ -1,13 +1,18 @@
+import array
 import io
+import json
 import unittest
 import tempfile
+from unittest import mock
 
 from os import path
 from nnlp.fst import Fst
 from nnlp.symbol import EPS_SYM, make_disambig_symbol
+from nnlp_tools import fst_writer
+from nnlp_tools.fst_writer import quantize_weights
 from nnlp_tools.mutable_fst import MutableFst
 
-from .util import trim_text
+from .util import assert_fst_equal, make_chain_fst, trim_text
 
 
 class TestFst(unittest.TestCase):
@@ -44,3 +49,129 @@ class TestFst(unittest.TestCase):
                 'A': 1,
                 'B': 2
             })
+
+    def test_write_json(self):
+        ''' test MutableFst.write_json and Fst.verify_json '''
+        mutable_fst = MutableFst()
+        for _ in range(5):
+            state = mutable_fst.create_state()
+            mutable_fst.add_arc(state - 1, state, '中', 'A', 0.5)
+            mutable_fst.add_arc(state - 1, state, '中', 'B')
+        mutable_fst.set_final_state(state)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'fst.json')
+
+            # states are written in several batches
+            with mock.patch.object(fst_writer, '_STATES_PER_WRITE', 2):
+                with open(filename, 'w', encoding='utf-8') as f:
+                    mutable_fst.write_json(f)
+
+            with open(filename, encoding='utf-8') as f:
+                o = json.load(f)
+            self.assertSetEqual(set(o['sections']),
+                                {'graph', 'isymbol_dict', 'final_weights'})
+            o.pop('sections')
+            self.assertDictEqual(o, json.loads(mutable_fst.to_json()))
+
+            self.assertTrue(Fst.verify_json(filename))
+            fst = Fst.from_json(filename, verify=True)
+            self.assertListEqual(fst.get_arcs(0, '中'), [[1, 'A', 0.5], [1, 'B', 0.0]])
+            self.assertEqual(fst.get_final_weight(5), 0.0)
+
+            # corrupt one byte of the graph
+            with open(filename, 'r+b') as f:
+                f.seek(30)
+                f.write(b'9')
+            self.assertFalse(Fst.verify_json(filename))
+            self.assertRaises(Exception, Fst.from_json, filename, verify=True)
+
+            # no checksums
+            with open(filename, 'w', encoding='utf-8') as f:
+                mutable_fst.write_json(f, checksums=False)
+            self.assertFalse(Fst.verify_json(filename))
+
+        # offsets start from the current position of file handle
+        f = io.BytesIO(b'xx')
+        f.seek(2)
+        writer = fst_writer.SectionWriter(f)
+        writer.begin_section('data')
+        writer.write(b'abc')
+        writer.end_section()
+        self.assertListEqual(writer.sections['data'][:2], [2, 3])
+
+    def test_from_binary(self):
+        ''' test MutableFst.write_binary and Fst.from_binary '''
+        mutable_fst = make_chain_fst()
+        expected = Fst.from_json(io.StringIO(mutable_fst.to_json()))
+        for weight_bits in (0, 8, 16):
+            f = io.BytesIO()
+            mutable_fst.write_binary(f, weight_bits=weight_bits)
+            f.seek(0)
+            fst = Fst.from_binary(f, verify=True)
+            assert_fst_equal(self, fst, expected, 301, delta=0.1)
+
+        # corrupted data
+        data = bytearray(f.getvalue())
+        data[100] ^= 0xff
+        self.assertRaises(Exception, Fst.from_binary, io.BytesIO(bytes(data)), verify=True)
+        self.assertRaises(Exception, Fst.from_binary, io.BytesIO(b'not a binary fst' * 10))
+
+    def test_from_binary_compressed(self):
+        ''' test Fst.from_binary with compressed arc blocks '''
+        mutable_fst = make_chain_fst()
+        f = io.BytesIO()
+        mutable_fst.write_binary(f)
+        expected = Fst.from_binary(io.BytesIO(f.getvalue()))
+        for compression in ('zlib', 'lzma'):
+            f = io.BytesIO()
+            mutable_fst.write_binary(f, weight_bits=8, compression=compression, block_states=32)
+            fst = Fst.from_binary(io.BytesIO(f.getvalue()), verify=True, cache_blocks=2)
+            assert_fst_equal(self, fst, expected, 301, delta=0.1)
+
+            # read the blocks again after they are evicted
+            assert_fst_equal(self, fst, expected, 301, delta=0.1)
+            self.assertRaises(IndexError, fst.get_arcs, 301, 'i0')
+
+    def test_from_binary_lazy(self):
+        ''' test Fst.from_binary with sharded FST loaded lazily '''
+        mutable_fst = make_chain_fst()
+        self.assertListEqual(fst_writer.hot_states(mutable_fst.to_arrays(), 3), [0, 1, 2])
+
+        data = io.BytesIO()
+        mutable_fst.write_binary(data)
+        expected = Fst.from_binary(io.BytesIO(data.getvalue()))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'fst.bin')
+            with open(filename, 'wb') as f:
+                mutable_fst.write_binary(f, block_states=16, sharded=True, prefetch=40)
+
+            fst = Fst.from_binary(filename, verify=True, cache_blocks=1, lazy=True)
+            assert_fst_equal(self, fst, expected, 301)
+            fst.close()
+
+        self.assertRaises(Exception, Fst.from_binary, io.BytesIO(data.getvalue()), lazy=True)
+
+    def test_quantize_weights(self):
+        ''' test quantize_weights '''
+        weights = array.array('f', [0, 1, 0.5, 1, 0])
+        codes, codebook = quantize_weights(weights, 8)
+        self.assertListEqual(codes.tolist(), [0, 2, 1, 2, 0])
+        self.assertListEqual(codebook.tolist(), [0, 0.5, 1])
+
+        # skewed weights with an outlier
+        weights = array.array('f', [i * i / 1e6 for i in range(3000)] + [0, 1000])
+        codes, codebook = quantize_weights(weights, 8)
+        self.assertEqual(len(codebook), 256)
+        self.assertEqual(codebook[codes[-2]], 0)
+        self.assertEqual(codebook[codes[-1]], 1000)
+        errors = [abs(codebook[code] - weight) for code, weight in zip(codes, weights)]
+        self.assertLess(max(errors), 0.1)
+
+        weights = array.array('f', [i / 100 for i in range(1000)])
+        codes, codebook = quantize_weights(weights, 8)
+        self.assertEqual(len(codebook), 256)
+        self.assertEqual(codes[0], 0)
+        for code, weight in zip(codes[1:], weights[1:]):
+            self.assertGreater(code, 0)
+            self.assertAlmostEqual(codebook[code], weight, delta=0.02)
@@ -1,10 +1,20 @@
 import io
+import os
+import tempfile
 import unittest
+from unittest import mock
 
+from os import path
+
+from nnlp.decoder import FstDecoder
+from nnlp.fst import Fst
+
+from nnlp_tools import grammar_fst_builder
 from nnlp_tools.bnf_tokenizer import BNFTokenizer
 from nnlp_tools.grammar import Grammar
 from nnlp_tools.rule_parser import RuleParser
 from nnlp_tools.grammar_fst_builder import GrammarFstBuilder
+from nnlp_tools.lexicon_fst_builder import build_lexicon_word_fst
 from nnlp_tools.util import SourcePosition
 from nnlp_tools.mutable_fst import MutableFst
 
@@ -28,12 +38,154 @@ class TestFSTGenerator(unittest.TestCase):
         fst_builder(grammar, mutable_fst)
 
         t = '''
-            0 2 <eps> <eps>
+            0 2 h h
+            0
+            1 2 h h
             1
-            2 3 h h
-            2 1 <eps> <eps>
-            3 4 i i
-            4 2 <eps> <eps>
+            2 1 i i
             '''
         self.assertEqual(norm_textfst(t), norm_textfst(mutable_fst.to_text()))
 
+    def test_class_reuse(self):
+        r''' test each class is generated only once '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+        fst_builder = GrammarFstBuilder()
+
+        rules = parser(*tokenizer('<num> ::= "1" | "2"'), SourcePosition())
+        rules += parser(*tokenizer('<root> ::= <num> "+" <num>'), SourcePosition())
+        grammar = Grammar(rules, "root")
+
+        mutable_fst = MutableFst()
+        class_fsts = fst_builder.build_classes(grammar, mutable_fst)
+        self.assertListEqual(list(class_fsts.keys()), ['<class:num>'])
+
+        mutable_fst = MutableFst()
+        fst_builder(grammar, mutable_fst)
+        fst = Fst.from_json(io.StringIO(mutable_fst.to_json()))
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('2+1'), ['2', '+', '1'])
+
+    def test_epsilon_free(self):
+        r''' test the generated FST has no epsilon arc '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+        fst_builder = GrammarFstBuilder(minimize_classes=True)
+
+        rules = parser(*tokenizer('<num> ::= "1" | "2" | _'), SourcePosition())
+        rules += parser(*tokenizer('<root> ::= (<num> "+")* <num> "="'), SourcePosition())
+        grammar = Grammar(rules, "root")
+
+        mutable_fst = MutableFst()
+        fst_builder(grammar, mutable_fst)
+        for _, _, isym, osym, _ in mutable_fst.arcs():
+            self.assertFalse(isym == '<eps>' and osym == '<eps>')
+
+        fst = Fst.from_json(io.StringIO(mutable_fst.to_json()))
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('+2='), ['+', '2', '='])
+
+    def test_optional_class_weight(self):
+        r''' test the weight of an empty rule is kept as the final weight '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+        fst_builder = GrammarFstBuilder()
+
+        rules = parser(*tokenizer('<root> ::= "a":_ _:"P" <opt> | "a":_ _:"Q"'), SourcePosition())
+        rules += parser(*tokenizer('<opt> ::= _ ; 9.0 | "z" ; 1.0'), SourcePosition())
+        grammar = Grammar(rules, "root")
+
+        mutable_fst = MutableFst()
+        fst_builder(grammar, mutable_fst)
+        self.assertAlmostEqual(max(mutable_fst.final_states().values()), 0.105361, places=5)
+
+        decoder = FstDecoder(Fst.from_json(io.StringIO(mutable_fst.to_json())))
+        self.assertListEqual(decoder.decode_sequence('a'), ['Q'])
+        self.assertListEqual(decoder.decode_sequence('az'), ['P', 'z'])
+
+    def test_read_lexicon(self):
+        r''' test the !read_lexicon macro '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+        fst_builder = GrammarFstBuilder()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lexicon_file = path.join(tmpdir, 'names.txt')
+            with open(lexicon_file, 'w', encoding='utf-8') as f:
+                f.write('ann 0.5 a n n\nanna 0.25 a n n a\nbob 0.25 b o b\n')
+
+            rules = parser(*tokenizer(f'<root> ::= "hi" !read_lexicon("{lexicon_file}")'),
+                           SourcePosition())
+            grammar = Grammar(rules, "root")
+
+            mutable_fst = MutableFst()
+            fst_builder(grammar, mutable_fst)
+
+        fst = Fst.from_json(io.StringIO(mutable_fst.to_json()))
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('hianna'), ['h', 'i', 'anna'])
+        self.assertListEqual(decoder.decode_sequence('hiann'), ['h', 'i', 'ann'])
+        self.assertListEqual(decoder.decode_sequence('hibo'), [])
+
+    def test_cache(self):
+        r''' test only the edited classes are generated again with cache_dir '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+
+        # names of the FSTs of compiled classes
+        compiled: list[str] = []
+        generate_arcs = GrammarFstBuilder._generate_arcs
+
+        def record_generate_arcs(builder, fst, *args):
+            compiled.append(fst.name)
+            return generate_arcs(builder, fst, *args)
+
+        def build(city_rule: str, cache_dir: str, lexicon_file: str) -> list[list[str]]:
+            rules = parser(*tokenizer(city_rule), SourcePosition())
+            rules += parser(*tokenizer('<num> ::= "1" | "2"'), SourcePosition())
+            root_rule = f'<root> ::= <num> <city> | "x" !read_lexicon("{lexicon_file}")'
+            rules += parser(*tokenizer(root_rule), SourcePosition())
+            grammar = Grammar(rules, "root")
+
+            compiled.clear()
+            mutable_fst = MutableFst()
+            GrammarFstBuilder(cache_dir=cache_dir)(grammar, mutable_fst)
+            decoder = FstDecoder(Fst.from_json(io.StringIO(mutable_fst.to_json())))
+            return [decoder.decode_sequence('1ab'), decoder.decode_sequence('xann')]
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.object(GrammarFstBuilder, '_generate_arcs', record_generate_arcs), \
+                mock.patch.object(grammar_fst_builder, 'build_lexicon_word_fst',
+                                  wraps=build_lexicon_word_fst) as build_lexicon, \
+                mock.patch.object(MutableFst, 'replace', autospec=True,
+                                  side_effect=MutableFst.replace) as replace:
+            cache_dir = path.join(tmpdir, 'cache')
+            lexicon_file = path.join(tmpdir, 'names.txt')
+            with open(lexicon_file, 'w', encoding='utf-8') as f:
+                f.write('ann 0.5 a n n\nbob 0.5 b o b\n')
+
+            expected = [['1', 'a', 'b'], ['x', 'ann']]
+            self.assertListEqual(build('<city> ::= "ab" | "c"', cache_dir, lexicon_file), expected)
+            self.assertSetEqual(set(compiled), {'FST', 'num', 'city'})
+            self.assertEqual(build_lexicon.call_count, 1)
+            self.assertEqual(replace.call_count, 1)
+
+            # the whole grammar is loaded from cache
+            self.assertListEqual(build('<city> ::= "ab" | "c"', cache_dir, lexicon_file), expected)
+            self.assertListEqual(compiled, [])
+            self.assertEqual(build_lexicon.call_count, 1)
+            self.assertEqual(replace.call_count, 1)
+
+            # only the edited class is compiled, the lexicon is loaded from cache
+            self.assertListEqual(build('<city> ::= "ab" | "d"', cache_dir, lexicon_file), expected)
+            self.assertSetEqual(set(compiled), {'city'})
+            self.assertEqual(build_lexicon.call_count, 1)
+            self.assertEqual(replace.call_count, 2)
+
+            # no temporary files are left
+            self.assertFalse([name for name in os.listdir(cache_dir) if '.tmp' in name])
@@ -0,0 +1,160 @@
+import io
+import json
+import tempfile
+import unittest
+
+from os import path
+from nnlp.decoder import FstDecoder
+from nnlp.fst import Fst
+from nnlp.lazy_fst import ComposedFst, LazyDeterminizedFst, ReplaceFst
+
+from nnlp_tools.bnf_tokenizer import BNFTokenizer
+from nnlp_tools.grammar import Grammar
+from nnlp_tools.grammar_fst_builder import GrammarFstBuilder
+from nnlp_tools.mutable_fst import MutableFst
+from nnlp_tools.rule_parser import RuleParser
+from nnlp_tools.util import SourcePosition
+
+
+def _make_fst() -> Fst:
+    ''' non-deterministic FST: a b -> x, a c -> y z '''
+
+    return _make_fst_from_graph([{
+        'a': [[1, 'x', 1.0], [2, 'y', 2.0]]
+    }, {
+        'b': [[0, '<eps>', 0.0]]
+    }, {
+        'c': [[3, 'z', 0.0]]
+    }, {
+        '<eps>': [[0, '<eps>', 0.0]]
+    }])
+
+
+def _make_fst_from_graph(graph: list[dict[str, list]]) -> Fst:
+    ''' make an FST from graph with final state 0 '''
+
+    isymbol_dict = {'<eps>': 0}
+    for arcs in graph:
+        for isymbol in arcs:
+            isymbol_dict.setdefault(isymbol, len(isymbol_dict))
+
+    o = dict(version=1, graph=graph, isymbol_dict=isymbol_dict, final_weights=[[0, 0.0]])
+    return Fst.from_json(io.StringIO(json.dumps(o)))
+
+
+class TestLazyDeterminizedFst(unittest.TestCase):
+    ''' unit test class for LazyDeterminizedFst '''
+
+    def test_decode(self):
+        ''' test decoding with LazyDeterminizedFst '''
+
+        fst = LazyDeterminizedFst(_make_fst(), cache_size=2)
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('abac'), ['x', 'y', 'z'])
+        self.assertListEqual(decoder.decode_sequence('acab'), ['y', 'z', 'x'])
+        self.assertListEqual(decoder.decode_sequence('aa'), [])
+
+        # after reading "a" the state is deterministic
+        self.assertEqual(len(fst.get_arcs(0, 'a')), 1)
+        self.assertListEqual(fst.get_arcs(0, 'b'), [])
+
+    def test_cache(self):
+        ''' test save_cache() and load_cache() '''
+
+        fst = LazyDeterminizedFst(_make_fst())
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('acab'), ['y', 'z', 'x'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'cache.json')
+            fst.save_cache(filename)
+
+            warm_fst = LazyDeterminizedFst(_make_fst())
+            warm_fst.load_cache(filename)
+            self.assertListEqual(warm_fst._states, fst._states)
+            self.assertDictEqual(dict(warm_fst._arc_cache), dict(fst._arc_cache))
+
+            decoder = FstDecoder(warm_fst)
+            self.assertListEqual(decoder.decode_sequence('abac'), ['x', 'y', 'z'])
+
+            # cache of another source FST with the same symbols
+            other_fst = _make_fst_from_graph([{'a': [[0, 'x', 1.0]], 'b': [], 'c': []}])
+            self.assertEqual(other_fst.isymbol_dict, _make_fst().isymbol_dict)
+            self.assertRaises(Exception, LazyDeterminizedFst(other_fst).load_cache, filename)
+
+    def test_max_states(self):
+        ''' test the expanded states are dropped between decodes '''
+
+        fst = LazyDeterminizedFst(_make_fst(), max_states=2)
+        decoder = FstDecoder(fst)
+        for _ in range(3):
+            self.assertListEqual(decoder.decode_sequence('abacab'), ['x', 'y', 'z', 'x'])
+            self.assertGreater(len(fst._states), 2)
+            self.assertListEqual(decoder.decode_sequence('ab'), ['x'])
+            self.assertLessEqual(len(fst._states), 2)
+
+
+class TestComposedFst(unittest.TestCase):
+    ''' unit test class for ComposedFst '''
+
+    def test_decode(self):
+        ''' test decoding with ComposedFst '''
+
+        # x -> X <break>, y -> Y, z -> <eps>
+        fst_b = _make_fst_from_graph([{
+            'x': [[1, 'X', 0.0]],
+            'y': [[0, 'Y', 0.0]],
+            'z': [[0, '<eps>', 0.0]],
+        }, {
+            '<eps>': [[0, '<break>', 0.0]]
+        }])
+
+        # X -> x, Y -> y, <break> -> <break>
+        fst_c = _make_fst_from_graph([{
+            'X': [[0, 'x', 0.0]],
+            'Y': [[0, 'y', 0.0]],
+            '<break>': [[0, '<break>', 0.0]],
+        }])
+
+        decoder = FstDecoder(ComposedFst([_make_fst(), fst_b]))
+        self.assertListEqual(decoder.decode_sequence('abac'), ['X', '<break>', 'Y'])
+        self.assertListEqual(decoder.decode_sequence('acab'), ['Y', 'X', '<break>'])
+
+        decoder = FstDecoder([_make_fst(), fst_b, fst_c])
+        self.assertListEqual(decoder.decode_sequence('abac'), ['x', '<break>', 'y'])
+        self.assertListEqual(decoder.decode_sequence('ab'), ['x', '<break>'])
+
+        # the states of a lazy FST composed are also bounded, and the composition drops its states
+        # with it
+        lazy_fst = LazyDeterminizedFst(_make_fst(), max_states=2)
+        composed_fst = ComposedFst([lazy_fst, fst_b])
+        decoder = FstDecoder(composed_fst)
+        for _ in range(3):
+            self.assertListEqual(decoder.decode_sequence('abacab'),
+                                 ['X', '<break>', 'Y', 'X', '<break>'])
+            self.assertGreater(len(lazy_fst._states), 2)
+            self.assertListEqual(decoder.decode_sequence('ab'), ['X', '<break>'])
+            self.assertLessEqual(len(lazy_fst._states), 2)
+        self.assertListEqual(decoder.decode_sequence('aa'), [])
+
+
+class TestReplaceFst(unittest.TestCase):
+    ''' unit test class for ReplaceFst '''
+
+    def test_decode(self):
+        ''' test decoding the FSTs of grammar classes without flattening them '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+        rules = parser(*tokenizer('<num> ::= "1" | "2":_ _:"two"'), SourcePosition())
+        rules += parser(*tokenizer('<root> ::= (<num> "+")* <num>'), SourcePosition())
+        grammar = Grammar(rules, 'root')
+
+        mutable_fst = MutableFst()
+        class_fsts = GrammarFstBuilder().build_classes(grammar, mutable_fst)
+        fsts = {s: Fst.from_json(io.StringIO(f.to_json())) for s, f in class_fsts.items()}
+        fst = ReplaceFst(Fst.from_json(io.StringIO(mutable_fst.to_json())), fsts)
+
+        decoder = FstDecoder(fst)
+        self.assertListEqual(decoder.decode_sequence('2+1+2'), ['two', '+', '1', '+', 'two'])
+        self.assertListEqual(decoder.decode_sequence('2+'), [])
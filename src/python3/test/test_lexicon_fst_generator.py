@@ -3,7 +3,10 @@ import unittest
 import math
 import io
 
-from nnlp_tools.lexicon_fst_builder import LexiconFstBuilder
+from nnlp.fst import Fst
+from nnlp.decoder import FstDecoder
+from nnlp_tools.lexicon_fst_builder import LexiconFstBuilder, MinimalLexiconFstBuilder
+from nnlp_tools.lexicon_fst_builder import build_lexicon_word_fst, build_sharded_lexicon_fst
 from nnlp_tools.mutable_fst import MutableFst
 
 from .util import norm_textfst
@@ -64,3 +67,93 @@ class TestLexiconFstBuilder(unittest.TestCase):
             '''
 
         self.assertEqual(norm_textfst(t), norm_textfst(mutable_fst.to_text()))
+
+        # the same FST from a sorted generator
+        mutable_fst = MutableFst()
+        fst_builder.add_sorted(iter(lexicon), mutable_fst)
+        self.assertEqual(norm_textfst(t), norm_textfst(mutable_fst.to_text()))
+
+    def test_disambig_id_reuse(self):
+        r''' test the disambig ids are reused across the ambiguous sequences '''
+
+        # 3 words of 'ab', 2 of 'cd', 2 of 'e', and 'f' is a prefix of 'fg'
+        lexicon = [('ab1', ('a', 'b'), 1.0), ('ab2', ('a', 'b'), 1.0), ('ab3', ('a', 'b'), 1.0),
+                   ('cd1', ('c', 'd'), 1.0), ('cd2', ('c', 'd'), 1.0), ('e1', ('e',), 1.0),
+                   ('e2', ('e',), 1.0), ('f', ('f',), 1.0), ('fg', ('f', 'g'), 1.0)]
+
+        for build in [LexiconFstBuilder(), LexiconFstBuilder().add_sorted,
+                      MinimalLexiconFstBuilder()]:
+            mutable_fst = MutableFst()
+            build(lexicon, mutable_fst)
+
+            # only #1 ... #N are used, N is the size of the largest ambiguous set
+            disambig_symbols = {isym for _, _, isym, _, _ in mutable_fst.arcs() if isym.startswith('#')}
+            self.assertSetEqual(disambig_symbols, {'#1', '#2', '#3'})
+
+    def test_minimal_fst_generator(self):
+        r''' test the MinimalLexiconFstBuilder '''
+
+        fst_builder = MinimalLexiconFstBuilder()
+        lexicon = [('fa', ('f', 'a'), 2.0), ('fo', ('f', 'o'), 0.5),
+                   ('foo', ('f', 'o', 'o'), 0.25), ('bar', ('f', 'o', 'o'), 1.0),
+                   ('go', ('g', 'o'), 1.0)]
+
+        mutable_fst = MutableFst()
+        fst_builder(lexicon, mutable_fst)
+        t = '''
+            0 3 f <eps> 0.25
+            0 4 g go 1
+            0
+            1 0 #1 foo
+            1 0 #2 bar 0.75
+            2 0 #1 fo 0.25
+            2 1 o <eps>
+            3 0 a fa 1.75
+            3 2 o <eps>
+            4 0 o <eps>
+            '''
+
+        self.assertEqual(norm_textfst(t), norm_textfst(mutable_fst.to_text()))
+
+        # lexicon should be sorted
+        self.assertRaises(Exception, fst_builder, list(reversed(lexicon)),
+                          MutableFst())
+
+    def test_sharded_fst_generator(self):
+        r''' test build_sharded_lexicon_fst() '''
+
+        lexicon = [('hi', ('h', 'i'), 1.0), ('hello', ('h', 'e', 'l', 'l', 'o'), 0.5),
+                   ('ba', ('b', 'a'), 1.0), ('bar', ('b', 'a', 'r'), 1.0),
+                   ('a', ('a',), 2.0)]
+        for minimal in [False, True]:
+            mutable_fst = build_sharded_lexicon_fst(lexicon,
+                                                    minimal=minimal,
+                                                    num_workers=2,
+                                                    shard_size=2)
+            self.assertEqual(len(list(mutable_fst.states())), 7)
+            self.assertDictEqual(mutable_fst.final_states(), {0: 0.0})
+
+            fst = Fst.from_json(io.StringIO(mutable_fst.rmdisambig().to_json()))
+            decoder = FstDecoder(fst)
+            self.assertListEqual(decoder.decode_sequence('bahia'), ['ba', 'hi', 'a'])
+
+    def test_word_fst_generator(self):
+        r''' test build_lexicon_word_fst() '''
+
+        lexicon = [('ab', ('a', 'b'), 1.0), ('ab2', ('a', 'b'), 2.0), ('a', ('a',), 1.0),
+                   ('abc', ('a', 'b', 'c'), 1.0), ('bc', ('b', 'c'), 1.0), ('bd', ('b', 'd'), 1.0)]
+        mutable_fst = build_lexicon_word_fst(lexicon)
+        for _, _, isym, _, _ in mutable_fst.arcs():
+            self.assertNotEqual(isym, '<eps>')
+            self.assertFalse(isym.startswith('#'))
+
+        # the entries share their prefixes, only the last arcs of 'a', 'ab' and 'ab2' are separated
+        self.assertListEqual(sorted(arc[2] for arc in mutable_fst.arcs()),
+                             ['a', 'a', 'b', 'b', 'b', 'b', 'c', 'c', 'd'])
+
+        decoder = FstDecoder(Fst.from_json(io.StringIO(mutable_fst.to_json())))
+        self.assertListEqual(decoder.decode_sequence('ab'), ['ab'])
+        self.assertListEqual(decoder.decode_sequence('a'), ['a'])
+        self.assertListEqual(decoder.decode_sequence('bd'), ['bd'])
+        self.assertListEqual(decoder.decode_sequence('abc'), ['abc'])
+        self.assertListEqual(decoder.decode_sequence('abd'), [])
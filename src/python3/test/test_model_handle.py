@@ -0,0 +1,91 @@
+import gc
+import os
+import tempfile
+import time
+import unittest
+import weakref
+
+from os import path
+from unittest import mock
+from nnlp.converter import Converter
+from nnlp.fst import Fst
+from nnlp.model_handle import ModelHandle
+from nnlp_tools.mutable_fst import MutableFst
+
+
+def _write_fst(filename: str, osymbol: str) -> None:
+    ''' write the FST converting a to osymbol, by renaming a temporary file '''
+
+    mutable_fst = MutableFst()
+    mutable_fst.add_arc(0, 0, 'a', osymbol)
+    mutable_fst.set_final_state(0)
+    with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        mutable_fst.write_json(f)
+    os.replace(filename + '.tmp', filename)
+
+
+class TestModelHandle(unittest.TestCase):
+    r''' unit test class for ModelHandle '''
+
+    def test_swap(self):
+        ''' test ModelHandle.acquire and ModelHandle.swap '''
+        released = []
+        fst_1, fst_2, fst_3 = Fst(), Fst(), Fst()
+        handle = ModelHandle(fst_1, on_release=released.append)
+
+        with handle.acquire() as fst:
+            self.assertIs(fst, fst_1)
+            self.assertIs(handle.swap(fst_2), fst_1)
+            self.assertIs(handle.fst, fst_2)
+
+            # in-flight user keeps the old model
+            self.assertListEqual(released, [])
+        self.assertListEqual(released, [fst_1])
+
+        # no users
+        handle.swap(fst_3)
+        self.assertListEqual(released, [fst_1, fst_2])
+
+        # the old model is closed by default
+        fst_4 = Fst()
+        handle = ModelHandle(fst_4)
+        with mock.patch.object(fst_4, 'close') as close:
+            handle.swap(Fst())
+            close.assert_called_once_with()
+
+    def test_reload(self):
+        ''' test ModelHandle.reload_if_changed and ModelHandle.watch with Converter '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'fst.json')
+            _write_fst(filename, 'x')
+            handle = ModelHandle(Fst.from_json(filename))
+            converter = Converter(handle)
+            self.assertEqual(converter.convert_string('aa'), 'xx')
+
+            # the swapped-out model is not kept by the decoder of converter
+            old_fst = weakref.ref(handle.fst)
+            self.assertTrue(handle.reload_if_changed(filename, Fst.from_json))
+            gc.collect()
+            self.assertIsNone(old_fst())
+            self.assertFalse(handle.reload_if_changed(filename, Fst.from_json))
+
+            # keep current model if failed to load
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('{"version":')
+            self.assertFalse(handle.reload_if_changed(filename, Fst.from_json))
+            self.assertIsNotNone(handle.reload_error)
+            self.assertEqual(converter.convert_string('aa'), 'xx')
+
+            _write_fst(filename, 'y')
+            self.assertTrue(handle.reload_if_changed(filename, Fst.from_json))
+            self.assertIsNone(handle.reload_error)
+            self.assertEqual(converter.convert_string('aa'), 'yy')
+
+            handle.watch(filename, Fst.from_json, interval=0.01)
+            _write_fst(filename, 'z')
+            for _ in range(500):
+                if converter.convert_string('a') == 'z':
+                    break
+                time.sleep(0.01)
+            handle.stop_watching()
+            self.assertEqual(converter.convert_string('aa'), 'zz')
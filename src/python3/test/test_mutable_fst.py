@@ -1,11 +1,17 @@
+import array
 import io
 import tempfile
 import unittest
+from unittest import mock
 import json
+import math
 
 from os import path
 
+from nnlp.decoder import FstDecoder
+from nnlp.fst import Fst
 from nnlp.symbol import EPS_SYM, make_disambig_symbol
+from nnlp_tools.fst_arrays import _iterate_vector_fst
 from nnlp_tools.mutable_fst import MutableFst, SymbolTable
 
 from .util import norm_textfst
@@ -60,6 +66,261 @@ class TestMutableFst(unittest.TestCase):
         state_1 = mutable_fst.create_state()
         self.assertRaises(Exception, mutable_fst.add_arc, 0, state_1, 'hi', 'hi')
 
+    def test_add_arcs(self):
+        ''' test adding arcs in batch '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arcs([0, state_1], array.array('i', [state_1, state_2]),
+                             ['h', 'i'], ('hi', EPS_SYM),
+                             array.array('f', [0.5, 0]))
+        mutable_fst.set_final_state(state_2)
+
+        # integer symbols are symbol-ids
+        h_id = mutable_fst._isymbols.get_id('h')
+        mutable_fst.add_arcs([state_2], [0], [h_id], ['hi'])
+
+        t = '''
+            0 1 h hi 0.5
+            1 2 i <eps>
+            2 0 h hi
+            2
+            '''
+        self.assertEqual(norm_textfst(t), norm_textfst(mutable_fst.to_text()))
+
+        self.assertRaises(Exception, mutable_fst.add_arcs, [0], [1, 2], ['h'],
+                          ['h'])
+        self.assertRaises(Exception, mutable_fst.add_arcs, [0], [1], [''],
+                          ['h'])
+        self.assertRaises(Exception, mutable_fst.add_arcs, [0], [1], [100],
+                          ['h'])
+
+    def test_import_arcs(self):
+        ''' test adding arcs in batch by rebuilding the graph '''
+
+        def build(min_import_arcs: int, dest_states: list[int]) -> MutableFst:
+            with mock.patch('nnlp_tools.mutable_fst._MIN_IMPORT_ARCS',
+                            min_import_arcs):
+                mutable_fst = MutableFst()
+                for _ in range(3):
+                    mutable_fst.create_state()
+                mutable_fst.add_arc(1, 2, 'a', 'b', 0.5)
+                mutable_fst.set_final_state(2, 1.5)
+
+                # unsorted source states and repeated symbols
+                mutable_fst.add_arcs([2, 0, 1, 0], dest_states,
+                                     ['c', 'a', 'a', 'c'],
+                                     ['d', EPS_SYM, 'b', 'd'], [0.25, 0, 1, 2])
+                return mutable_fst
+
+        imported_fst = build(1, [0, 1, 1, 2])
+        self.assertEqual(imported_fst.to_text(),
+                         build(1000, [0, 1, 1, 2]).to_text())
+        self.assertListEqual(
+            [arc[1] for arc in imported_fst.arcs() if arc[0] == 0], [1, 2])
+
+        self.assertRaises(Exception, build, 1, [0, 1, 1, 4])
+
+    def test_to_arrays(self):
+        ''' test exporting FST as columns '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'h', 'hi', 0.5)
+        mutable_fst.add_arc(0, state_2, 'i', EPS_SYM)
+        mutable_fst.add_arc(state_1, state_2, EPS_SYM, EPS_SYM, 1)
+        mutable_fst.set_final_state(state_2, 0.25)
+
+        arrays = mutable_fst.to_arrays()
+        self.assertEqual(arrays.num_states, 3)
+        self.assertEqual(arrays.num_arcs, 3)
+        self.assertListEqual(arrays.src_states.tolist(), [0, 0, 1])
+        self.assertListEqual(arrays.dest_states.tolist(), [1, 2, 2])
+        self.assertListEqual([arrays.isymbols[i] for i in arrays.ilabels],
+                             ['h', 'i', EPS_SYM])
+        self.assertListEqual([arrays.osymbols[i] for i in arrays.olabels],
+                             ['hi', EPS_SYM, EPS_SYM])
+        self.assertListEqual(arrays.weights.tolist(), [0.5, 0, 1])
+        self.assertDictEqual(arrays.final_states(), {2: 0.25})
+
+        # the same as iterating the arcs
+        columns = _iterate_vector_fst(mutable_fst._fst)
+        self.assertListEqual([c.tolist() for c in columns], [
+            arrays.src_states.tolist(),
+            arrays.ilabels.tolist(),
+            arrays.olabels.tolist(),
+            arrays.weights.tolist(),
+            arrays.dest_states.tolist(),
+            arrays.final_weights.tolist(),
+        ])
+
+        # cached until the FST is changed
+        self.assertIs(mutable_fst.to_arrays(), arrays)
+        mutable_fst.add_arc(state_2, state_2, 'h', 'hi', 0.1)
+        arrays = mutable_fst.to_arrays()
+        self.assertEqual(arrays.num_arcs, 4)
+
+        # float32 weights are rounded
+        self.assertEqual(list(arrays.arcs())[-1], (2, 2, 1, 1, 0.1))
+        mutable_fst.set_final_state(state_1, 0.1)
+        self.assertDictEqual(mutable_fst.to_arrays().final_states(), {
+            1: 0.1,
+            2: 0.25
+        })
+
+    def test_inplace(self):
+        ''' test the transforms with inplace=True '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'x')
+        mutable_fst.add_arc(0, state_2, 'a', 'x')
+        mutable_fst.add_arc(state_1, state_1, make_disambig_symbol(1), EPS_SYM)
+        mutable_fst.set_final_state(state_1)
+        mutable_fst.set_final_state(state_2)
+        text = mutable_fst.to_text()
+
+        # the input is not changed without inplace
+        fst = mutable_fst.determinize().rmdisambig().minimize()
+        self.assertEqual(mutable_fst.to_text(), text)
+        self.assertEqual(fst.name, 'min(rds(det(FST)))')
+
+        fst_inplace = mutable_fst.determinize(inplace=True)
+        self.assertIs(fst_inplace, mutable_fst)
+        fst_inplace = fst_inplace.rmdisambig(inplace=True)
+        fst_inplace = fst_inplace.minimize(inplace=True)
+        self.assertIs(fst_inplace, mutable_fst)
+        self.assertEqual(fst_inplace.name, fst.name)
+        self.assertEqual(norm_textfst(fst_inplace.to_text()),
+                         norm_textfst(fst.to_text()))
+
+    def test_copy_on_write_symbol_table(self):
+        ''' test the copy of SymbolTable '''
+
+        symbol_table = SymbolTable()
+        symbol_table.add_symbol('a')
+        symbol_copy = symbol_table.copy()
+        self.assertIs(symbol_copy._symbol_table, symbol_table._symbol_table)
+
+        symbol_copy.add_symbol('b')
+        symbol_table.add_symbol('c')
+        self.assertListEqual(list(symbol_copy), [(0, EPS_SYM), (1, 'a'),
+                                                 (2, 'b')])
+        self.assertListEqual(list(symbol_table), [(0, EPS_SYM), (1, 'a'),
+                                                  (2, 'c')])
+        self.assertEqual(symbol_copy.get_id('b'), 2)
+        self.assertEqual(symbol_table.get_id('c'), 2)
+        self.assertRaises(KeyError, symbol_table.get_id, 'b')
+
+    def test_final_states(self):
+        ''' test the tracked final states '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'a')
+        mutable_fst.add_arc(0, state_2, EPS_SYM, EPS_SYM)
+        mutable_fst.set_final_state(state_1, 0.5)
+        mutable_fst.set_final_state(state_2)
+        mutable_fst.set_final_state(state_2, math.inf)
+        self.assertDictEqual(mutable_fst.final_states(), {state_1: 0.5})
+
+        # collected from graph after rmepsilon
+        mutable_fst.set_final_state(state_2, 0.25)
+        mutable_fst.rmepsilon()
+        self.assertDictEqual(mutable_fst.final_states(), {
+            0: 0.25,
+            state_1: 0.5
+        })
+
+        mutable_fst.set_final_state(0, 1)
+        self.assertDictEqual(mutable_fst.final_states(), {
+            0: 1,
+            state_1: 0.5
+        })
+
+    def test_optimize_for_decoding(self):
+        ''' test optimize_for_decoding '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        state_3 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'x', 1)
+        mutable_fst.add_arc(state_1, state_2, EPS_SYM, EPS_SYM, 2)
+        mutable_fst.add_arc(state_2, 0, 'b', 'y')
+        mutable_fst.add_arc(0, state_3, 'c', 'z')  # not coaccessible
+        mutable_fst.set_final_state(0)
+
+        fst = mutable_fst.optimize_for_decoding()
+        self.assertEqual(fst.name, 'opt(FST)')
+        self.assertEqual(mutable_fst.num_arcs(), 4)
+
+        t = '''
+            0 1 a x 3
+            0
+            1 0 b y
+            '''
+        self.assertEqual(norm_textfst(t), norm_textfst(fst.to_text()))
+        self.assertListEqual(list(fst._isymbols), [(0, EPS_SYM), (1, 'a'),
+                                                   (2, 'b')])
+        self.assertListEqual(list(fst._osymbols), [(0, EPS_SYM), (1, 'x'),
+                                                   (2, 'y')])
+        self.assertDictEqual(fst.final_states(), {0: 0})
+
+        # the start state is on a cycle, and its weights are pushed
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'x', 1)
+        mutable_fst.add_arc(state_1, 0, 'b', 'y', 1)
+        mutable_fst.add_arc(0, state_2, 'c', 'z', 2)
+        mutable_fst.set_final_state(state_2, 1)
+
+        fst = mutable_fst.optimize_for_decoding()
+        t = '''
+            0 2 c z 3
+            0 1 a x 5
+            1 3 b y
+            2
+            3 2 c z
+            3 1 a x 2
+            '''
+        self.assertEqual(norm_textfst(t), norm_textfst(fst.to_text()))
+
+        # final weights decide the best path, before and after pushing
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        state_2 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'x', 1)
+        mutable_fst.add_arc(0, state_2, 'a', 'y', 2)
+        mutable_fst.set_final_state(state_1, 5)
+        mutable_fst.set_final_state(state_2, 0)
+        for fst in [mutable_fst, mutable_fst.optimize_for_decoding()]:
+            decoder = FstDecoder(Fst.from_json(io.StringIO(fst.to_json())))
+            self.assertListEqual(decoder.decode_sequence(['a']), ['y'])
+
+    def test_prune(self):
+        ''' test prune '''
+
+        mutable_fst = MutableFst()
+        state_1 = mutable_fst.create_state()
+        mutable_fst.add_arc(0, state_1, 'a', 'a', 1)
+        mutable_fst.add_arc(0, state_1, 'b', 'b', 5)
+        mutable_fst.set_final_state(state_1)
+
+        fst = mutable_fst.prune(weight=2)
+        self.assertEqual(mutable_fst.num_arcs(), 2)
+        t = '''
+            0 1 a a 1
+            1
+            '''
+        self.assertEqual(norm_textfst(t), norm_textfst(fst.to_text()))
+        self.assertEqual(mutable_fst.prune(weight=4).num_arcs(), 2)
+
     def test_to_json(self):
         ''' test to_json method of FST '''
         mutable_fst = MutableFst()
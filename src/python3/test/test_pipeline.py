@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from os import path
+from nnlp_tools.lexicon_fst_builder import build_lexicon_fst
+from nnlp_tools.mutable_fst import MutableFst
+from nnlp_tools.pipeline import Pipeline, Stage
+from nnlp_tools.util import read_lexicon
+
+
+class TestPipeline(unittest.TestCase):
+    ''' unit test class for Pipeline '''
+
+    def test_pipeline(self):
+        ''' test the pipeline resumes from the cached stages '''
+
+        calls: list[str] = []
+
+        def build_lexicon(filename: str) -> MutableFst:
+            calls.append('L')
+            return build_lexicon_fst(read_lexicon(filename, False))
+
+        def determinize(fst: MutableFst) -> MutableFst:
+            calls.append('det')
+            return fst.determinize()
+
+        def minimize(fst: MutableFst, allow_nondet: bool) -> MutableFst:
+            calls.append('min')
+            return fst.rmdisambig().minimize(allow_nondet=allow_nondet)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lexicon_file = path.join(tmpdir, 'lexicon.txt')
+            with open(lexicon_file, 'w', encoding='utf-8') as f:
+                f.write('ab 0.5 a b\nac 0.5 a c\n')
+
+            def run(allow_nondet: bool, minimize=minimize, version: str = '') -> str:
+                cache_dir = path.join(tmpdir, 'cache')
+                fst = Pipeline([
+                    Stage('L', build_lexicon, [lexicon_file], filename=lexicon_file),
+                    Stage('det', determinize),
+                    Stage('min', minimize, version=version, allow_nondet=allow_nondet),
+                ], cache_dir).run()
+                return fst.to_text()
+
+            text = run(False)
+            self.assertListEqual(calls, ['L', 'det', 'min'])
+            self.assertEqual(run(False), text)
+            self.assertListEqual(calls, ['L', 'det', 'min'])
+
+            run(True)
+            self.assertListEqual(calls, ['L', 'det', 'min', 'min'])
+
+            with open(lexicon_file, 'a', encoding='utf-8') as f:
+                f.write('b 0.5 b\n')
+            run(True)
+            self.assertListEqual(calls, ['L', 'det', 'min', 'min', 'L', 'det', 'min'])
+
+            # the code of stage function changed
+            def minimize_v2(fst: MutableFst, allow_nondet: bool) -> MutableFst:
+                calls.append('min2')
+                return fst.rmdisambig().minimize(allow_nondet=allow_nondet)
+
+            minimize_v2.__qualname__ = minimize.__qualname__
+            calls.clear()
+            run(True, minimize_v2)
+            self.assertListEqual(calls, ['min2'])
+            run(True, minimize_v2)
+            self.assertListEqual(calls, ['min2'])
+
+            # the version of stage changed
+            run(True, minimize_v2, version='2')
+            self.assertListEqual(calls, ['min2', 'min2'])
+
+            # the source of nnlp_tools changed
+            with mock.patch('nnlp_tools.pipeline._get_package_hash', return_value='changed'):
+                run(True, minimize_v2, version='2')
+            self.assertListEqual(calls, ['min2', 'min2', 'L', 'det', 'min2'])
@@ -84,4 +84,20 @@ class TestRuleParser(unittest.TestCase):
         rule_set = set()
         rule_set.add(rule_0)
         rule_set.add(rule_1)
-        self.assertEqual(len(rule_set), 1)
\ No newline at end of file
+        self.assertEqual(len(rule_set), 1)
+
+    def test_sub_rule_order(self):
+        r''' test the tokens after a sub rule keep their order '''
+
+        tokenizer = BNFTokenizer()
+        parser = RuleParser()
+
+        rules = parser(*tokenizer('<hi> ::= ("hi" | "hello") "world" ("a")("b")'), SourcePosition())
+        self.assertEqual(
+            rules[-1],
+            Rule('hi', [
+                BNFToken(BNFToken.CLASS, 'hi_00'),
+                BNFToken(BNFToken.SYMBOL, 'world'),
+                BNFToken(BNFToken.CLASS, 'hi_01'),
+                BNFToken(BNFToken.CLASS, 'hi_02')
+            ]))
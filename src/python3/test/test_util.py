@@ -1,7 +1,13 @@
+import io
 import unittest
 import math
+import tempfile
 
-from nnlp_tools.util import lexicon_add_ilabel_selfloop
+from os import path
+from nnlp.fst import Fst
+from nnlp_tools.evaluate import evaluate_agreement
+from nnlp_tools.lexicon_fst_builder import build_lexicon_fst
+from nnlp_tools.util import iter_lexicon, lexicon_add_ilabel_selfloop, prune_lexicon, sort_lexicon
 
 
 class TestToolsUtil(unittest.TestCase):
@@ -24,3 +30,75 @@ class TestToolsUtil(unittest.TestCase):
             ('r', ('r',), -math.log(0.1)),
             ('t', ('t',), -math.log(0.1)),
         ])
+
+    def test_iter_lexicon(self):
+        ''' test iter_lexicon() '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'lexicon.txt')
+            with open(filename, 'w', encoding='utf-8') as f:
+                for i in range(100):
+                    f.write(f'w{i} 0.5 w {i}\n')
+
+            lexicon = list(iter_lexicon(filename, True, batch_size=7))
+            self.assertEqual(len(lexicon), 100)
+            self.assertEqual(lexicon[42], ('w42', ['w', '42'], -math.log(0.5)))
+            self.assertListEqual(
+                list(iter_lexicon(filename, True, num_workers=2, batch_size=7)),
+                lexicon)
+
+    def test_sort_lexicon(self):
+        ''' test sort_lexicon() '''
+        lexicon = [
+            ('foo', ['f', 'o', 'o'], 1.0),
+            ('fo', ['f', 'o'], 2.0),
+            ('bar', ('f', 'o', 'o'), 3.0),
+            ('foo', ('f', 'o', 'o'), 0.5),
+            ('a', ('a',), 0.0),
+        ]
+        expected = [
+            ('a', ('a',), 0.0),
+            ('fo', ('f', 'o'), 2.0),
+            ('bar', ('f', 'o', 'o'), 3.0),
+            ('foo', ('f', 'o', 'o'), 0.5),
+        ]
+        self.assertListEqual(list(sort_lexicon(lexicon)), expected)
+        self.assertListEqual(
+            list(sort_lexicon(lexicon, max_entries_in_memory=2)), expected)
+
+    def test_prune_lexicon(self):
+        ''' test prune_lexicon() '''
+        lexicon = [
+            ('a', ('a',), 9),
+            ('ab', ('a', 'b'), 3),
+            ('bc', ('b', 'c'), 1),
+            ('b', ('b',), 9),
+            ('cd', ('c', 'd'), 3),
+            ('de', ('d', 'e'), 8),
+        ]
+        self.assertListEqual(list(prune_lexicon(lexicon)), lexicon)
+        self.assertListEqual(list(prune_lexicon(lexicon, max_weight=3)), lexicon[:5])
+        self.assertListEqual(list(prune_lexicon(lexicon, top_n=2)),
+                             [lexicon[0], lexicon[3], lexicon[1], lexicon[2]])
+        self.assertListEqual(list(prune_lexicon(lexicon, max_weight=2, top_n=2)),
+                             [lexicon[0], lexicon[3], lexicon[2]])
+        self.assertListEqual(list(prune_lexicon(lexicon, top_n=0)), [lexicon[0], lexicon[3]])
+
+    def test_evaluate_agreement(self):
+        ''' test evaluate_agreement() with the pruned lexicon '''
+        lexicon = [
+            ('a', ('a',), 2),
+            ('b', ('b',), 2),
+            ('c', ('c',), 2),
+            ('ab', ('a', 'b'), 1),
+        ]
+        reference = build_lexicon_fst(lexicon).rmdisambig()
+        pruned = build_lexicon_fst(prune_lexicon(lexicon, top_n=0)).rmdisambig()
+
+        agreement = evaluate_agreement(Fst.from_json(io.StringIO(reference.to_json())),
+                                       Fst.from_json(io.StringIO(pruned.to_json())),
+                                       ['abc', 'ca'])
+        self.assertEqual(agreement.num_sentences, 2)
+        self.assertEqual(agreement.num_agreed_sentences, 1)
+        self.assertEqual(agreement.num_symbols, 4)
+        self.assertEqual(agreement.num_agreed_symbols, 3)
+        self.assertEqual(agreement.sentence_agreement, 0.5)
@@ -1,6 +1,13 @@
 ''' utility for testing '''
 from __future__ import annotations
 
+import math
+import unittest
+
+from nnlp.fst import Fst
+from nnlp.symbol import EPS_SYM
+from nnlp_tools.mutable_fst import MutableFst
+
 
 def trim_text(text: str) -> str:
     ''' removing leading space in text'''
@@ -18,3 +25,51 @@ def norm_textfst(text: str) -> str:
         lines = lines[1:]
 
     return '\n'.join(lines)
+
+
+def make_chain_fst(loop_back: bool = False) -> MutableFst:
+    ''' FST of a chain of 301 states, each state has an arc and an epsilon arc
+    to the next state. The input labels are repeated every 7 states and not
+    sorted. When loop_back is true, each state also has an arc back to state 0
+    with the same input label as the arc to next state '''
+
+    mutable_fst = MutableFst()
+    for i in range(300):
+        state = mutable_fst.create_state()
+        isymbol = f'i{(300 - i) % 7}'
+        mutable_fst.add_arc(state - 1, state, isymbol, f'o{i}', i / 10)
+        mutable_fst.add_arc(state - 1, state, EPS_SYM, EPS_SYM)
+        if loop_back:
+            mutable_fst.add_arc(state - 1, 0, isymbol, f'p{i}', 1)
+    mutable_fst.set_final_state(state, 0.5)
+    return mutable_fst
+
+
+def assert_fst_equal(test: unittest.TestCase,
+                     fst: Fst,
+                     expected: Fst,
+                     num_states: int,
+                     delta: float = 0) -> None:
+    ''' check that fst has the same arcs and final weights as expected for
+    the first num_states states. The weights differ by at most delta, and the
+    zero weights are the same '''
+
+    test.assertDictEqual(fst.isymbol_dict, expected.isymbol_dict)
+    for state in range(num_states):
+        for isymbol in expected.isymbol_dict:
+            arcs = fst.get_arcs(state, isymbol)
+            expected_arcs = expected.get_arcs(state, isymbol)
+            test.assertListEqual([tuple(arc[:2]) for arc in arcs],
+                                 [tuple(arc[:2]) for arc in expected_arcs])
+            for arc, expected_arc in zip(arcs, expected_arcs):
+                test.assertAlmostEqual(arc[2], expected_arc[2], delta=delta)
+                if expected_arc[2] == 0:
+                    test.assertEqual(arc[2], 0)
+
+        final_weight = fst.get_final_weight(state)
+        expected_final_weight = expected.get_final_weight(state)
+        if math.isnan(expected_final_weight):
+            test.assertTrue(math.isnan(final_weight))
+        else:
+            test.assertAlmostEqual(final_weight, expected_final_weight,
+                                   delta=delta)